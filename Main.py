@@ -1,7 +1,6 @@
 import plotly.express as px
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
+from data_access import load_data_from_db, load_rollup
 import streamlit_shadcn_ui as ui
 
 # Set Streamlit page configuration
@@ -13,15 +12,6 @@ st.set_page_config(
 )
 
 
-# Create a function to load data from the SQLite database
-def load_data_from_db(query):
-    sqlite_file = 'test.sqlite'
-    engine = create_engine(f'sqlite:///{sqlite_file}')
-    df = pd.read_sql(query, engine)
-    return df
-
-
-
 # # Fetch data from SQLite based on user selection from dropdown
 # dropdown_options = {
 #     '---': None,
@@ -114,11 +104,8 @@ def load_data_from_db(query):
 query = 'SELECT * FROM aggregated_insurence_state;'
 df = load_data_from_db(query)
 
-# Aggregate data by summing quarter amounts and transactions per year
-agg_df = df.groupby(["state", "year"]).agg({
-    "number_of_transactions": "sum",
-    "total_amount": "sum"
-}).reset_index()
+# Quarter amounts and transactions summed per state and year by the ingest
+agg_df = load_rollup('aggregated_insurence_state', 'state_year')
 
 
 # Display metrics in two columns
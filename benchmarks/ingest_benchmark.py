@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from sqlalchemy import create_engine
+from benchmarks.synthetic_data import SCALES, generate_synthetic_tree
+from extraction.extraction import (scan_ingested_files, process_data, stream_data,
+                                   bulk_load_data, refresh_data)
+from extraction.parquet_dataset import write_parquet_dataset
+
+# Ingest benchmarks over synthetic PhonePe pulse trees. Run from the repository root:
+#   python -m benchmarks.ingest_benchmark --scales 1 10 --output results.json
+#   python -m benchmarks.ingest_benchmark --scales 1 --baseline results.json
+# Each (scale, mode) run happens in its own Python process so that the peak
+# RSS of one mode does not leak into the next. The results are written as
+# JSON, tagged with the git commit, to compare them between commits.
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def ingest_engine(output_directory):
+    return create_engine(f"sqlite:///{os.path.join(output_directory, 'test.sqlite')}",
+                         connect_args={'timeout': 60})
+
+
+# Every mode ingests data_directory into output_directory and returns the number of rows written
+def report_path(output_directory):
+    return os.path.join(output_directory, 'ingest_report.json')
+
+
+def run_process(data_directory, output_directory, workers):
+    tables = process_data(data_directory, ingest_engine(output_directory), workers=1,
+                          report_path=report_path(output_directory))
+    return sum(tables.values()) if tables else None
+
+
+def run_parallel(data_directory, output_directory, workers):
+    tables = process_data(data_directory, ingest_engine(output_directory), workers=workers,
+                          report_path=report_path(output_directory))
+    return sum(tables.values()) if tables else None
+
+
+def run_stream(data_directory, output_directory, workers):
+    return stream_data(data_directory, ingest_engine(output_directory), workers=1)
+
+
+def run_stream_parallel(data_directory, output_directory, workers):
+    return stream_data(data_directory, ingest_engine(output_directory), workers=workers)
+
+
+def run_bulk(data_directory, output_directory, workers):
+    tables = bulk_load_data(data_directory, ingest_engine(output_directory), workers=workers)
+    return sum(tables.values()) if tables else None
+
+
+def run_refresh(data_directory, output_directory, workers):
+    # A first refresh into an empty database: every file counts as changed
+    summary = refresh_data(data_directory, ingest_engine(output_directory), workers=workers)
+    return summary['rows_written'] if summary else None
+
+
+def run_parquet(data_directory, output_directory, workers):
+    tables = write_parquet_dataset(data_directory, os.path.join(output_directory, 'parquet'), workers=workers)
+    return sum(tables.values()) if tables else None
+
+
+MODES = {
+    'process': run_process,
+    'parallel': run_parallel,
+    'stream': run_stream,
+    'stream_parallel': run_stream_parallel,
+    'bulk': run_bulk,
+    'refresh': run_refresh,
+    'parquet': run_parquet,
+}
+
+
+def peak_rss_mb():
+    # Largest resident set of this process or of any finished child process
+    # (the extraction pool workers). ru_maxrss is in KiB on Linux, bytes on macOS.
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_mode(mode, data_directory, output_directory, workers):
+    # Runs inside the benchmark subprocess: time one ingest into a fresh output directory
+    shutil.rmtree(output_directory, ignore_errors=True)
+    os.makedirs(output_directory)
+
+    start = time.perf_counter()
+    file_count = len(scan_ingested_files(data_directory))
+    rows = MODES[mode](data_directory, output_directory, workers)
+    wall_seconds = time.perf_counter() - start
+
+    # The modes built on process_data also report where the time went
+    stages = None
+    if os.path.exists(report_path(output_directory)):
+        with open(report_path(output_directory)) as report_file:
+            stages = json.load(report_file)['stages']
+
+    return {
+        'files': file_count,
+        'rows': rows,
+        'wall_seconds': round(wall_seconds, 4),
+        'files_per_second': round(file_count / wall_seconds, 1),
+        'rows_per_second': round(rows / wall_seconds, 1) if rows else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'stages': stages,
+        'ok': rows is not None,
+    }
+
+
+def run_mode_in_subprocess(mode, data_directory, output_directory, workers):
+    command = [sys.executable, '-m', 'benchmarks.ingest_benchmark', '--run-one', mode,
+               '--data-directory', data_directory, '--output-directory', output_directory,
+               '--workers', str(workers)]
+    completed = subprocess.run(command, cwd=REPO_DIRECTORY, capture_output=True, text=True)
+
+    # The ingest functions print their own summaries; the result is the last line
+    output_lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not output_lines:
+        print(f"Failed to run the {mode} benchmark: {completed.stderr.strip()[-500:]}")
+        return {'ok': False}
+    try:
+        return json.loads(output_lines[-1])
+    except ValueError as e:
+        print(f"Failed to read the {mode} benchmark result: {e}")
+        return {'ok': False}
+
+
+def prepare_tree(work_directory, scale, workers):
+    # Generate the synthetic tree of a scale once and reuse it on later runs
+    data_directory = os.path.join(work_directory, f'scale-{scale}', 'data')
+    marker_path = os.path.join(data_directory, '.complete')
+    if os.path.exists(marker_path):
+        return data_directory
+
+    shutil.rmtree(data_directory, ignore_errors=True)
+    start = time.perf_counter()
+    file_count = generate_synthetic_tree(data_directory, scale, workers)
+    with open(marker_path, 'w') as marker:
+        marker.write(str(file_count))
+    print(f"Generated {file_count} files at {scale}x in {time.perf_counter() - start:.1f}s")
+    return data_directory
+
+
+def git_commit():
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIRECTORY,
+                                   capture_output=True, text=True)
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+def compare_with_baseline(results, baseline_path):
+    # Print the wall time speedup of every (scale, mode) also present in the baseline
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    baseline_runs = {(run['scale'], run['mode']): run for run in baseline['runs'] if run.get('ok')}
+
+    print(f"Compared with {baseline.get('commit')}:")
+    for run in results['runs']:
+        baseline_run = baseline_runs.get((run['scale'], run['mode']))
+        if run.get('ok') and baseline_run:
+            speedup = baseline_run['wall_seconds'] / run['wall_seconds']
+            print(f"  {run['scale']:>4}x {run['mode']:<16} {baseline_run['wall_seconds']:>9.2f}s -> "
+                  f"{run['wall_seconds']:>9.2f}s  ({speedup:.2f}x)")
+
+
+def print_results(results):
+    print(f"{'scale':>6} {'mode':<16} {'files':>8} {'rows':>10} {'wall s':>9} "
+          f"{'files/s':>10} {'rows/s':>12} {'peak MB':>9}")
+    for run in results['runs']:
+        if not run.get('ok'):
+            print(f"{run['scale']:>5}x {run['mode']:<16} failed")
+            continue
+        print(f"{run['scale']:>5}x {run['mode']:<16} {run['files']:>8} {run['rows']:>10} "
+              f"{run['wall_seconds']:>9.2f} {run['files_per_second']:>10.0f} "
+              f"{run['rows_per_second']:>12.0f} {run['peak_rss_mb']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ingest modes on synthetic PhonePe pulse trees')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10], choices=sorted(SCALES),
+                        help='tree sizes relative to the real data/ tree (100 is about 800k files)')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=1, help='runs per (scale, mode)')
+    parser.add_argument('--work-directory', default=os.path.join(tempfile.gettempdir(), 'pulse-benchmarks'),
+                        help='where the synthetic trees and databases are kept between runs')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare with')
+    # Used by the benchmark itself to run one mode in a fresh process
+    parser.add_argument('--run-one', choices=list(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--data-directory', help=argparse.SUPPRESS)
+    parser.add_argument('--output-directory', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_mode(args.run_one, args.data_directory, args.output_directory, args.workers)))
+        return
+
+    results = {
+        'commit': git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'runs': [],
+    }
+
+    for scale in args.scales:
+        data_directory = prepare_tree(args.work_directory, scale, args.workers)
+        output_directory = os.path.join(args.work_directory, f'scale-{scale}', 'output')
+        for mode in args.modes:
+            for repetition in range(args.repeat):
+                run = run_mode_in_subprocess(mode, data_directory, output_directory, args.workers)
+                results['runs'].append({'scale': scale, 'mode': mode, 'repetition': repetition, **run})
+        shutil.rmtree(output_directory, ignore_errors=True)
+
+    print_results(results)
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Wrote the results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime, timezone
+from sqlalchemy import create_engine
+import data_access
+from data_access import (load_table, load_filtered, load_rollup, set_query_backend, clear_result_cache,
+                         dispose_engine, close_duckdb)
+from semantic_layer import load_measures
+from benchmarks.synthetic_data import SCALES
+from benchmarks.ingest_benchmark import prepare_tree, git_commit
+from extraction.extraction import bulk_load_data
+from extraction.parquet_dataset import write_parquet_dataset
+
+# Page query benchmarks: the reads the pages make, run on every query
+# backend of data_access against the same synthetic data. Run from the
+# repository root:
+#   python -m benchmarks.query_benchmark --scales 1 10 --output queries.json
+# Every pass starts with an empty result cache, so each query reaches the
+# backend once per pass (the dimension lookups are cached within a pass).
+
+# Backend name -> (data_access query backend, DuckDB source)
+BACKENDS = {
+    'sqlite': ('sqlite', None),
+    'duckdb': ('duckdb', 'parquet'),
+}
+
+# (page, what it reads), in page order
+PAGE_WORKLOAD = [
+    ('visual: fact table', lambda: load_table('aggregated_insurence_state')),
+    ('visual: state_year rollup', lambda: load_rollup('aggregated_insurence_state', 'state_year')),
+    ('visual: state rollup', lambda: load_rollup('aggregated_insurence_state', 'state')),
+    ('plotting: filtered rows', lambda: load_filtered('aggregated_transaction_state',
+                                                      {'year': [2022], 'quarter': [1, 2, 3, 4],
+                                                       'state': ['Karnataka']})),
+    ('plotting: brands by year', lambda: load_measures('aggregated_user_counry',
+                                                       ['latest(phone_count)', 'latest(Percentage)'],
+                                                       ['year', 'phone_brand'])),
+    ('mapping: fact table', lambda: load_table('map_transaction_hover_state')),
+    ('mapping: totals by state', lambda: load_measures('map_transaction_hover_state',
+                                                       ['sum(total_transactions_amount)',
+                                                        'sum(total_transactions_count)'],
+                                                       ['state'], {'year': [2022], 'quarter': [1, 2]})),
+    ('top charts: totals by entity', lambda: load_measures('top_transaction_state', ['sum(amount)', 'sum(count)'],
+                                                           ['entity_name'], {'entity_type': ['districts']})),
+    ('dash board: fact table', lambda: load_table('top_user_state')),
+    ('dash board: totals', lambda: load_measures('top_transaction_country', ['sum(amount)', 'sum(count)'])),
+]
+
+
+def prepare_query_data(work_directory, scale, workers):
+    # The database and Parquet export of a scale, built once and reused
+    data_directory = prepare_tree(work_directory, scale, workers)
+    query_directory = os.path.join(work_directory, f'scale-{scale}', 'query')
+    marker_path = os.path.join(query_directory, '.complete')
+    if os.path.exists(marker_path):
+        return query_directory
+
+    os.makedirs(query_directory, exist_ok=True)
+    database_path = os.path.join(query_directory, data_access.DATABASE_FILE)
+    if os.path.exists(database_path):
+        os.remove(database_path)
+    engine = create_engine(f'sqlite:///{database_path}')
+    bulk_load_data(data_directory, engine, workers=workers)
+    write_parquet_dataset(data_directory, os.path.join(query_directory, data_access.PARQUET_DIRECTORY), workers=workers,
+                          engine=engine)
+    with open(marker_path, 'w') as marker:
+        marker.write('ok')
+    return query_directory
+
+
+def run_backend(backend, repeat):
+    # Seconds of every workload query over repeat passes, and of each pass,
+    # or None when the backend is not installed
+    query_backend, duckdb_source = BACKENDS[backend]
+    if set_query_backend(query_backend, duckdb_source) != query_backend:
+        return None
+    query_seconds = {name: [] for name, load in PAGE_WORKLOAD}
+    pass_seconds = []
+
+    for repetition in range(repeat):
+        clear_result_cache()
+        pass_start = time.perf_counter()
+        for name, load in PAGE_WORKLOAD:
+            start = time.perf_counter()
+            load()
+            query_seconds[name].append(time.perf_counter() - start)
+        pass_seconds.append(time.perf_counter() - pass_start)
+
+    return {
+        'pass_seconds': round(statistics.median(pass_seconds), 4),
+        'queries': {name: round(statistics.median(seconds), 4) for name, seconds in query_seconds.items()},
+    }
+
+
+def print_results(results):
+    for run in results['runs']:
+        print(f"{run['scale']}x {run['backend']}: {run['pass_seconds']:.3f}s per pass")
+        for name, seconds in run['queries'].items():
+            print(f"    {name:<32} {seconds * 1000:>9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the page queries on every query backend')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1], choices=sorted(SCALES))
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--repeat', type=int, default=5, help='passes over the workload per backend')
+    parser.add_argument('--work-directory', default=os.path.join(tempfile.gettempdir(), 'pulse-benchmarks'),
+                        help='where the synthetic trees, databases and exports are kept between runs')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    args = parser.parse_args()
+
+    results = {
+        'commit': git_commit(),
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': args.repeat,
+        'runs': [],
+    }
+
+    # data_access opens its files relative to the working directory, like the pages
+    output_path = os.path.abspath(args.output) if args.output else None
+    start_directory = os.getcwd()
+    for scale in args.scales:
+        query_directory = prepare_query_data(args.work_directory, scale, args.workers)
+        os.chdir(query_directory)
+        try:
+            for backend in args.backends:
+                run = run_backend(backend, args.repeat)
+                if run is not None:
+                    results['runs'].append({'scale': scale, 'backend': backend, **run})
+        finally:
+            dispose_engine()
+            close_duckdb()
+            os.chdir(start_directory)
+
+    print_results(results)
+    if output_path:
+        with open(output_path, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Wrote the results to {output_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import os
+import json
+import random
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+# Synthetic PhonePe pulse trees for the ingest benchmarks. The files follow the
+# layout and JSON schemas of the real data/ tree:
+#   <data_type>/<subfolder>[/hover]/country/india[/state/<state>]/<year>/<quarter>.json
+# Every value is drawn from a generator seeded with the file path, so a tree is
+# the same every time it is generated.
+
+# The real tree: 36 states and union territories, published from 2018 to 2023
+STATES = [
+    'andaman-&-nicobar-islands', 'andhra-pradesh', 'arunachal-pradesh', 'assam', 'bihar',
+    'chandigarh', 'chhattisgarh', 'dadra-&-nagar-haveli-&-daman-&-diu', 'delhi', 'goa',
+    'gujarat', 'haryana', 'himachal-pradesh', 'jammu-&-kashmir', 'jharkhand', 'karnataka',
+    'kerala', 'ladakh', 'lakshadweep', 'madhya-pradesh', 'maharashtra', 'manipur',
+    'meghalaya', 'mizoram', 'nagaland', 'odisha', 'puducherry', 'punjab', 'rajasthan',
+    'sikkim', 'tamil-nadu', 'telangana', 'tripura', 'uttar-pradesh', 'uttarakhand', 'west-bengal',
+]
+FIRST_YEAR = 2018
+YEARS = 6
+QUARTERS = (1, 2, 3, 4)
+
+TRANSACTION_TYPES = ['Recharge & bill payments', 'Peer-to-peer payments', 'Merchant payments',
+                     'Financial Services', 'Others']
+PHONE_BRANDS = ['Xiaomi', 'Samsung', 'Vivo', 'Oppo', 'Realme', 'Apple', 'Motorola', 'OnePlus',
+                'Huawei', 'Tecno', 'Gionee', 'Infinix', 'Asus', 'Lava', 'Lenovo', 'Micromax',
+                'COOLPAD', 'HMD Global', 'Lyf', 'Others']
+TOP_ENTITIES = 10
+
+# Scale factors relative to the real tree: the number of states and years
+# multiply the file count, the number of districts multiplies the rows per file
+SCALES = {
+    1: {'states': 1, 'years': 1, 'districts': 1},
+    10: {'states': 5, 'years': 2, 'districts': 2},
+    100: {'states': 25, 'years': 4, 'districts': 4},
+}
+
+DATASETS = [(data_type, subfolder) for data_type in ('aggregated', 'map', 'top')
+            for subfolder in ('insurance', 'transaction', 'user')]
+
+
+def scale_states(scale):
+    # The real states first, then numbered copies of them for the larger scales
+    states = list(STATES)
+    for copy_number in range(2, SCALES[scale]['states'] + 1):
+        states.extend(f'{state}-{copy_number}' for state in STATES)
+    return states
+
+
+def scale_years(scale):
+    return list(range(FIRST_YEAR, FIRST_YEAR + YEARS * SCALES[scale]['years']))
+
+
+def state_display_name(state):
+    # The name the country-level files use for a state, e.g. 'tamil nadu'
+    return state.replace('-', ' ')
+
+
+def state_districts(state, scale):
+    district_count = random.Random(f'districts/{state}').randint(2, 38) * SCALES[scale]['districts']
+    return [f'{state_display_name(state)} district {number}' for number in range(1, district_count + 1)]
+
+
+def quarter_timestamps(year, quarter):
+    start = datetime(year, quarter * 3 - 2, 1, tzinfo=timezone.utc)
+    end = datetime(year + 1, 1, 1, tzinfo=timezone.utc) if quarter == 4 else \
+        datetime(year, quarter * 3 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000) - 1
+
+
+def response(data):
+    return {'success': True, 'code': 'SUCCESS', 'data': data, 'responseTimestamp': 1692611156795}
+
+
+def metric(rng, scale_of_count):
+    count = rng.randint(1, scale_of_count)
+    return {'type': 'TOTAL', 'count': count, 'amount': round(count * rng.uniform(50, 5000), 6)}
+
+
+def aggregated_file(subfolder, rng, year, quarter, size):
+    if subfolder == 'user':
+        registered_users = rng.randint(10000, 1000000) * size
+        # Like the real tree, the device breakdown stops being published in 2022
+        users_by_device = None
+        if (year - FIRST_YEAR) % YEARS < 4:
+            shares = [rng.random() for brand in PHONE_BRANDS]
+            users_by_device = [{'brand': brand, 'count': int(registered_users * share / sum(shares)),
+                                'percentage': share / sum(shares)}
+                               for brand, share in zip(PHONE_BRANDS, shares)]
+        return response({'aggregated': {'registeredUsers': registered_users,
+                                        'appOpens': registered_users * rng.randint(0, 60)},
+                         'usersByDevice': users_by_device})
+
+    names = ['Insurance'] if subfolder == 'insurance' else TRANSACTION_TYPES
+    from_timestamp, to_timestamp = quarter_timestamps(year, quarter)
+    return response({'from': from_timestamp, 'to': to_timestamp,
+                     'transactionData': [{'name': name, 'paymentInstruments': [metric(rng, 100000 * size)]}
+                                         for name in names]})
+
+
+def map_file(subfolder, rng, regions, size):
+    if subfolder == 'user':
+        hover_data = {}
+        for region in regions:
+            registered_users = rng.randint(1000, 100000) * size
+            hover_data[region] = {'registeredUsers': registered_users,
+                                  'appOpens': registered_users * rng.randint(0, 60)}
+        return response({'hoverData': hover_data})
+
+    return response({'hoverDataList': [{'name': region, 'metric': [metric(rng, 10000 * size)]}
+                                       for region in regions]})
+
+
+def top_file(subfolder, rng, states, districts, size):
+    pincodes = [str(rng.randint(110001, 855126)) for number in range(TOP_ENTITIES)]
+
+    def entities(names):
+        if names is None:
+            return None
+        if subfolder == 'user':
+            return [{'name': name, 'registeredUsers': rng.randint(1000, 100000) * size} for name in names]
+        return [{'entityName': name, 'metric': metric(rng, 10000 * size)} for name in names]
+
+    return response({'states': entities(states), 'districts': entities(districts), 'pincodes': entities(pincodes)})
+
+
+def write_json(file_path, data):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as file:
+        json.dump(data, file, separators=(',', ':'))
+
+
+def generate_region_files(output_directory, state, scale):
+    # Write every quarter file of one region: the India-level files when
+    # state is None, the files of one state otherwise. Returns the file count.
+    states = scale_states(scale)
+    regions = [state_display_name(name) for name in states] if state is None else state_districts(state, scale)
+    size = len(states) if state is None else 1
+    file_count = 0
+
+    for data_type, subfolder in DATASETS:
+        region_path = os.path.join(output_directory, data_type, subfolder)
+        if data_type == 'map':
+            region_path = os.path.join(region_path, 'hover')
+        region_path = os.path.join(region_path, 'country', 'india')
+        if state is not None:
+            region_path = os.path.join(region_path, 'state', state)
+
+        for year in scale_years(scale):
+            for quarter in QUARTERS:
+                rng = random.Random(f'{data_type}/{subfolder}/{state}/{year}/{quarter}')
+                if data_type == 'aggregated':
+                    data = aggregated_file(subfolder, rng, year, quarter, size)
+                elif data_type == 'map':
+                    data = map_file(subfolder, rng, regions, size)
+                else:
+                    # The state files have no 'states' list
+                    if state is None:
+                        top_states = rng.sample(regions, min(TOP_ENTITIES, len(regions)))
+                        top_districts = [f'{region} district 1' for region in top_states]
+                    else:
+                        top_states, top_districts = None, regions[:TOP_ENTITIES]
+                    data = top_file(subfolder, rng, top_states, top_districts, size)
+
+                write_json(os.path.join(region_path, str(year), f'{quarter}.json'), data)
+                file_count += 1
+
+    return file_count
+
+
+def generate_synthetic_tree(output_directory, scale=1, workers=1):
+    # Write a synthetic data/ tree at one of the SCALES into output_directory
+    # and return the number of files written
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale {scale}, expected one of {sorted(SCALES)}")
+
+    regions = [None] + scale_states(scale)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            file_counts = executor.map(generate_region_files, [output_directory] * len(regions),
+                                       regions, [scale] * len(regions))
+            return sum(file_counts)
+
+    return sum(generate_region_files(output_directory, state, scale) for state in regions)
@@ -0,0 +1,561 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import pandas as pd
+from pandas.api.types import is_integer_dtype, is_object_dtype, is_string_dtype
+from sqlalchemy import create_engine, event, text
+from extraction.manifest import read_data_version
+from extraction.rollups import ROLLUP_GRAINS, ROLLUP_MEASURES, rollup_table_name
+from extraction.hierarchies import hierarchy_path_name, hierarchy_table_name
+from extraction.dimensions import DIMENSION_COLUMNS, dimension_table_name
+from extraction.geography import GEOGRAPHY_TABLE, STATE_GEOGRAPHY
+from extraction.schema import table_dtypes
+from extraction.parquet_dataset import (parquet_dataset_exists, read_parquet_dataset, parquet_partition_values,
+                                        parquet_column_names, parquet_data_version, stamp_database_version)
+
+# Shared data access for Main.py and the pages. Streamlit reruns a page
+# script on every interaction, but this module is imported once per server
+# process, so every session and rerun reuses the same engine and its pool.
+#
+# The queries run on one of the QUERY_BACKENDS: 'sqlite', the database the
+# ingest writes (the default), or 'duckdb', an in-process columnar engine
+# reading the Parquet export or the CSV snapshot directly (duckdb_backend).
+# Choose one with set_query_backend, or before starting Streamlit with the
+# PULSE_QUERY_BACKEND and PULSE_DUCKDB_SOURCE environment variables. Without
+# the duckdb package the pages stay on SQLite.
+
+# SQLite database written by extraction.extraction
+DATABASE_FILE = 'test.sqlite'
+
+# Parquet snapshot written by extraction.parquet_dataset.write_parquet_dataset,
+# read instead of SQLite while it was exported at the database's data version,
+# and the DuckDB backend's default source
+PARQUET_DIRECTORY = 'pulse_parquet'
+
+# CSV snapshot of the tables, one of the DuckDB backend's sources
+CSV_DIRECTORY = 'phonepe_extracted data'
+
+QUERY_BACKEND = os.environ.get('PULSE_QUERY_BACKEND', 'sqlite')
+DUCKDB_SOURCE = os.environ.get('PULSE_DUCKDB_SOURCE', 'parquet')
+
+# Connections kept open for concurrent sessions, and how many more may be
+# opened under load before a session waits for a free one
+POOL_SIZE = 8
+MAX_OVERFLOW = 8
+
+# Prepared statements kept per connection by the sqlite3 driver, so repeated
+# page queries skip parsing and planning
+CACHED_STATEMENTS = 256
+
+# Query results are cached until the next ingest, in least recently used
+# order, up to this many bytes of DataFrame memory
+RESULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# How often the data version is read back from the database; results
+# cached under an older version are dropped as soon as it changes
+DATA_VERSION_CHECK_SECONDS = 1.0
+
+_engine = None
+_engine_lock = threading.Lock()
+
+_backend_state = {'name': QUERY_BACKEND, 'duckdb_source': DUCKDB_SOURCE, 'duckdb': None, 'duckdb_version': None}
+
+_result_cache = OrderedDict()  # key -> (DataFrame, bytes)
+_result_cache_lock = threading.Lock()
+_result_cache_state = {'bytes': 0, 'max_bytes': RESULT_CACHE_BYTES, 'version': None, 'checked': 0.0,
+                       'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+def configure_read_connection(dbapi_connection, connection_record):
+    # Per connection settings: refuse writes, and give the page cache and
+    # memory map enough room to keep the tables in memory between reruns
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA query_only = ON')
+    cursor.execute('PRAGMA cache_size = -32000')
+    cursor.execute('PRAGMA mmap_size = 268435456')
+    cursor.execute('PRAGMA temp_store = MEMORY')
+    cursor.close()
+
+
+def get_engine():
+    # The process-wide read-only engine, created on first use. The database
+    # is opened with mode=ro so a page can never lock out the ingest.
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = create_engine(
+                    f'sqlite:///file:{DATABASE_FILE}?mode=ro&uri=true',
+                    pool_size=POOL_SIZE,
+                    max_overflow=MAX_OVERFLOW,
+                    pool_pre_ping=True,
+                    connect_args={'check_same_thread': False, 'cached_statements': CACHED_STATEMENTS},
+                )
+                event.listen(engine, 'connect', configure_read_connection)
+                _engine = engine
+    return _engine
+
+
+def dispose_engine():
+    # Close the pooled connections, e.g. after the database file was replaced
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def duckdb_directory():
+    return PARQUET_DIRECTORY if _backend_state['duckdb_source'] == 'parquet' else CSV_DIRECTORY
+
+
+def get_duckdb():
+    # The process-wide DuckDB database, created on first use and recreated
+    # when its source changed, so the views pick up new tables
+    import duckdb_backend
+
+    version = duckdb_backend.duckdb_data_version(_backend_state['duckdb_source'], duckdb_directory())
+    with _engine_lock:
+        if _backend_state['duckdb'] is None or version != _backend_state['duckdb_version']:
+            if _backend_state['duckdb'] is not None:
+                _backend_state['duckdb'].close()
+            _backend_state['duckdb'] = duckdb_backend.open_duckdb(_backend_state['duckdb_source'], duckdb_directory())
+            _backend_state['duckdb_version'] = version
+        return _backend_state['duckdb']
+
+
+def close_duckdb():
+    with _engine_lock:
+        if _backend_state['duckdb'] is not None:
+            _backend_state['duckdb'].close()
+            _backend_state['duckdb'] = None
+
+
+# ***************************************Result cache*******************************
+
+def normalize_query(query):
+    # Collapse whitespace outside of string literals and drop the trailing
+    # semicolon, so formatting differences do not miss the cache
+    parts = re.split(r"""('(?:[^']|'')*'|"[^"]*")""", query.strip().rstrip(';'))
+    return ''.join(part if index % 2 else ' '.join(part.split()) for index, part in enumerate(parts)).strip()
+
+
+def freeze_params(params):
+    # Hashable form of the query parameters, lists included
+    if not params:
+        return ()
+    return tuple(sorted((name, tuple(value) if isinstance(value, (list, tuple, set)) else value)
+                        for name, value in params.items()))
+
+
+def current_data_version():
+    # The query backend's data version, read at most every DATA_VERSION_CHECK_SECONDS
+    now = time.monotonic()
+    if _result_cache_state['version'] is not None and \
+            now - _result_cache_state['checked'] < DATA_VERSION_CHECK_SECONDS:
+        return _result_cache_state['version']
+
+    version = QUERY_BACKENDS[_backend_state['name']]['data_version']()
+
+    with _result_cache_lock:
+        if version != _result_cache_state['version']:
+            if _result_cache:
+                _result_cache_state['invalidations'] += 1
+            _result_cache.clear()
+            _result_cache_state['bytes'] = 0
+            _result_cache_state['version'] = version
+        _result_cache_state['checked'] = now
+    return version
+
+
+def cache_get(key):
+    with _result_cache_lock:
+        entry = _result_cache.get(key)
+        if entry is None:
+            _result_cache_state['misses'] += 1
+            return None
+        _result_cache.move_to_end(key)
+        _result_cache_state['hits'] += 1
+    # Pages modify the frames they get; the copy-on-write of pandas 3 (required
+    # in requirements.txt) keeps the cached one intact
+    return entry[0].copy(deep=False)
+
+
+def cache_put(key, df):
+    size = int(df.memory_usage(index=True, deep=True).sum())
+    with _result_cache_lock:
+        if size > _result_cache_state['max_bytes'] or key[0] != _result_cache_state['version']:
+            return
+        previous = _result_cache.pop(key, None)
+        if previous is not None:
+            _result_cache_state['bytes'] -= previous[1]
+        _result_cache[key] = (df, size)
+        _result_cache_state['bytes'] += size
+        while _result_cache_state['bytes'] > _result_cache_state['max_bytes']:
+            evicted_key, (evicted_df, evicted_size) = _result_cache.popitem(last=False)
+            _result_cache_state['bytes'] -= evicted_size
+            _result_cache_state['evictions'] += 1
+
+
+def cached_result(key, load):
+    # Result of load() for key under the current data version, loaded on a miss
+    key = (current_data_version(),) + key
+    df = cache_get(key)
+    if df is None:
+        df = load()
+        cache_put(key, df)
+        df = df.copy(deep=False)
+    return df
+
+
+def set_result_cache_size(max_bytes):
+    with _result_cache_lock:
+        _result_cache_state['max_bytes'] = max_bytes
+        while _result_cache and _result_cache_state['bytes'] > max_bytes:
+            evicted_key, (evicted_df, evicted_size) = _result_cache.popitem(last=False)
+            _result_cache_state['bytes'] -= evicted_size
+            _result_cache_state['evictions'] += 1
+
+
+def clear_result_cache():
+    with _result_cache_lock:
+        _result_cache.clear()
+        _result_cache_state['bytes'] = 0
+
+
+def result_cache_stats():
+    with _result_cache_lock:
+        lookups = _result_cache_state['hits'] + _result_cache_state['misses']
+        return {
+            'entries': len(_result_cache),
+            'bytes': _result_cache_state['bytes'],
+            'max_bytes': _result_cache_state['max_bytes'],
+            'hits': _result_cache_state['hits'],
+            'misses': _result_cache_state['misses'],
+            'hit_rate': _result_cache_state['hits'] / lookups if lookups else None,
+            'evictions': _result_cache_state['evictions'],
+            'invalidations': _result_cache_state['invalidations'],
+            'data_version': _result_cache_state['version'],
+        }
+
+
+# ***************************************Query backends*******************************
+# Each backend runs the same SQL (':name' parameters, double-quoted
+# identifiers) and has a data version that changes when its data does.
+
+def read_sqlite_query(query, params=None):
+    with get_engine().connect() as connection:
+        return pd.read_sql(text(query), connection, params=params)
+
+
+def sqlite_data_version():
+    # (database version, parquet export stamp)
+    with get_engine().connect() as connection:
+        return read_data_version(connection), parquet_data_version(PARQUET_DIRECTORY)
+
+
+def read_duckdb_query(query, params=None):
+    import duckdb_backend
+    return duckdb_backend.read_duckdb_query(get_duckdb(), query, params)
+
+
+def duckdb_data_version():
+    import duckdb_backend
+    source = _backend_state['duckdb_source']
+    return 'duckdb', source, duckdb_backend.duckdb_data_version(source, duckdb_directory())
+
+
+QUERY_BACKENDS = {
+    'sqlite': {'read': read_sqlite_query, 'data_version': sqlite_data_version},
+    'duckdb': {'read': read_duckdb_query, 'data_version': duckdb_data_version},
+}
+
+
+def available_query_backend(name):
+    # name, or 'sqlite' when name is 'duckdb' and the duckdb package is not installed
+    if name == 'duckdb':
+        try:
+            import duckdb_backend
+        except ImportError as e:
+            print(f"The DuckDB query backend needs the duckdb package (pip install duckdb): {e}. "
+                  f"Falling back to SQLite.")
+            return 'sqlite'
+    return name
+
+
+def set_query_backend(name, duckdb_source=None):
+    # Switch every page to another backend ('sqlite' or 'duckdb'; DuckDB
+    # reads duckdb_source, 'parquet' or 'csv'). Cached results are dropped.
+    # Returns the backend now in use.
+    if name not in QUERY_BACKENDS:
+        raise ValueError(f"Unknown query backend {name}, expected one of {sorted(QUERY_BACKENDS)}")
+    name = available_query_backend(name)
+    close_duckdb()
+    with _result_cache_lock:
+        _backend_state['name'] = name
+        if duckdb_source is not None:
+            _backend_state['duckdb_source'] = duckdb_source
+        _result_cache.clear()
+        _result_cache_state['bytes'] = 0
+        _result_cache_state['version'] = None
+    return name
+
+
+# The backend chosen by PULSE_QUERY_BACKEND, if it can be loaded
+_backend_state['name'] = available_query_backend(_backend_state['name'])
+
+
+def reads_parquet_directly(table_name):
+    # The SQLite backend reads a table from the Parquet export with pyarrow
+    # when the export has it and was taken at the database's data version,
+    # so the fact tables never disagree with the rollups, dimension and
+    # hierarchy tables read from SQLite. DuckDB queries the export itself.
+    if _backend_state['name'] != 'sqlite' or not parquet_dataset_exists(PARQUET_DIRECTORY, table_name):
+        return False
+    database_version, parquet_stamp = current_data_version()
+    return stamp_database_version(parquet_stamp) == database_version
+
+
+# ***************************************Queries*******************************
+
+def read_query(query, params=None):
+    return QUERY_BACKENDS[_backend_state['name']]['read'](query, params)
+
+
+def load_data_from_db(query, params=None):
+    # Run a query on a pooled connection, or return its cached result when the
+    # data has not changed since. Pass values as params (':name' placeholders)
+    # so the statement text stays the same and the compiled and prepared
+    # statements are reused.
+    return cached_result(('sql', normalize_query(query), freeze_params(params)),
+                         lambda: read_query(query, params))
+
+
+# ***************************************Filters*******************************
+# A filter spec maps column names to the selected values, e.g.
+#   {'year': [2022], 'quarter': [1, 2], 'state': ['Karnataka']}
+# A column left out or set to None is not filtered; an empty selection
+# matches no rows, like an empty multiselect filtering a DataFrame.
+
+def sql_value(value):
+    # numpy scalars from DataFrame columns as plain Python values for the driver
+    return value.item() if hasattr(value, 'item') else value
+
+
+def compile_filter_conditions(filters=None):
+    # WHERE clause (empty without conditions) with one parameterized
+    # IN (...) condition per filtered column, and its params
+    conditions = []
+    params = {}
+
+    for column, values in (filters or {}).items():
+        if values is None:
+            continue
+        if isinstance(values, (str, int, float)):
+            values = [values]
+        values = list(values)
+        if not values:
+            conditions.append('0 = 1')
+            continue
+        names = [f'{column}_{index}' for index in range(len(values))]
+        conditions.append(f'"{column}" IN ({", ".join(":" + name for name in names)})')
+        params.update(zip(names, map(sql_value, values)))
+
+    where_clause = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    return where_clause, params
+
+
+def compile_filter_query(table_name, filters=None, columns=None):
+    # SELECT of the rows matching a filter spec.
+    # Returns (query, params) for load_data_from_db.
+    select_list = ', '.join(f'"{column}"' for column in columns) if columns else '*'
+    where_clause, params = compile_filter_conditions(filters)
+    return f'SELECT {select_list} FROM {table_name}{where_clause}', params
+
+
+def freeze_filters(filters):
+    return tuple(sorted((column, None if values is None else tuple(sorted(map(sql_value, values))))
+                        for column, values in (filters or {}).items()))
+
+
+# ***************************************Compact frames*******************************
+# The loaded frames are typed from the declared table schemas: dimension
+# columns as pd.Categorical over their dimension table, year and quarter in
+# the smallest integer types, so cached and per-session frames take a
+# fraction of the memory, and isin, groupby and unique work on integer codes.
+# Columns without a declared type (rollups' row_count, ad hoc queries) are
+# typed from their values the same way.
+
+def load_dimension_categories(column):
+    # Values of a dimension in key order, or None for a database built
+    # before the dimension tables existed
+    try:
+        return load_data_from_db(f'SELECT value FROM {dimension_table_name(column)} ORDER BY id')['value']
+    except Exception:
+        return None
+
+
+def dimension_categorical(column, values):
+    categories = load_dimension_categories(column)
+    if categories is not None:
+        categorical = pd.Categorical(values, categories=categories)
+        # A value missing from the dimension table would silently become NaN
+        if not ((categorical.codes == -1) & values.notna().to_numpy()).any():
+            return categorical
+    return values.astype('category')
+
+
+def compact_frame(df, dtypes=None):
+    # dtypes: {column: declared dtype}, e.g. table_dtypes(table_name)
+    dtypes = dtypes or {}
+    for column in df.columns:
+        values = df[column]
+        dtype = dtypes.get(column)
+        if dtype is None:
+            if column in DIMENSION_COLUMNS and (is_object_dtype(values) or is_string_dtype(values)):
+                dtype = 'category'
+            elif is_integer_dtype(values):
+                df[column] = pd.to_numeric(values, downcast='integer')
+                continue
+            else:
+                continue
+        df[column] = dimension_categorical(column, values) if dtype == 'category' else values.astype(dtype)
+    return df
+
+
+def load_filtered(table_name, filters=None, columns=None, dtypes=None):
+    # Rows of a table matching a filter spec, as a compact frame typed from
+    # the table's declared schema unless dtypes are given. The selection is
+    # applied by SQLite through the composite indexes, or by partition and
+    # row group pruning when the Parquet snapshot exists.
+    if dtypes is None:
+        dtypes = table_dtypes(table_name)
+    filters = {column: [values] if isinstance(values, (str, int, float)) else values
+               for column, values in (filters or {}).items()}
+    if reads_parquet_directly(table_name):
+        other_filters = {column: values for column, values in filters.items() if column not in ('year', 'quarter')}
+        key = ('parquet', table_name, freeze_filters(filters), tuple(columns) if columns else None,
+               tuple(sorted(dtypes.items())))
+        return cached_result(key, lambda: compact_frame(read_parquet_dataset(
+            PARQUET_DIRECTORY, table_name, columns=columns, years=filters.get('year'),
+            quarters=filters.get('quarter'), filters=other_filters), dtypes))
+
+    query, params = compile_filter_query(table_name, filters, columns)
+    return cached_result(('sql', normalize_query(query), freeze_params(params), tuple(sorted(dtypes.items()))),
+                         lambda: compact_frame(read_query(query, params), dtypes))
+
+
+def load_table(table_name, years=None, quarters=None):
+    # The whole table, or only the selected years and quarters
+    return load_filtered(table_name, {'year': years, 'quarter': quarters})
+
+
+def load_rollup(table_name, grain, filters=None, columns=None):
+    # A fact table pre-aggregated at one of the ROLLUP_GRAINS by the ingest,
+    # e.g. load_rollup('aggregated_insurence_state', 'state_year'). By default
+    # the grain columns and the summed measures, without row_count. Typed
+    # like the fact table's columns.
+    if columns is None:
+        columns = ROLLUP_GRAINS[grain] + ROLLUP_MEASURES[table_name]
+    return load_filtered(rollup_table_name(table_name, grain), filters, columns, table_dtypes(table_name))
+
+
+def load_hierarchy(table_name, path, filters=None):
+    # (nodes, branchvalues) of a fact table's hierarchy along path, from the
+    # node table the ingest builds (extraction.hierarchies). Unfiltered, every
+    # node carries its total ('total'). Filtered, only the matching leaves
+    # and their ancestors are kept, and only the leaves carry values, for
+    # the chart to sum ('remainder'). None when no node table has the path,
+    # or the filters select on a column outside it.
+    path_name = hierarchy_path_name(path)
+    if path_name is None or table_name not in ROLLUP_MEASURES:
+        return None
+
+    leaf_filters = {}
+    for column, values in (filters or {}).items():
+        if values is None:
+            continue
+        values = [values] if isinstance(values, (str, int, float)) else list(values)
+        if column in path:
+            leaf_filters[column] = values
+        elif column not in load_table_columns(table_name):
+            return None
+        elif not set(load_distinct_values(table_name, column)) <= set(values):
+            # Selecting every value of a column is no filter at all
+            return None
+
+    try:
+        nodes = load_filtered(hierarchy_table_name(table_name, path_name))
+    except Exception as e:
+        print(f"Failed to load the {path_name} hierarchy of {table_name}: {e}")
+        return None
+    if not leaf_filters:
+        return nodes, 'total'
+
+    keep = nodes['depth'] == len(path)
+    for column, values in leaf_filters.items():
+        keep &= nodes[column].isin(values)
+    parent_ids = set(nodes.loc[keep, 'parent'])
+    for depth in range(len(path) - 1, 0, -1):
+        ancestors = (nodes['depth'] == depth) & nodes['id'].isin(parent_ids)
+        keep |= ancestors
+        parent_ids = set(nodes.loc[ancestors, 'parent'])
+
+    nodes = nodes[keep].copy()
+    nodes.loc[nodes['depth'] < len(path), ROLLUP_MEASURES[table_name]] = 0
+    return nodes, 'remainder'
+
+
+def load_table_columns(table_name):
+    # Column names of a table, without reading any row
+    if reads_parquet_directly(table_name):
+        return parquet_column_names(PARQUET_DIRECTORY, table_name)
+    return list(load_data_from_db(f'SELECT * FROM {table_name} LIMIT 0').columns)
+
+
+def table_exists(table_name):
+    # Whether the backend has the table: a database imported from the CSV
+    # snapshot without the JSON tree lacks the state top tables
+    try:
+        load_table_columns(table_name)
+        return True
+    except Exception:
+        return False
+
+
+def load_distinct_values(table_name, column):
+    # Sorted values of one column, for the options of a filter widget
+    if reads_parquet_directly(table_name):
+        df = load_filtered(table_name, columns=[column])
+        return sorted(df[column].dropna().unique())
+    df = load_data_from_db(f'SELECT DISTINCT "{column}" FROM {table_name} ORDER BY "{column}"')
+    return list(df[column].dropna())
+
+
+def load_year_quarter_options(table_name):
+    # Years and quarters for the filter widgets, without loading the table
+    if reads_parquet_directly(table_name):
+        return parquet_partition_values(PARQUET_DIRECTORY, table_name)
+    df = load_data_from_db(f'SELECT DISTINCT year, quarter FROM {table_name}')
+    return sorted(df['year'].unique()), sorted(df['quarter'].unique())
+
+
+def load_geography():
+    # slug, display name ('state' column value) and geojson ST_NM of every
+    # state, or the built-in list for a database built before the table existed
+    try:
+        return load_data_from_db(f'SELECT slug, state, geojson_name FROM {GEOGRAPHY_TABLE} ORDER BY id')
+    except Exception:
+        return pd.DataFrame([(slug, display_name, geojson_name)
+                             for slug, (display_name, geojson_name) in STATE_GEOGRAPHY.items()],
+                            columns=['slug', 'state', 'geojson_name'])
+
+
+def with_geojson_names(df, column='state'):
+    # Add the geojson_name column the choropleths join on (featureidkey
+    # 'properties.ST_NM'). A lookup per distinct state, not per row.
+    geography = load_geography()
+    df['geojson_name'] = df[column].map(dict(zip(geography['state'], geography['geojson_name'])))
+    return df
@@ -0,0 +1,194 @@
+import os
+import re
+import duckdb
+from extraction.schema import TABLE_SCHEMAS, table_column_names
+from extraction.rollups import table_rollup_grains, rollup_table_name, rollup_select_sql
+from extraction.hierarchies import table_hierarchy_paths, hierarchy_table_name, hierarchy_select_sql
+from extraction.dimensions import (DIMENSION_COLUMNS, dimension_table_name, dimension_source_tables,
+                                   dimension_values_sql)
+from extraction.geography import GEOGRAPHY_TABLE, STATE_GEOGRAPHY
+from extraction.parquet_dataset import dataset_path, parquet_dataset_exists, parquet_data_version
+from extraction.csv_import import CSV_SNAPSHOT_FILES, canonical_names
+
+# DuckDB query backend for data_access: the queries the pages send to SQLite,
+# run by an in-process columnar engine straight over the Parquet export or
+# the CSV snapshot, with vectorized scans and aggregation.
+#
+# Every fact table is a view with the declared columns and types of its
+# schema. The rollups, the hierarchy node tables and the dimension tables are
+# views over the fact views, computed when they are queried, and there is no
+# rollup catalog, so the semantic layer aggregates the fact views directly.
+# The geography table is the built-in list. The CSV snapshot's state,
+# district and entity names are mapped to the names the ingest writes through
+# a table of the snapshot's distinct names, mapped once by the importer's
+# canonical_names when the database is opened.
+
+SOURCES = ('parquet', 'csv')
+
+DUCKDB_TYPES = {'INTEGER': 'BIGINT', 'REAL': 'DOUBLE', 'TEXT': 'VARCHAR'}
+
+# Columns whose snapshot spelling differs from the ingest's. Entity names are
+# mapped per entity type, the other names under the type ''.
+NAME_COLUMNS = ('state', 'districts_name', 'entity_name')
+DISPLAY_NAMES_TABLE = 'display_names'
+
+
+def sql_string(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def parquet_view_sql(parquet_directory, table_name):
+    # The table's Hive-partitioned dataset, in declared column order
+    files = os.path.join(dataset_path(parquet_directory, table_name), '*', '*', '*.parquet')
+    select_list = ', '.join(f'CAST("{column}" AS {DUCKDB_TYPES[sql_type]}) AS "{column}"'
+                            for column, sql_type, nullable in TABLE_SCHEMAS[table_name]['columns'])
+    return f'SELECT {select_list} FROM read_parquet({sql_string(files)}, hive_partitioning = true)'
+
+
+def csv_tables(csv_directory):
+    # Tables whose file is in the snapshot
+    return [table_name for table_name, (file_name, renamed_columns) in CSV_SNAPSHOT_FILES.items()
+            if os.path.exists(os.path.join(csv_directory, file_name))]
+
+
+def csv_source_sql(csv_directory, table_name):
+    file_name, renamed_columns = CSV_SNAPSHOT_FILES[table_name]
+    return f'read_csv_auto({sql_string(os.path.join(csv_directory, file_name))}, header = true)'
+
+
+def snapshot_name_columns(table_name):
+    # {column: snapshot column} of the table's name columns and entity type
+    file_name, renamed_columns = CSV_SNAPSHOT_FILES[table_name]
+    table_columns = table_column_names(table_name)
+    return {column: renamed_columns.get(column, column) for column in NAME_COLUMNS + ('entity_type',)
+            if column in table_columns and renamed_columns.get(column, column) is not None}
+
+
+def create_display_names(connection, csv_directory):
+    # The display_names table: (column_name, kind, raw, display) of every
+    # name in the snapshot, mapped as the CSV importer maps them
+    names = set()
+    for table_name in csv_tables(csv_directory):
+        columns = snapshot_name_columns(table_name)
+        name_columns = [column for column in NAME_COLUMNS if column in columns]
+        if not name_columns:
+            continue
+        select_list = ', '.join(f'CAST("{snapshot_column}" AS VARCHAR) AS "{column}"'
+                                for column, snapshot_column in columns.items())
+        raw = connection.execute(f'SELECT DISTINCT {select_list} '
+                                 f'FROM {csv_source_sql(csv_directory, table_name)}').df()
+        display = canonical_names(raw.copy())
+        for column in name_columns:
+            kinds = raw['entity_type'] if column == 'entity_name' else [''] * len(raw)
+            names.update((column, kind, raw_name, display_name)
+                         for kind, raw_name, display_name in zip(kinds, raw[column], display[column])
+                         if isinstance(raw_name, str))
+
+    connection.execute(f'CREATE TABLE {DISPLAY_NAMES_TABLE} '
+                       f'(column_name VARCHAR, kind VARCHAR, raw VARCHAR, display VARCHAR)')
+    if names:
+        connection.executemany(f'INSERT INTO {DISPLAY_NAMES_TABLE} VALUES (?, ?, ?, ?)', sorted(names))
+
+
+def csv_view_sql(csv_directory, table_name):
+    # The snapshot file under the table's column names. A column missing from
+    # the snapshot reads as NULL, and the names are mapped to their display
+    # names through the display_names table.
+    file_name, renamed_columns = CSV_SNAPSHOT_FILES[table_name]
+    name_columns = snapshot_name_columns(table_name)
+    select_list = []
+    joins = []
+    for column, sql_type, nullable in TABLE_SCHEMAS[table_name]['columns']:
+        snapshot_column = renamed_columns.get(column, column)
+        if snapshot_column is None:
+            value = 'NULL'
+        elif column in NAME_COLUMNS:
+            alias = f'names_{column}'
+            kind = f'CAST(snapshot."{name_columns["entity_type"]}" AS VARCHAR)' if column == 'entity_name' else "''"
+            joins.append(f' LEFT JOIN {DISPLAY_NAMES_TABLE} AS {alias} ON {alias}.column_name = {sql_string(column)} '
+                         f'AND {alias}.kind = {kind} '
+                         f'AND {alias}.raw = CAST(snapshot."{snapshot_column}" AS VARCHAR)')
+            value = f'COALESCE({alias}.display, snapshot."{snapshot_column}")'
+        else:
+            value = f'snapshot."{snapshot_column}"'
+        select_list.append(f'CAST({value} AS {DUCKDB_TYPES[sql_type]}) AS "{column}"')
+
+    return (f'SELECT {", ".join(select_list)} '
+            f'FROM {csv_source_sql(csv_directory, table_name)} AS snapshot' + ''.join(joins))
+
+
+def view_statements(source, directory):
+    # Views of every fact table found in the source, then of their rollups,
+    # their hierarchy node tables and the dimension tables
+    geography_rows = ', '.join(f'({sql_string(slug)}, {sql_string(display_name)}, {sql_string(geojson_name)})'
+                               for slug, (display_name, geojson_name) in STATE_GEOGRAPHY.items())
+    statements = [f'CREATE TABLE {GEOGRAPHY_TABLE} AS SELECT row_number() OVER () AS id, * '
+                  f'FROM (VALUES {geography_rows}) AS geography(slug, state, geojson_name)']
+
+    snapshot_tables = csv_tables(directory) if source == 'csv' else []
+    table_columns = {}
+    for table_name in TABLE_SCHEMAS:
+        if source == 'parquet' and parquet_dataset_exists(directory, table_name):
+            statements.append(f'CREATE VIEW {table_name} AS {parquet_view_sql(directory, table_name)}')
+        elif source == 'csv' and table_name in snapshot_tables:
+            statements.append(f'CREATE VIEW {table_name} AS {csv_view_sql(directory, table_name)}')
+        else:
+            continue
+        table_columns[table_name] = table_column_names(table_name)
+
+    for table_name, columns in table_columns.items():
+        for grain in table_rollup_grains(table_name, columns):
+            statements.append(f'CREATE VIEW {rollup_table_name(table_name, grain)} AS '
+                              f'{rollup_select_sql(table_name, grain)}')
+        for path_name in table_hierarchy_paths(table_name, columns):
+            statements.append(f'CREATE VIEW {hierarchy_table_name(table_name, path_name)} AS '
+                              f'{hierarchy_select_sql(table_name, path_name)}')
+
+    for column in DIMENSION_COLUMNS:
+        source_tables = dimension_source_tables(column, table_columns)
+        if source_tables:
+            statements.append(f'CREATE VIEW {dimension_table_name(column)} AS '
+                              f'SELECT row_number() OVER (ORDER BY value) AS id, value '
+                              f'FROM ({dimension_values_sql(column, source_tables)})')
+
+    return statements
+
+
+def open_duckdb(source, directory):
+    # An in-memory DuckDB database with the views of one source
+    if source not in SOURCES:
+        raise ValueError(f"Unknown DuckDB source {source}, expected one of {list(SOURCES)}")
+    connection = duckdb.connect(':memory:')
+    if source == 'csv':
+        create_display_names(connection, directory)
+    for statement in view_statements(source, directory):
+        connection.execute(statement)
+    return connection
+
+
+def duckdb_data_version(source, directory):
+    # Changes whenever the source is rewritten: the Parquet export stamp, or
+    # the latest modification time of the CSV snapshot
+    if source == 'parquet':
+        return parquet_data_version(directory)
+    mtimes = [os.path.getmtime(os.path.join(directory, file_name))
+              for file_name, renamed_columns in CSV_SNAPSHOT_FILES.values()
+              if os.path.exists(os.path.join(directory, file_name))]
+    return max(mtimes, default=None)
+
+
+def duckdb_query(query):
+    # data_access writes parameters as :name, DuckDB reads them as $name.
+    # Quoted identifiers and string literals are left alone.
+    parts = re.split(r"""('(?:[^']|'')*'|"[^"]*")""", query)
+    return ''.join(part if index % 2 else re.sub(r'(?<![:\w]):(\w+)', r'$\1', part)
+                   for index, part in enumerate(parts))
+
+
+def read_duckdb_query(connection, query, params=None):
+    # Run a query on its own cursor, so concurrent sessions can share the database
+    cursor = connection.cursor()
+    try:
+        return cursor.execute(duckdb_query(query), params or {}).df()
+    finally:
+        cursor.close()
@@ -0,0 +1,218 @@
+import os
+import time
+from itertools import chain
+from queue import Queue
+from threading import Event
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from sqlalchemy import create_engine
+from extraction.schema import TABLE_SCHEMAS
+from extraction.geography import state_display_name, district_display_name
+from extraction.scanner import scan_data_directory
+from extraction.extraction import EXTRACTION_REGISTRY, TOP_ENTITY_NAMES, bulk_load_batches, iter_column_batches
+
+# Bulk importer of the CSV snapshot in 'phonepe_extracted data': builds a
+# ready database, with its indexes, rollups, geography and dimension tables,
+# from the 18 exported CSVs instead of the JSON tree. Run from the repository
+# root with `python -m extraction.csv_import`.
+#
+# Every file is read in chunks with the column names and types of its table's
+# schema, by a pool of reader threads, and the chunks are written through the
+# bulk load's staging tables, so the import is swapped in as one transaction.
+# The tables the snapshot cannot supply are extracted from the JSON tree
+# instead, when it is checked out next to the snapshot.
+
+CSV_DIRECTORY = 'phonepe_extracted data'
+DATA_DIRECTORY = 'data'
+
+# The CSV snapshot predates the ingest: table -> (file name, {column: snapshot
+# column}) for the columns it names differently. A None column is missing
+# from the snapshot. The snapshot's states are slugs or lower-case names and
+# its districts lower-case, and are mapped to their display names.
+CSV_SNAPSHOT_FILES = {
+    'aggregated_insurence_country': ('agregated_insurence_country.csv', {}),
+    'aggregated_insurence_state': ('aggregated_insurence_state.csv', {}),
+    'agregated_transaction_country': ('agregated_transaction_country.csv', {}),
+    'aggregated_transaction_state': ('aggregated_transaction_state.csv', {}),
+    'aggregated_user_counry': ('aggregated_user_counry.csv', {}),
+    'agregated_user_state': ('agregated_user_state.csv', {}),
+    'map_insurence_hover_counry': ('map_insurence_hover_counry.csv', {'state': 'state_name'}),
+    'map_insurence_hover_state': ('map_insurence_hover_state.csv', {'state': 'state_name/ut_name'}),
+    'map_transaction_hover_counry': ('map_transaction_hover_counry.csv', {'state': 'state_name'}),
+    'map_transaction_hover_state': ('map_transaction_hover_state.csv', {'state': 'state_name/ut_name'}),
+    'map_user_hover_contry': ('map_user_hover_contry.csv', {'state': 'state/ut_name'}),
+    'map_user_hover_state': ('map_user_hover_state.csv', {'state': 'state_name/ut_name'}),
+    'top_insurence_country': ('top_insurence_country.csv', {}),
+    'top_insurance_state': ('top_insurence_state.csv', {'state': None}),
+    'top_transaction_country': ('top_transaction_country.csv', {}),
+    'top_transaction_state': ('top_transaction_state.csv', {'state': None}),
+    'top_user_country': ('top_user_country.csv', {}),
+    'top_user_state': ('top_user_state.csv', {}),
+}
+
+# pandas dtype a CSV column of each SQLite type is parsed as. Text stays text,
+# so pincodes keep their digits.
+CSV_DTYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'TEXT': 'str'}
+
+
+def snapshot_columns(table_name):
+    # {column: snapshot column} of a table, None for the missing columns
+    file_name, renamed_columns = CSV_SNAPSHOT_FILES[table_name]
+    return {column: renamed_columns.get(column, column)
+            for column, sql_type, nullable in TABLE_SCHEMAS[table_name]['columns']}
+
+
+def importable_tables(csv_directory):
+    # Tables whose file is in the snapshot and has every NOT NULL column. The
+    # state top files lost their state column in the export, so they cannot
+    # be imported; they are extracted from the JSON tree instead.
+    table_names = []
+    for table_name, (file_name, renamed_columns) in CSV_SNAPSHOT_FILES.items():
+        if not os.path.exists(os.path.join(csv_directory, file_name)):
+            print(f"Skipped {table_name}: {file_name} is not in {csv_directory}")
+            continue
+        columns = snapshot_columns(table_name)
+        missing = [column for column, sql_type, nullable in TABLE_SCHEMAS[table_name]['columns']
+                   if columns[column] is None and not nullable]
+        if missing:
+            print(f"Skipped {table_name}: {file_name} has no {', '.join(missing)} column")
+            continue
+        table_names.append(table_name)
+    return table_names
+
+
+def display_names(values, display_name):
+    # Map a column through a display name function, once per distinct value
+    names = {value: display_name(value) for value in values.dropna().unique()}
+    return values.map(names)
+
+
+def canonical_names(chunk):
+    # The state, district and entity names the ingest writes
+    if 'state' in chunk:
+        chunk['state'] = display_names(chunk['state'], state_display_name)
+    if 'districts_name' in chunk:
+        chunk['districts_name'] = display_names(chunk['districts_name'], district_display_name)
+    if 'entity_name' in chunk:
+        for entity_type, display_name in TOP_ENTITY_NAMES:
+            entities = chunk['entity_type'] == entity_type
+            if display_name is not None and entities.any():
+                chunk.loc[entities, 'entity_name'] = display_names(chunk.loc[entities, 'entity_name'], display_name)
+    return chunk
+
+
+def iter_csv_table(csv_directory, table_name, chunk_size=50000):
+    # {column: list of values} batches of one snapshot file, in schema order
+    file_name, renamed_columns = CSV_SNAPSHOT_FILES[table_name]
+    columns = snapshot_columns(table_name)
+    dtypes = {columns[column]: CSV_DTYPES[sql_type]
+              for column, sql_type, nullable in TABLE_SCHEMAS[table_name]['columns']
+              if columns[column] is not None}
+    renames = {snapshot_column: column for column, snapshot_column in columns.items() if snapshot_column is not None}
+
+    reader = pd.read_csv(os.path.join(csv_directory, file_name), usecols=list(dtypes), dtype=dtypes,
+                         chunksize=chunk_size)
+    for chunk in reader:
+        chunk = canonical_names(chunk.rename(columns=renames))
+        batch = {}
+        for column in columns:
+            if column not in chunk:
+                batch[column] = [None] * len(chunk)
+                continue
+            values = chunk[column].astype(object)
+            batch[column] = values.where(values.notna(), None).tolist()
+        yield batch
+
+
+def read_csv_table(csv_directory, table_name, chunk_size, batch_queue, stop):
+    # Reader thread: queue the table's batches, then None once it is done
+    try:
+        for columns in iter_csv_table(csv_directory, table_name, chunk_size):
+            if stop.is_set():
+                return
+            batch_queue.put((table_name, columns))
+    except Exception as e:
+        batch_queue.put((table_name, e))
+    finally:
+        batch_queue.put(None)
+
+
+def iter_csv_batches(csv_directory, table_names, chunk_size=50000, workers=4):
+    # (table_name, columns) batches of the tables, read by up to workers
+    # threads at once. The queue is bounded, so the readers stay at most a
+    # few chunks ahead of the writer.
+    batch_queue = Queue(maxsize=2 * workers)
+    stop = Event()
+    finished = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for table_name in table_names:
+            executor.submit(read_csv_table, csv_directory, table_name, chunk_size, batch_queue, stop)
+        try:
+            while finished < len(table_names):
+                item = batch_queue.get()
+                if item is None:
+                    finished += 1
+                    continue
+                table_name, columns = item
+                if isinstance(columns, Exception):
+                    raise RuntimeError(f"Failed to read the {table_name} snapshot: {columns}") from columns
+                yield table_name, columns
+        finally:
+            # Unblock the readers still queueing batches when the load stops early
+            stop.set()
+            while finished < len(table_names):
+                if batch_queue.get() is None:
+                    finished += 1
+
+
+def iter_json_batches(data_directory, table_names, chunk_size=50000):
+    # (table_name, columns) batches of the tables, extracted from the quarter
+    # files of their datasets in the JSON tree
+    if not table_names:
+        return
+    datasets = {dataset for (dataset, scope), (table_name, extract_function) in EXTRACTION_REGISTRY.items()
+                if table_name in table_names}
+    data_files = [data_file for data_file in scan_data_directory(data_directory, datasets)
+                  if EXTRACTION_REGISTRY[(data_file.dataset, data_file.scope)][0] in table_names]
+    yield from iter_column_batches(data_files, chunk_size)
+
+
+def import_csv_snapshot(csv_directory, engine, workers=4, chunk_size=50000, journal_mode='OFF',
+                        data_directory=None):
+    # Replace the database's tables with the snapshot's, and with the JSON
+    # tree's for the tables the snapshot cannot supply. Returns the rows
+    # imported per table, or None if the import failed and was rolled back.
+    start = time.perf_counter()
+    table_names = importable_tables(csv_directory)
+    json_tables = [table_name for table_name in CSV_SNAPSHOT_FILES if table_name not in table_names]
+    if json_tables and (data_directory is None or not os.path.isdir(data_directory)):
+        print(f"No JSON tree to extract {', '.join(json_tables)} from; the database will not have them")
+        dropped_tables, json_tables = json_tables, []
+    else:
+        dropped_tables = []
+
+    csv_batches = iter_csv_batches(csv_directory, table_names, chunk_size, workers)
+    json_batches = iter_json_batches(data_directory, json_tables, chunk_size)
+    try:
+        staged_rows = bulk_load_batches(engine, chain(csv_batches, json_batches), journal_mode,
+                                        drop_tables=dropped_tables)
+    finally:
+        csv_batches.close()
+        json_batches.close()
+    if staged_rows is None:
+        return None
+
+    print(f"Imported {sum(staged_rows.values())} rows into {len(staged_rows)} tables "
+          f"from {csv_directory} in {time.perf_counter() - start:.2f}s")
+    if json_tables:
+        print(f"Extracted {', '.join(json_tables)} from {data_directory}")
+    return staged_rows
+
+
+if __name__ == '__main__':
+    # A fresh database for the pages from the snapshot in the repository
+    repository_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    engine = create_engine('sqlite:///test.sqlite', connect_args={'timeout': 60})
+    import_csv_snapshot(os.path.join(repository_directory, CSV_DIRECTORY), engine, workers=os.cpu_count(),
+                        data_directory=os.path.join(repository_directory, DATA_DIRECTORY))
@@ -0,0 +1,49 @@
+# Dimension tables of the repeated text columns of the fact tables. Every
+# distinct value of a column, over all the fact tables that have it, gets an
+# integer key:
+#   dim_<column>(id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)
+# Keys follow the sort order of the values. The tables are rebuilt with the
+# rollups at the end of every ingest, and the loader uses them as the
+# categories of the pd.Categorical columns it hands to the pages, so every
+# frame of a column shares one category dtype and order.
+#
+# The fact tables do not reference the keys: they still store the text
+# values, which the filters, indexes, rollups and refresh slices select and
+# group by, so the database is no smaller for them. The memory saving is in
+# the loaded frames only.
+
+DIMENSION_COLUMNS = ['state', 'districts_name', 'name', 'type_of_transaction', 'transaction_type',
+                     'phone_brand', 'entity_type', 'entity_name']
+
+
+def dimension_table_name(column):
+    return f'dim_{column}'
+
+
+def dimension_source_tables(column, table_columns):
+    return [table_name for table_name, columns in table_columns.items() if column in columns]
+
+
+def dimension_values_sql(column, source_tables):
+    # The SELECT of a dimension's distinct values in key order
+    distinct_values = ' UNION '.join(f'SELECT "{column}" AS value FROM {table_name}'
+                                     for table_name in source_tables)
+    return f'SELECT value FROM ({distinct_values}) WHERE value IS NOT NULL ORDER BY value'
+
+
+def dimension_statements(table_columns):
+    # SQL rebuilding every dimension table from the fact tables in
+    # table_columns ({table name: columns})
+    statements = []
+
+    for column in DIMENSION_COLUMNS:
+        source_tables = dimension_source_tables(column, table_columns)
+        if not source_tables:
+            continue
+
+        dimension_table = dimension_table_name(column)
+        statements.append(f'DROP TABLE IF EXISTS {dimension_table}')
+        statements.append(f'CREATE TABLE {dimension_table} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)')
+        statements.append(f'INSERT INTO {dimension_table} (value) {dimension_values_sql(column, source_tables)}')
+
+    return statements
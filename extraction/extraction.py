@@ -1,7 +1,27 @@
 import os
 import json
+import time
 import pandas as pd
-from sqlalchemy import create_engine
+from itertools import repeat
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from queue import Queue
+from threading import Thread
+from sqlalchemy import create_engine, inspect, text
+from extraction.scanner import scan_data_directory
+from extraction.manifest import (MANIFEST_TABLE, create_manifest_table, read_manifest, clear_manifest,
+                                 replace_manifest, file_fingerprint, file_content_hash, upsert_manifest_entries,
+                                 delete_manifest_entries, bump_data_version, CREATE_DATA_VERSION_SQL,
+                                 BUMP_DATA_VERSION_SQL, CREATE_MANIFEST_SQL, UPSERT_MANIFEST_SQL)
+from extraction.rollups import (CREATE_ROLLUP_CATALOG_SQL, ROLLUP_CATALOG_TABLE, rollup_statements,
+                                rollup_table_name, table_rollup_grains)
+from extraction.hierarchies import hierarchy_statements, hierarchy_table_name, table_hierarchy_paths
+from extraction.dimensions import dimension_statements
+from extraction.geography import state_display_name, district_display_name, geography_statements
+from extraction.schema import TABLE_SCHEMAS, table_column_names, create_table_sql
+from extraction.instrumentation import (new_ingest_stats, add_stage_time, stage_timer, record_file,
+                                        merge_ingest_stats, start_progress, report_progress,
+                                        build_run_report, write_run_report)
 
 def get_data_from_file(file_path):
     try:
@@ -12,407 +32,984 @@ def get_data_from_file(file_path):
         print(f'File not found: {file_path}')
         return None
 
-def process_data(data_directory, engine):
-    quarter_data = []
-
-    for current_dir, subdirs, files in os.walk(data_directory):
-        if 'aggregated' in current_dir or 'map' in current_dir or 'top' in current_dir:
-            data_type = os.path.basename(os.path.dirname(os.path.dirname(current_dir)))
-            subfolder_name = os.path.basename(current_dir)
-
-            if 'state' in current_dir:
-                for state in os.listdir(current_dir):
-                    state_dir = os.path.join(current_dir, state)
-
-                    for file in os.listdir(state_dir):
-                        if file.endswith('.json'):
-                            file_path = os.path.join(state_dir, file)
-                            parsed_data = get_data_from_file(file_path)
-
-                            if parsed_data is not None:
-                                year = int(file_path.split('/')[-3])
-                                quarter = int(file.split('.')[0])
-                                extract_function = choose_appropriate_data_extraction_function(data_type, subfolder_name, state)
-                                extracted_data = extract_function(parsed_data, year, quarter)
-                                if extracted_data is not None:
-                                    quarter_data.append(extracted_data)
-            else:
-                for file in files:
-                    if file.endswith('.json'):
-                        file_path = os.path.join(current_dir, file)
-                        parsed_data = get_data_from_file(file_path)
-
-                        if parsed_data is not None:
-                            year = int(file_path.split('/')[-2])
-                            quarter = int(file.split('.')[0])
-                            extract_function = choose_appropriate_data_extraction_function(data_type, subfolder_name, None)
-                            extracted_data = extract_function(parsed_data, year, quarter)
-                            if extracted_data is not None:
-                                quarter_data.append(extracted_data)
-
-    if not quarter_data:
+# Column order of every table, from the declared schemas. Extraction appends
+# into one list per column (a "column batch") and a DataFrame is only built
+# when a batch is flushed.
+TABLE_COLUMNS = {table_name: table_column_names(table_name) for table_name in TABLE_SCHEMAS}
+
+
+def new_column_batch(table_name):
+    return {column: [] for column in TABLE_COLUMNS[table_name]}
+
+
+def batch_row_count(columns):
+    return len(columns['year'])
+
+
+def merge_column_batches(target_batches, source_batches):
+    # Append the columns of source_batches to target_batches, table by table
+    for table_name, source_columns in source_batches.items():
+        target_columns = target_batches.get(table_name)
+        if target_columns is None:
+            target_batches[table_name] = source_columns
+        else:
+            for column, values in source_columns.items():
+                target_columns[column].extend(values)
+
+
+def column_batch_to_frame(columns):
+    return pd.DataFrame(columns)
+
+
+def extract_file(data_file, batches, stats=None):
+    # Parse a single JSON file and append its rows to the column batch of its
+    # table in batches; returns the number of rows the file produced, or None
+    # when the file could not be read or extracted. With stats, the time spent
+    # reading, parsing and extracting and any failure are recorded there.
+    extractor = EXTRACTION_REGISTRY.get((data_file.dataset, data_file.scope))
+    if extractor is None:
+        return 0
+
+    table_name, extract_function = extractor
+    columns = batches.get(table_name)
+    if columns is None:
+        columns = batches[table_name] = new_column_batch(table_name)
+
+    start = time.perf_counter()
+    file_bytes = 0
+    try:
+        with open(data_file.path, 'rb') as file:
+            raw_data = file.read()
+        file_bytes = len(raw_data)
+        read_done = time.perf_counter()
+        parsed_data = json.loads(raw_data)
+    except (OSError, ValueError) as e:
+        print(f"Failed to read {data_file.path}: {e}")
+        if stats is not None:
+            record_file(stats, data_file, file_bytes, 0, time.perf_counter() - start, error=str(e))
+        return None
+    parse_done = time.perf_counter()
+
+    # A file that fails halfway must not leave the columns at different lengths
+    column_lengths = {column: len(values) for column, values in columns.items()}
+    try:
+        row_count = extract_function(parsed_data, data_file.year, data_file.quarter, data_file.state, columns)
+        error = None
+    except Exception as e:
+        for column, values in columns.items():
+            del values[column_lengths[column]:]
+        print(f"Failed to extract {data_file.path}: {e!r}")
+        row_count, error = None, repr(e)
+    extract_done = time.perf_counter()
+
+    if stats is not None:
+        add_stage_time(stats, 'read', read_done - start)
+        add_stage_time(stats, 'parse', parse_done - read_done)
+        add_stage_time(stats, 'extract', extract_done - parse_done)
+        record_file(stats, data_file, file_bytes, row_count or 0, extract_done - start, error=error)
+    return row_count
+
+
+def scan_ingested_files(data_directory):
+    # Every file that has an extraction function, in scan order
+    return list(scan_data_directory(data_directory, INGESTED_DATASETS))
+
+
+def extract_shard(data_files):
+    # Worker entry point: extract a contiguous run of files into column batches.
+    # Returns the batches, the row count of every file in the shard and the
+    # shard's ingest stats.
+    batches = {}
+    stats = new_ingest_stats()
+    row_counts = [extract_file(data_file, batches, stats) for data_file in data_files]
+    return batches, row_counts, stats
+
+
+def split_into_shards(data_files, shard_count):
+    # Split the file list into contiguous, ordered shards
+    shard_size = max(1, -(-len(data_files) // shard_count))
+    return [data_files[i:i + shard_size] for i in range(0, len(data_files), shard_size)]
+
+
+def extract_files(data_files, workers=1, stats=None):
+    # Extract all files into one set of column batches, optionally in a process pool.
+    # executor.map yields the shards in submission order, and shards are
+    # contiguous, so merging them reproduces the serial row order exactly.
+    if workers is None or workers <= 1 or len(data_files) <= 1:
+        batches, row_counts, shard_stats = extract_shard(data_files)
+        if stats is not None:
+            merge_ingest_stats(stats, shard_stats)
+        return batches, row_counts
+
+    batches = {}
+    row_counts = []
+    # Several shards per worker keep the pool busy when file sizes differ
+    shards = split_into_shards(data_files, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for shard_batches, shard_row_counts, shard_stats in executor.map(extract_shard, shards):
+            merge_column_batches(batches, shard_batches)
+            row_counts.extend(shard_row_counts)
+            if stats is not None:
+                merge_ingest_stats(stats, shard_stats)
+
+    return batches, row_counts
+
+
+def finish_shard(shard_result, stats, row_counts=None):
+    # Batches of a finished shard; its stats are merged into the run's stats,
+    # and the row counts of its files appended to row_counts
+    batches, shard_row_counts, shard_stats = shard_result
+    if row_counts is not None:
+        row_counts.extend(shard_row_counts)
+    if stats is not None:
+        merge_ingest_stats(stats, shard_stats)
+        report_progress(stats)
+    return batches
+
+
+def iter_shard_batches(data_files, workers=1, shard_size=64, stats=None, row_counts=None):
+    # Yield the column batches of consecutive shards of files, in file order.
+    # With workers > 1 only a small window of shards is in flight, so parsed
+    # data never piles up in memory. Pass a list as row_counts to get the row
+    # count of every file (None for a failed one), in file order.
+    shards = split_into_shards(data_files, max(1, len(data_files) // shard_size))
+
+    if workers is None or workers <= 1:
+        for shard in shards:
+            yield finish_shard(extract_shard(shard), stats, row_counts)
+        return
+
+    window_size = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for shard in shards:
+            pending.append(executor.submit(extract_shard, shard))
+            if len(pending) >= window_size:
+                yield finish_shard(pending.popleft().result(), stats, row_counts)
+        while pending:
+            yield finish_shard(pending.popleft().result(), stats, row_counts)
+
+
+def iter_column_batches(data_files, batch_size, workers=1, stats=None, row_counts=None):
+    # Accumulate extracted columns per table and yield (table_name, columns)
+    # whenever a table has collected batch_size rows; the remainders are
+    # yielded at the end
+    batches = {}
+
+    for shard_batches in iter_shard_batches(data_files, workers, stats=stats, row_counts=row_counts):
+        merge_column_batches(batches, shard_batches)
+
+        for table_name in list(shard_batches):
+            if batch_row_count(batches[table_name]) >= batch_size:
+                yield table_name, batches.pop(table_name)
+
+    for table_name, columns in batches.items():
+        if batch_row_count(columns):
+            yield table_name, columns
+
+
+def iter_row_batches(data_files, batch_size, workers=1, stats=None, row_counts=None):
+    # Same batches as iter_column_batches, as DataFrames
+    for table_name, columns in iter_column_batches(data_files, batch_size, workers, stats, row_counts):
+        frame_start = time.perf_counter()
+        df = column_batch_to_frame(columns)
+        if stats is not None:
+            add_stage_time(stats, 'frame', time.perf_counter() - frame_start)
+        yield table_name, df
+
+
+def write_batch(connection, table_name, batch, replace):
+    # replace=True drops whatever an earlier run left in the table first. The
+    # table is created from its declared schema, never from the batch's dtypes.
+    if replace:
+        connection.execute(text(f'DROP TABLE IF EXISTS {table_name}'))
+    connection.execute(text(create_table_sql(table_name)))
+    batch.to_sql(table_name, connection, index=False, if_exists='append')
+
+
+def table_index_statements(table_name):
+    # Every table is read and refreshed by (year, quarter). The pages also
+    # filter the state tables by state and the top tables by entity type,
+    # with the year and quarter selections on top. Index names are global in
+    # SQLite, so each one carries its table name.
+    columns = TABLE_COLUMNS[table_name]
+    indexes = [('slice', ['year', 'quarter'])]
+    if 'state' in columns:
+        indexes.append(('state', ['state', 'year', 'quarter']))
+    if 'entity_type' in columns:
+        indexes.append(('entity', ['entity_type', 'year', 'quarter']))
+    return [f'CREATE INDEX IF NOT EXISTS idx_{table_name}_{index_name} ON {table_name} ({", ".join(index_columns)})'
+            for index_name, index_columns in indexes]
+
+
+def create_table_indexes(connection, table_name):
+    for statement in table_index_statements(table_name):
+        connection.execute(text(statement))
+
+
+def build_rollups(connection, table_names):
+    # Rebuild the rollup and hierarchy node tables of the given fact tables
+    # from their current rows
+    for table_name in table_names:
+        for statement in rollup_statements(table_name, TABLE_COLUMNS[table_name]) + \
+                hierarchy_statements(table_name, TABLE_COLUMNS[table_name]):
+            connection.execute(text(statement))
+
+
+def build_dimensions(connection):
+    # Rebuild the geography table, and the dimension tables from every fact
+    # table in the database
+    existing_tables = set(inspect(connection).get_table_names())
+    for statement in geography_statements() + dimension_statements({table_name: columns for table_name, columns in TABLE_COLUMNS.items()
+                                           if table_name in existing_tables}):
+        connection.execute(text(statement))
+
+
+def stream_data(data_directory, engine, batch_size=10000, workers=1):
+    # Streaming ingest: every batch is written and committed in its own
+    # transaction, so memory stays bounded by batch_size rows per table and an
+    # interrupted run keeps everything committed before the failure
+    data_files = scan_ingested_files(data_directory)
+    started_tables = set()
+    rows_written = 0
+    row_counts = []
+
+    try:
+        with engine.begin() as connection:
+            clear_manifest(connection)
+        for table_name, batch in iter_row_batches(data_files, batch_size, workers, row_counts=row_counts):
+            with engine.begin() as connection:
+                write_batch(connection, table_name, batch, replace=table_name not in started_tables)
+            started_tables.add(table_name)
+            rows_written += len(batch)
+        with engine.begin() as connection:
+            for table_name in started_tables:
+                create_table_indexes(connection, table_name)
+            build_rollups(connection, started_tables)
+            build_dimensions(connection)
+            replace_manifest(connection, ingested_manifest_entries(data_directory, data_files, row_counts))
+            bump_data_version(connection)
+    except Exception as e:
+        print(f"Failed to stream data to the database after {rows_written} rows: {e}")
+        return None
+
+    print(f"Streamed {rows_written} rows into {len(started_tables)} tables")
+    return rows_written
+
+
+def run_table_writer(engine, table_name, batch_queue, results):
+    # Writer thread of one table: takes batches off its queue until it gets
+    # None. After a failure it keeps draining the queue so extraction never blocks.
+    # results[table_name] gets the table's row count, batch count, write and
+    # index seconds and error (None when it succeeded).
+    table_result = {'rows': 0, 'batches': 0, 'write_seconds': 0.0, 'index_seconds': 0.0, 'error': None}
+
+    while True:
+        batch = batch_queue.get()
+        if batch is None:
+            break
+        if table_result['error'] is not None:
+            continue
+        write_start = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                write_batch(connection, table_name, batch, replace=table_result['rows'] == 0)
+            table_result['rows'] += len(batch)
+            table_result['batches'] += 1
+        except Exception as e:
+            table_result['error'] = str(e)
+        table_result['write_seconds'] += time.perf_counter() - write_start
+
+    if table_result['error'] is None and table_result['rows']:
+        index_start = time.perf_counter()
+        try:
+            with engine.begin() as connection:
+                create_table_indexes(connection, table_name)
+        except Exception as e:
+            table_result['error'] = str(e)
+        table_result['index_seconds'] = time.perf_counter() - index_start
+
+    results[table_name] = table_result
+
+
+def process_data(data_directory, engine, workers=1, batch_size=10000, report_path=None, progress_interval=None):
+    # Full ingest in a single traversal: every file is extracted once and its
+    # rows are routed to the writer of its table. Each table has its own
+    # writer thread, so writing overlaps with parsing and with the other tables.
+    # SQLite still serialises the commits, so give the engine a generous lock
+    # timeout (connect_args={'timeout': 60}).
+    # report_path: write the run report (stage timings, per-dataset counters,
+    # slowest files, errors) there as JSON.
+    # progress_interval: print a progress line every that many seconds.
+    run_start = time.perf_counter()
+    stats = new_ingest_stats()
+    with stage_timer(stats, 'scan'):
+        data_files = scan_ingested_files(data_directory)
+    start_progress(stats, len(data_files), progress_interval)
+
+    batch_queues = {}
+    writers = []
+    results = {}
+    row_counts = []
+
+    with engine.begin() as connection:
+        clear_manifest(connection)
+
+    try:
+        for table_name, batch in iter_row_batches(data_files, batch_size, workers, stats, row_counts):
+            batch_queue = batch_queues.get(table_name)
+            if batch_queue is None:
+                # A short queue bounds how many batches wait in memory per table
+                batch_queue = batch_queues[table_name] = Queue(maxsize=2)
+                writer = Thread(target=run_table_writer, args=(engine, table_name, batch_queue, results),
+                                name=f'writer-{table_name}')
+                writer.start()
+                writers.append(writer)
+            batch_queue.put(batch)
+    finally:
+        for batch_queue in batch_queues.values():
+            batch_queue.put(None)
+        for writer in writers:
+            writer.join()
+
+    if results:
+        saved_tables = [table_name for table_name, table_result in results.items()
+                        if table_result['error'] is None and table_result['rows']]
+        try:
+            with stage_timer(stats, 'rollup'), engine.begin() as connection:
+                build_rollups(connection, saved_tables)
+                build_dimensions(connection)
+                # The files of a table that failed to save stay out, so the next refresh redoes them
+                replace_manifest(connection, [entry for entry in
+                                              ingested_manifest_entries(data_directory, data_files, row_counts)
+                                              if entry['dataset'] in saved_tables])
+                bump_data_version(connection)
+        except Exception as e:
+            print(f"Failed to build the rollup and dimension tables: {e}")
+
+    for table_result in results.values():
+        add_stage_time(stats, 'write', table_result['write_seconds'])
+        add_stage_time(stats, 'index', table_result['index_seconds'])
+    if report_path is not None:
+        tables = {table_name: dict(table_result, write_seconds=round(table_result['write_seconds'], 4),
+                                   index_seconds=round(table_result['index_seconds'], 4))
+                  for table_name, table_result in results.items()}
+        write_run_report(build_run_report(stats, data_directory, workers, batch_size,
+                                          time.perf_counter() - run_start, tables), report_path)
+
+    if not results:
         print("No data to process.")
         return None
 
-    df = pd.concat(quarter_data, ignore_index=True)
-    if df.empty:
-        print("No data to save to the database.")
+    rows_per_table = {}
+    for table_name, table_result in results.items():
+        if table_result['error'] is not None:
+            print(f"Failed to save {table_name} to the database: {table_result['error']}")
+        else:
+            rows_per_table[table_name] = table_result['rows']
+
+    if stats['error_count']:
+        print(f"Skipped {stats['error_count']} files that could not be read or extracted")
+    print(f"Saved {sum(rows_per_table.values())} rows into {len(rows_per_table)} tables")
+    return rows_per_table
+
+
+def drop_table_statements(table_name):
+    # SQL dropping a fact table with its rollups, catalog entries and node tables
+    table_columns = TABLE_COLUMNS[table_name]
+    statements = [CREATE_ROLLUP_CATALOG_SQL,
+                  f"DELETE FROM {ROLLUP_CATALOG_TABLE} WHERE source_table = '{table_name}'"]
+    for grain in table_rollup_grains(table_name, table_columns):
+        statements.append(f'DROP TABLE IF EXISTS {rollup_table_name(table_name, grain)}')
+    for path_name in table_hierarchy_paths(table_name, table_columns):
+        statements.append(f'DROP TABLE IF EXISTS {hierarchy_table_name(table_name, path_name)}')
+    statements.append(f'DROP TABLE IF EXISTS {table_name}')
+    return statements
+
+
+def bulk_load_batches(engine, column_batches, journal_mode='OFF', manifest_entries=None, drop_tables=()):
+    # Load (table_name, columns) batches as the full contents of their
+    # tables. Rows go into <table>__staging tables, indexed only by their
+    # key, with executemany inside one large transaction, with the journal
+    # (journal_mode='OFF' or 'WAL') and fsyncs turned down. The staging
+    # tables are then swapped in and indexed in a single journaled
+    # transaction, so readers see either the old tables or the new ones,
+    # never a partial load. Returns the rows loaded per table, or None.
+    # manifest_entries: called once the batches are staged, returns the
+    # manifest rows of the source files; without it the manifest is dropped.
+    # drop_tables: tables the load has no rows for that must not outlive it,
+    # dropped in the swap unless a batch was staged for them.
+    staged_rows = {}
+
+    raw_connection = engine.raw_connection()
+    connection = raw_connection.driver_connection
+    saved_isolation_level = connection.isolation_level
+    saved_journal_mode = connection.execute('PRAGMA journal_mode').fetchone()[0]
+    saved_synchronous = connection.execute('PRAGMA synchronous').fetchone()[0]
+    # WAL is kept once chosen; OFF is only for the load itself
+    swap_journal_mode = saved_journal_mode if journal_mode.upper() == 'OFF' else journal_mode
+
+    try:
+        # Manage the transactions by hand instead of letting sqlite3 open them
+        connection.isolation_level = None
+        connection.execute(f'PRAGMA journal_mode = {journal_mode}')
+        connection.execute('PRAGMA synchronous = OFF')
+
+        connection.execute('BEGIN')
+        for table_name, columns in column_batches:
+            staging_table = f'{table_name}__staging'
+            if table_name not in staged_rows:
+                connection.execute(f'DROP TABLE IF EXISTS {staging_table}')
+                connection.execute(create_table_sql(table_name, staging_table))
+                staged_rows[table_name] = 0
+
+            placeholders = ', '.join('?' * len(columns))
+            connection.executemany(f'INSERT INTO {staging_table} VALUES ({placeholders})', zip(*columns.values()))
+            staged_rows[table_name] += batch_row_count(columns)
+        connection.execute('COMMIT')
+
+        # The swap must survive a crash, so it runs with a real journal again
+        connection.execute(f'PRAGMA journal_mode = {swap_journal_mode}')
+        connection.execute(f'PRAGMA synchronous = {saved_synchronous}')
+        connection.execute('BEGIN IMMEDIATE')
+        connection.execute(f'DROP TABLE IF EXISTS {MANIFEST_TABLE}')
+        if manifest_entries is not None:
+            connection.execute(CREATE_MANIFEST_SQL)
+            connection.executemany(UPSERT_MANIFEST_SQL, manifest_entries())
+        for table_name in drop_tables:
+            if table_name not in staged_rows:
+                for statement in drop_table_statements(table_name):
+                    connection.execute(statement)
+        for table_name in staged_rows:
+            connection.execute(f'DROP TABLE IF EXISTS {table_name}')
+            connection.execute(f'ALTER TABLE {table_name}__staging RENAME TO {table_name}')
+            for statement in table_index_statements(table_name):
+                connection.execute(statement)
+            for statement in rollup_statements(table_name, TABLE_COLUMNS[table_name]) + \
+                    hierarchy_statements(table_name, TABLE_COLUMNS[table_name]):
+                connection.execute(statement)
+        existing_tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for statement in geography_statements() + dimension_statements(
+                {table_name: columns for table_name, columns in TABLE_COLUMNS.items() if table_name in existing_tables}):
+            connection.execute(statement)
+        connection.execute(CREATE_DATA_VERSION_SQL)
+        connection.execute(BUMP_DATA_VERSION_SQL, {'updated': time.time()})
+        connection.execute('COMMIT')
+
+        connection.execute('ANALYZE')
+    except Exception as e:
+        if connection.in_transaction:
+            connection.execute('ROLLBACK')
+        print(f"Failed to bulk load the database: {e}")
+        return None
+    finally:
+        connection.execute(f'PRAGMA journal_mode = {swap_journal_mode}')
+        connection.execute(f'PRAGMA synchronous = {saved_synchronous}')
+        connection.isolation_level = saved_isolation_level
+        raw_connection.close()
+
+    return staged_rows
+
+
+def bulk_load_data(data_directory, engine, workers=1, batch_size=50000, journal_mode='OFF'):
+    # Bulk-load mode for full rebuilds of the database from the JSON tree
+    data_files = scan_ingested_files(data_directory)
+    row_counts = []
+    staged_rows = bulk_load_batches(engine, iter_column_batches(data_files, batch_size, workers, row_counts=row_counts),
+                                    journal_mode,
+                                    lambda: ingested_manifest_entries(data_directory, data_files, row_counts))
+    if staged_rows is None:
         return None
 
-    file_name = choose_appropriate_data_extraction_function.__name__
+    print(f"Bulk loaded {sum(staged_rows.values())} rows into {len(staged_rows)} tables")
+    return staged_rows
+
+
+def state_column_value(state):
+    # How the state-level extraction functions write the state slug into the 'state' column
+    return state_display_name(state)
+
+
+def delete_slice(connection, table_name, state, year, quarter):
+    # Remove the rows one source file produced: a country file owns a whole
+    # (year, quarter) of its table, a state file only that state's rows
+    if state is None:
+        connection.execute(text(f'DELETE FROM {table_name} WHERE year = :year AND quarter = :quarter'),
+                           {'year': year, 'quarter': quarter})
+    else:
+        connection.execute(text(f'DELETE FROM {table_name} WHERE year = :year AND quarter = :quarter AND state = :state'),
+                           {'year': year, 'quarter': quarter, 'state': state_column_value(state)})
+
+
+def manifest_entry(data_file, data_directory, size, mtime, content_hash, row_count=0):
+    return {
+        'path': os.path.relpath(data_file.path, data_directory),
+        'size': size,
+        'mtime': mtime,
+        'content_hash': content_hash,
+        'dataset': EXTRACTION_REGISTRY[(data_file.dataset, data_file.scope)][0],
+        'state': data_file.state,
+        'year': data_file.year,
+        'quarter': data_file.quarter,
+        'row_count': row_count,
+    }
+
+
+def ingested_manifest_entries(data_directory, data_files, row_counts):
+    # Manifest rows of the files a full ingest extracted. Files that failed
+    # to extract (row count None) are left out, so the next refresh retries them.
+    entries = []
+    for data_file, row_count in zip(data_files, row_counts):
+        if row_count is None:
+            continue
+        size, mtime = file_fingerprint(data_file.path)
+        entries.append(manifest_entry(data_file, data_directory, size, mtime,
+                                      file_content_hash(data_file.path), row_count))
+    return entries
+
+
+def refresh_data(data_directory, engine, workers=1):
+    # Incremental ingest: compare the files on disk with the manifest, parse
+    # only the added or changed ones and rewrite just their slices
+    manifest = read_manifest(engine)
+    data_files = scan_ingested_files(data_directory)
+
+    changed_files = []
+    touched_entries = []
+    seen_paths = set()
+    unchanged_count = 0
+
+    for data_file in data_files:
+        path = os.path.relpath(data_file.path, data_directory)
+        seen_paths.add(path)
+
+        size, mtime = file_fingerprint(data_file.path)
+        entry = manifest.get(path)
+        if entry is not None and entry['size'] == size and entry['mtime'] == mtime:
+            unchanged_count += 1
+            continue
+
+        content_hash = file_content_hash(data_file.path)
+        if entry is not None and entry['content_hash'] == content_hash:
+            # Touched but not modified, only the stored mtime needs updating
+            touched_entries.append(dict(entry, size=size, mtime=mtime))
+            unchanged_count += 1
+            continue
+
+        changed_files.append((data_file, manifest_entry(data_file, data_directory, size, mtime, content_hash)))
+
+    removed_paths = [path for path in manifest if path not in seen_paths]
+
+    files_to_extract = [data_file for data_file, entry in changed_files]
+    batches, row_counts = extract_files(files_to_extract, workers)
+    for (data_file, entry), row_count in zip(changed_files, row_counts):
+        entry['row_count'] = row_count
+
+    rows_written = 0
     try:
-        df.to_sql(f'{file_name}', engine, index=False, if_exists='replace')
-        engine.execute(f"CREATE INDEX idx_quarter ON {file_name} (quarter)")
+        # One transaction: a failed refresh leaves the previous tables and manifest untouched
+        with engine.begin() as connection:
+            create_manifest_table(connection)
+            existing_tables = set(inspect(connection).get_table_names())
+
+            for path in removed_paths:
+                entry = manifest[path]
+                if entry['dataset'] in existing_tables:
+                    delete_slice(connection, entry['dataset'], entry['state'], entry['year'], entry['quarter'])
+            delete_manifest_entries(connection, removed_paths)
+
+            for data_file, entry in changed_files:
+                if entry['dataset'] in existing_tables:
+                    delete_slice(connection, entry['dataset'], entry['state'], entry['year'], entry['quarter'])
+
+            for table_name, columns in batches.items():
+                if not batch_row_count(columns):
+                    continue
+                df = column_batch_to_frame(columns)
+                write_batch(connection, table_name, df, replace=False)
+                create_table_indexes(connection, table_name)
+                rows_written += len(df)
+
+            # Files that failed to extract stay out of the manifest, so the next refresh retries them
+            upsert_manifest_entries(connection, [entry for data_file, entry in changed_files
+                                                 if entry['row_count'] is not None] + touched_entries)
+            if changed_files or removed_paths:
+                touched_tables = {entry['dataset'] for data_file, entry in changed_files} | \
+                                 {manifest[path]['dataset'] for path in removed_paths}
+                existing_tables = set(inspect(connection).get_table_names())
+                build_rollups(connection, sorted(touched_tables & existing_tables))
+                build_dimensions(connection)
+                bump_data_version(connection)
     except Exception as e:
-        print(f"Failed to save data to the database: {e}")
+        print(f"Failed to refresh the database: {e}")
         return None
 
-    return df
+    summary = {
+        'changed_files': len(changed_files),
+        'removed_files': len(removed_paths),
+        'unchanged_files': unchanged_count,
+        'rows_written': rows_written,
+    }
+    print(f"Refreshed {summary['changed_files']} files ({summary['rows_written']} rows), "
+          f"removed {summary['removed_files']}, skipped {summary['unchanged_files']} unchanged")
+    return summary
 
 # Define the data extraction functions here
-
-# Example of a data extraction function
-def extract_aggregated_insurance_country_data(parsed_data, year, quarter):
-    table = []
-    transaction_data = parsed_data['data']['transactionData']
-
-    for transaction in transaction_data:
-        row = {
-            'year': year,
-            'quarter': quarter,
-            'name': transaction['name'],
-            'count': transaction['paymentInstruments'][0]['count'],
-            'amount': transaction['paymentInstruments'][0]['amount']  # Assuming 'amount' is a key in the JSON
-        }
-        table.append(row)
-
-    return pd.DataFrame(table)
-
-# Define the other data extraction functions here
-def extract_aggregated_insurance_country_data(parsed_data):
-    table = []
+# Each one appends the rows of one parsed file to the column lists in
+# `columns` and returns how many rows it added. Values that are the same for
+# every row of the file are computed once and repeated.
+def extract_aggregated_insurance_country_data(parsed_data, year, quarter, state, columns):
     transaction_data = parsed_data['data']['transactionData']
+    row_count = len(transaction_data)
 
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    names, counts, amounts = columns['name'], columns['count'], columns['amount']
     for transaction in transaction_data:
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'name': transaction['name'],
-            'count': transaction['paymentInstruments'][0]['count'],
-            'amount': transaction['paymentInstruments'][0]['amount'],
-        }
-        table.append(row)
+        payment_instrument = transaction['paymentInstruments'][0]
+        names.append(transaction['name'])
+        counts.append(payment_instrument['count'])
+        amounts.append(payment_instrument['amount'])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_aggregated_insurance_state_data(parsed_data):
-    table = []
+def extract_aggregated_insurance_state_data(parsed_data, year, quarter, state, columns):
     from_timestamp = parsed_data['data']['from']
     to_timestamp = parsed_data['data']['to']
     transaction_data = parsed_data['data']['transactionData']
-
+    row_count = len(transaction_data)
+
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['from_timestamp'].extend(repeat(from_timestamp, row_count))
+    columns['to_timestamp'].extend(repeat(to_timestamp, row_count))
+    names, counts, amounts = columns['type_of_transaction'], columns['number_of_transactions'], columns['total_amount']
     for transaction in transaction_data:
-        row = {
-            'state': state.replace('-', ' ').title(),
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'from_timestamp': from_timestamp,
-            'to_timestamp': to_timestamp,
-            'type_of_transaction': transaction['name'],
-            'number_of_transactions': transaction['paymentInstruments'][0]['count'],
-            'total_amount': transaction['paymentInstruments'][0]['amount'],
-        }
-        table.append(row)
-
-    return pd.DataFrame(table)
-
-
-def extract_aggregated_transaction_country_data(parsed_data):
-    table = []
+        payment_instrument = transaction['paymentInstruments'][0]
+        names.append(transaction['name'])
+        counts.append(payment_instrument['count'])
+        amounts.append(payment_instrument['amount'])
+
+    return row_count
+
+
+def extract_aggregated_transaction_country_data(parsed_data, year, quarter, state, columns):
     transaction_data = parsed_data['data']['transactionData']
+    row_count = len(transaction_data)
 
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    names, counts, amounts = columns['name'], columns['count'], columns['amount']
     for transaction in transaction_data:
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'name': transaction['name'],
-            'count': transaction['paymentInstruments'][0]['count'],
-            'amount': transaction['paymentInstruments'][0]['amount'],
-        }
-        table.append(row)
+        payment_instrument = transaction['paymentInstruments'][0]
+        names.append(transaction['name'])
+        counts.append(payment_instrument['count'])
+        amounts.append(payment_instrument['amount'])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_aggregated_transaction_state_data(parsed_data):
-    table = []
-    from_timestamp = parsed_data['data']['from']
-    to_timestamp = parsed_data['data']['to']
+def extract_aggregated_transaction_state_data(parsed_data, year, quarter, state, columns):
     transaction_data = parsed_data['data']['transactionData']
+    row_count = len(transaction_data)
 
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    names, counts, amounts = columns['type_of_transaction'], columns['number_of_transactions'], columns['total_amount']
     for transaction in transaction_data:
-        row = {
-            'state': state.replace('-', ' ').title(),
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'type_of_transaction': transaction['name'],
-            'number_of_transactions': transaction['paymentInstruments'][0]['count'],
-            'total_amount': transaction['paymentInstruments'][0]['amount'],
-        }
-        table.append(row)
+        payment_instrument = transaction['paymentInstruments'][0]
+        names.append(transaction['name'])
+        counts.append(payment_instrument['count'])
+        amounts.append(payment_instrument['amount'])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_aggregated_user_country_data(parsed_data):
-    table = []
+def extract_aggregated_user_country_data(parsed_data, year, quarter, state, columns):
     registered_users = parsed_data["data"]["aggregated"]["registeredUsers"]
     total_open_apps = parsed_data["data"]["aggregated"]["appOpens"]
     users_by_device = parsed_data["data"]["usersByDevice"]
 
-    if users_by_device is not None:
-        for user_device in users_by_device:
-            row = {
-                'year': int(os.path.basename(os.path.dirname(file_path))),
-                'quarter': int(file.split('.')[0]),
-                "registered_users": registered_users,
-                "total_open_apps": total_open_apps,
-                "phone_brand": user_device["brand"],
-                "phone_count": user_device["count"],
-                "Percentage": f"{user_device['percentage'] * 100:.2f}",
-            }
-            table.append(row)
+    if users_by_device is None:
+        return 0
 
-    return pd.DataFrame(table)
+    row_count = len(users_by_device)
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['registered_users'].extend(repeat(registered_users, row_count))
+    columns['total_open_apps'].extend(repeat(total_open_apps, row_count))
+    brands, counts, percentages = columns['phone_brand'], columns['phone_count'], columns['Percentage']
+    for user_device in users_by_device:
+        brands.append(user_device["brand"])
+        counts.append(user_device["count"])
+        percentages.append(round(user_device['percentage'] * 100, 2))
 
+    return row_count
 
-def extract_aggregated_user_state_data(parsed_data):
-    table = []
+
+def extract_aggregated_user_state_data(parsed_data, year, quarter, state, columns):
     registered_users = parsed_data["data"]["aggregated"]["registeredUsers"]
     total_open_apps = parsed_data["data"]["aggregated"]["appOpens"]
     users_by_device = parsed_data["data"]["usersByDevice"]
 
-    if users_by_device is not None:
-        for user_device in users_by_device:
-            row = {
-                'state': state.replace('-', ' ').title(),
-                'year': int(os.path.basename(os.path.dirname(file_path))),
-                'quarter': int(file.split('.')[0]),
-                "registered_users": registered_users,
-                "total_open_apps": total_open_apps,
-                "phone_brand": user_device["brand"],
-                "phone_count": user_device["count"],
-                "Percentage": f"{user_device['percentage'] * 100:.2f}",
-            }
-            table.append(row)
-
-    return pd.DataFrame(table)
-
-
-def extract_map_insurance_hover_country_data(parsed_data):
-    table = []
+    if users_by_device is None:
+        return 0
+
+    row_count = len(users_by_device)
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['registered_users'].extend(repeat(registered_users, row_count))
+    columns['total_open_apps'].extend(repeat(total_open_apps, row_count))
+    brands, counts, percentages = columns['phone_brand'], columns['phone_count'], columns['Percentage']
+    for user_device in users_by_device:
+        brands.append(user_device["brand"])
+        counts.append(user_device["count"])
+        percentages.append(round(user_device['percentage'] * 100, 2))
+
+    return row_count
+
+
+def extract_map_insurance_hover_country_data(parsed_data, year, quarter, state, columns):
     hover_data_list = parsed_data["data"]["hoverDataList"]
+    row_count = len(hover_data_list)
 
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    states, counts, amounts = columns['state'], columns['total_transactions_count'], columns['total_transactions_amount']
     for entry in hover_data_list:
         metric_data = entry["metric"][0]
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'state': entry["name"].replace('-', ' ').title(),
-            'total_transactions_count': metric_data["count"],
-            'total_transactions_amount': metric_data["amount"],
-        }
-        table.append(row)
+        states.append(state_display_name(entry["name"]))
+        counts.append(metric_data["count"])
+        amounts.append(metric_data["amount"])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_map_insurance_hover_state_data(parsed_data):
-    table = []
+def extract_map_insurance_hover_state_data(parsed_data, year, quarter, state, columns):
     hover_data_list = parsed_data["data"]["hoverDataList"]
+    row_count = len(hover_data_list)
 
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    districts, counts, amounts = columns['districts_name'], columns['total_transactions_count'], columns['total_transactions_amount']
     for entry in hover_data_list:
-        district_name = entry["name"].replace('-', ' ').title(),
         metric_data = entry["metric"][0]
-        total_transactions_count = metric_data["count"]
-        total_transactions_amount = metric_data["amount"]
+        districts.append(district_display_name(entry["name"]))
+        counts.append(metric_data["count"])
+        amounts.append(metric_data["amount"])
 
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'state': state.replace('-', ' ').title(),
-            'districts_name': district_name,
-            'total_transactions_count': total_transactions_count,
-            'total_transactions_amount': total_transactions_amount,
-        }
-        table.append(row)
+    return row_count
 
-    return pd.DataFrame(table)
 
-
-def extract_map_transaction_hover_country_data(parsed_data):
-    table = []
+def extract_map_transaction_hover_country_data(parsed_data, year, quarter, state, columns):
     hover_data_list = parsed_data["data"]["hoverDataList"]
+    row_count = len(hover_data_list)
 
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    states, counts, amounts = columns['state'], columns['total_transactions_count'], columns['total_transactions_amount']
     for entry in hover_data_list:
         metric_data = entry["metric"][0]
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'state': entry["name"].replace('-', ' ').title(),
-            'total_transactions_count': metric_data["count"],
-            'total_transactions_amount': metric_data["amount"],
-        }
-        table.append(row)
+        states.append(state_display_name(entry["name"]))
+        counts.append(metric_data["count"])
+        amounts.append(metric_data["amount"])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_map_transaction_hover_state_data(parsed_data):
-    table = []
+def extract_map_transaction_hover_state_data(parsed_data, year, quarter, state, columns):
     hover_data_list = parsed_data["data"]["hoverDataList"]
+    row_count = len(hover_data_list)
 
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    districts, counts, amounts = columns['districts_name'], columns['total_transactions_count'], columns['total_transactions_amount']
     for entry in hover_data_list:
-        district_name = entry["name"]
         metric_data = entry["metric"][0]
-        total_transactions_count = metric_data["count"]
-        total_transactions_amount = metric_data["amount"]
-
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'state': state.replace('-', ' ').title(),
-            'districts_name': district_name,
-            'total_transactions_count': total_transactions_count,
-            'total_transactions_amount': total_transactions_amount,
-        }
-        table.append(row)
+        districts.append(district_display_name(entry["name"]))
+        counts.append(metric_data["count"])
+        amounts.append(metric_data["amount"])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_map_user_hover_country_data(parsed_data):
-    table = []
+def extract_map_user_hover_country_data(parsed_data, year, quarter, state, columns):
     hover_data = parsed_data["data"]["hoverData"]
+    row_count = len(hover_data)
 
-    for state, state_data in hover_data.items():
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'state': state.replace('-', ' ').title(),
-            'registered_users': state_data["registeredUsers"],
-        }
-        table.append(row)
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    states, registered_users = columns['state'], columns['registered_users']
+    for state_name, state_data in hover_data.items():
+        states.append(state_display_name(state_name))
+        registered_users.append(state_data["registeredUsers"])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_map_user_hover_state_data(parsed_data):
-    table = []
+def extract_map_user_hover_state_data(parsed_data, year, quarter, state, columns):
     hover_data = parsed_data["data"]["hoverData"]
+    row_count = len(hover_data)
 
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    districts, registered_users = columns['districts_name'], columns['registered_users']
     for district, district_data in hover_data.items():
-        row = {
-            'year': int(os.path.basename(os.path.dirname(file_path))),
-            'quarter': int(file.split('.')[0]),
-            'state': state.replace('-', ' ').title(),
-            'districts_name': district,
-            'registered_users': district_data["registeredUsers"],
-        }
-        table.append(row)
+        districts.append(district_display_name(district))
+        registered_users.append(district_data["registeredUsers"])
 
-    return pd.DataFrame(table)
+    return row_count
 
 
-def extract_top_insurance_country_data(parsed_data):
-    entity_data = []
-    for entity_type in ['states', 'districts', 'pincodes']:
-        entities = parsed_data['data'][entity_type]
+# Entity lists of the top files, and how their names are written: states and
+# districts like everywhere else, pincodes (sometimes null) as they are
+TOP_ENTITY_NAMES = [('states', state_display_name), ('districts', district_display_name), ('pincodes', None)]
 
+
+def extend_top_metric_entities(parsed_data, columns):
+    # Shared by the top insurance and transaction files: one row per state,
+    # district and pincode entity. The state files have no 'states' list.
+    row_count = 0
+
+    for entity_type, display_name in TOP_ENTITY_NAMES:
+        entities = parsed_data['data'].get(entity_type)
+        if entities is None:
+            continue
+
+        entity_count = len(entities)
+        columns['entity_type'].extend(repeat(entity_type, entity_count))
+        entity_names, transaction_types = columns['entity_name'], columns['transaction_type']
+        counts, amounts = columns['count'], columns['amount']
         for entity in entities:
-            entity_row = {
-                'year': int(os.path.basename(os.path.dirname(file_path))),
-                'quarter': int(file.split('.')[0]),
-                'entity_type': entity_type,
-                'entity_name': entity['entityName'],
-                'transaction_type': entity['metric']['type'],
-                'count': entity['metric']['count'],
-                'amount': entity['metric']['amount'],
-            }
-            entity_data.append(entity_row)
-
-    return pd.DataFrame(entity_data)
-
-
-def extract_top_insurance_state_data(parsed_data):
-    for entity_type in ['states', 'districts', 'pincodes']:
+            entity_metric = entity['metric']
+            entity_name = entity['entityName']
+            entity_names.append(entity_name if display_name is None else display_name(entity_name))
+            transaction_types.append(entity_metric['type'])
+            counts.append(entity_metric['count'])
+            amounts.append(entity_metric['amount'])
+        row_count += entity_count
+
+    return row_count
+
+
+def extend_top_user_entities(parsed_data, columns):
+    # The top user files list registered users per entity instead of a metric
+    row_count = 0
+
+    for entity_type, display_name in TOP_ENTITY_NAMES:
         entities = parsed_data['data'].get(entity_type)
+        if entities is None:
+            continue
+
+        entity_count = len(entities)
+        columns['entity_type'].extend(repeat(entity_type, entity_count))
+        entity_names, registered_users = columns['entity_name'], columns['registeredUsers']
+        for entity in entities:
+            entity_name = entity['name']
+            entity_names.append(entity_name if display_name is None else display_name(entity_name))
+            registered_users.append(entity['registeredUsers'])
+        row_count += entity_count
+
+    return row_count
+
+
+def extract_top_insurance_country_data(parsed_data, year, quarter, state, columns):
+    row_count = extend_top_metric_entities(parsed_data, columns)
+
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    return row_count
+
+
+def extract_top_insurance_state_data(parsed_data, year, quarter, state, columns):
+    row_count = extend_top_metric_entities(parsed_data, columns)
+
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    return row_count
+
+
+def extract_top_transaction_country_data(parsed_data, year, quarter, state, columns):
+    row_count = extend_top_metric_entities(parsed_data, columns)
+
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    return row_count
+
+
+def extract_top_transaction_state_data(parsed_data, year, quarter, state, columns):
+    row_count = extend_top_metric_entities(parsed_data, columns)
+
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    return row_count
+
+
+def extract_top_user_country_data(parsed_data, year, quarter, state, columns):
+    row_count = extend_top_user_entities(parsed_data, columns)
+
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    return row_count
+
+
+def extract_top_user_state_data(parsed_data, year, quarter, state, columns):
+    row_count = extend_top_user_entities(parsed_data, columns)
+
+    columns['year'].extend(repeat(year, row_count))
+    columns['quarter'].extend(repeat(quarter, row_count))
+    columns['state'].extend(repeat(state_column_value(state), row_count))
+    return row_count
+
+# Registry of the extraction functions: (dataset, scope) from the scanner ->
+# (table the rows are written to, extraction function). The table names are
+# the ones the pages read, spelling included.
+EXTRACTION_REGISTRY = {
+    ('aggregated_insurance', 'country'): ('aggregated_insurence_country', extract_aggregated_insurance_country_data),
+    ('aggregated_insurance', 'state'): ('aggregated_insurence_state', extract_aggregated_insurance_state_data),
+    ('aggregated_transaction', 'country'): ('agregated_transaction_country', extract_aggregated_transaction_country_data),
+    ('aggregated_transaction', 'state'): ('aggregated_transaction_state', extract_aggregated_transaction_state_data),
+    ('aggregated_user', 'country'): ('aggregated_user_counry', extract_aggregated_user_country_data),
+    ('aggregated_user', 'state'): ('agregated_user_state', extract_aggregated_user_state_data),
+    ('map_insurance', 'country'): ('map_insurence_hover_counry', extract_map_insurance_hover_country_data),
+    ('map_insurance', 'state'): ('map_insurence_hover_state', extract_map_insurance_hover_state_data),
+    ('map_transaction', 'country'): ('map_transaction_hover_counry', extract_map_transaction_hover_country_data),
+    ('map_transaction', 'state'): ('map_transaction_hover_state', extract_map_transaction_hover_state_data),
+    ('map_user', 'country'): ('map_user_hover_contry', extract_map_user_hover_country_data),
+    ('map_user', 'state'): ('map_user_hover_state', extract_map_user_hover_state_data),
+    ('top_insurance', 'country'): ('top_insurence_country', extract_top_insurance_country_data),
+    ('top_insurance', 'state'): ('top_insurance_state', extract_top_insurance_state_data),
+    ('top_transaction', 'country'): ('top_transaction_country', extract_top_transaction_country_data),
+    ('top_transaction', 'state'): ('top_transaction_state', extract_top_transaction_state_data),
+    ('top_user', 'country'): ('top_user_country', extract_top_user_country_data),
+    ('top_user', 'state'): ('top_user_state', extract_top_user_state_data),
+}
+
+# Datasets the scanner has to visit; everything else is skipped without being walked
+INGESTED_DATASETS = {dataset for dataset, scope in EXTRACTION_REGISTRY}
+
+if __name__ == '__main__':
+    # Database connection: the SQLite file the pages read. The table writers
+    # share it, so wait for the write lock instead of failing after 5 seconds.
+    engine = create_engine('sqlite:///test.sqlite', connect_args={'timeout': 60})
+
+    # Example usage, run from the repository root with `python -m extraction.extraction`
+    # (the pool workers need this block to stay behind the main guard)
+    data_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+    tables = process_data(data_directory, engine, workers=os.cpu_count(),
+                          report_path='ingest_report.json', progress_interval=5)
+
+    # Full rebuilds are fastest through the bulk-load mode
+    # tables = bulk_load_data(data_directory, engine, workers=os.cpu_count())
 
-        if entities is not None:
-            entity_data = []
-
-            for entity in entities:
-                entity_name = entity["entityName"]
-                entity_metric = entity["metric"]
-
-                row = {
-                    'year': int(os.path.basename(os.path.dirname(file_path))),
-                    'quarter': int(file.split('.')[0]),
-                    'entity_type': entity_type,
-                    'entity_name': entity_name,
-                    'transaction_type': entity_metric['type'],
-                    'count': entity_metric['count'],
-                    'amount': entity_metric['amount'],
-                }
-                entity_data.append(row)
-
-            return pd.DataFrame(entity_data)
-
-# Function to choose appropriate data extraction function
-def choose_appropriate_data_extraction_function(data_type, subfolder_name, state):
-    if data_type == 'aggregated':
-        if subfolder_name == 'insurance':
-            if state is not None:
-                return extract_aggregated_insurance_state_data
-            else:
-                return extract_aggregated_insurance_country_data
-        elif subfolder_name == 'user':
-            if state is not None:
-                return extract_aggregated_user_state_data
-            else:
-                return extract_aggregated_user_country_data
-        elif subfolder_name == 'transaction':
-            if state is not None:
-                return extract_aggregated_transaction_state_data
-            else:
-                return extract_aggregated_transaction_country_data
-    elif data_type == 'map':
-        if subfolder_name == 'insurance':
-            if state is not None:
-                return extract_map_insurance_hover_state_data
-            else:
-                return extract_map_insurance_hover_country_data
-        elif subfolder_name == 'transaction':
-            if state is not None:
-                return extract_map_transaction_hover_state_data
-            else:
-                return extract_map_transaction_hover_country_data
-        elif subfolder_name == 'user':
-            if state is not None:
-                return extract_map_user_hover_state_data
-            else:
-                return extract_map_user_hover_country_data
-    elif data_type == 'top':
-        if subfolder_name == 'insurance':
-            if state is not None:
-                return extract_top_insurance_state_data
-            else:
-                return extract_top_insurance_country_data
-
-# Database connection
-engine = create_engine('sqlite:///mydatabase.db')
-
-# Example usage
-data_directory = '/home/user/pulse/data'
-df = process_data(data_directory, engine)
+    # Later runs only need to pick up the newly published quarters
+    # refresh_data(data_directory, engine, workers=os.cpu_count())
@@ -0,0 +1,83 @@
+# Canonical names of the states and union territories. The PhonePe tree
+# spells a state three ways: the folder slug ('andaman-&-nicobar-islands'),
+# the lower-case name in the country files ('andaman & nicobar islands') and
+# the entity names of the top files. The extraction functions write every
+# one of them as the display name, and the geography table maps each state
+# to its name in the India states geojson the maps are drawn with
+# (properties.ST_NM), so the pages join on it instead of fixing up names.
+#   geography(id INTEGER PRIMARY KEY, slug TEXT UNIQUE, state TEXT UNIQUE, geojson_name TEXT)
+
+GEOGRAPHY_TABLE = 'geography'
+
+# slug -> (display name, geojson ST_NM)
+STATE_GEOGRAPHY = {
+    'andaman-&-nicobar-islands': ('Andaman & Nicobar Islands', 'Andaman & Nicobar'),
+    'andhra-pradesh': ('Andhra Pradesh', 'Andhra Pradesh'),
+    'arunachal-pradesh': ('Arunachal Pradesh', 'Arunachal Pradesh'),
+    'assam': ('Assam', 'Assam'),
+    'bihar': ('Bihar', 'Bihar'),
+    'chandigarh': ('Chandigarh', 'Chandigarh'),
+    'chhattisgarh': ('Chhattisgarh', 'Chhattisgarh'),
+    'dadra-&-nagar-haveli-&-daman-&-diu': ('Dadra & Nagar Haveli & Daman & Diu',
+                                           'Dadra and Nagar Haveli and Daman and Diu'),
+    'delhi': ('Delhi', 'Delhi'),
+    'goa': ('Goa', 'Goa'),
+    'gujarat': ('Gujarat', 'Gujarat'),
+    'haryana': ('Haryana', 'Haryana'),
+    'himachal-pradesh': ('Himachal Pradesh', 'Himachal Pradesh'),
+    'jammu-&-kashmir': ('Jammu & Kashmir', 'Jammu & Kashmir'),
+    'jharkhand': ('Jharkhand', 'Jharkhand'),
+    'karnataka': ('Karnataka', 'Karnataka'),
+    'kerala': ('Kerala', 'Kerala'),
+    'ladakh': ('Ladakh', 'Ladakh'),
+    'lakshadweep': ('Lakshadweep', 'Lakshadweep'),
+    'madhya-pradesh': ('Madhya Pradesh', 'Madhya Pradesh'),
+    'maharashtra': ('Maharashtra', 'Maharashtra'),
+    'manipur': ('Manipur', 'Manipur'),
+    'meghalaya': ('Meghalaya', 'Meghalaya'),
+    'mizoram': ('Mizoram', 'Mizoram'),
+    'nagaland': ('Nagaland', 'Nagaland'),
+    'odisha': ('Odisha', 'Odisha'),
+    'puducherry': ('Puducherry', 'Puducherry'),
+    'punjab': ('Punjab', 'Punjab'),
+    'rajasthan': ('Rajasthan', 'Rajasthan'),
+    'sikkim': ('Sikkim', 'Sikkim'),
+    'tamil-nadu': ('Tamil Nadu', 'Tamil Nadu'),
+    'telangana': ('Telangana', 'Telangana'),
+    'tripura': ('Tripura', 'Tripura'),
+    'uttar-pradesh': ('Uttar Pradesh', 'Uttar Pradesh'),
+    'uttarakhand': ('Uttarakhand', 'Uttarakhand'),
+    'west-bengal': ('West Bengal', 'West Bengal'),
+}
+
+
+def state_slug(name):
+    # Folder slug of a state from any of its PhonePe spellings, including the
+    # CSV snapshot's, which writes '&' as 'and' ('andaman--and-nicobar-islands')
+    return name.strip().lower().replace(' ', '-').replace('--and-', '-&-')
+
+
+def state_display_name(name):
+    # Display name of a state from any of its PhonePe spellings. Names that
+    # are not in STATE_GEOGRAPHY are title-cased, as they always were.
+    geography = STATE_GEOGRAPHY.get(state_slug(name))
+    if geography is None:
+        return name.replace('-', ' ').title()
+    return geography[0]
+
+
+def district_display_name(name):
+    # Districts have no geojson here; every table spells them title-cased
+    return name.replace('-', ' ').title()
+
+
+def geography_statements():
+    # SQL rebuilding the geography table
+    rows = ', '.join("('{}', '{}', '{}')".format(slug, display_name, geojson_name)
+                     for slug, (display_name, geojson_name) in STATE_GEOGRAPHY.items())
+    return [
+        f'DROP TABLE IF EXISTS {GEOGRAPHY_TABLE}',
+        f'CREATE TABLE {GEOGRAPHY_TABLE} (id INTEGER PRIMARY KEY, slug TEXT NOT NULL UNIQUE, '
+        f'state TEXT NOT NULL UNIQUE, geojson_name TEXT NOT NULL)',
+        f'INSERT INTO {GEOGRAPHY_TABLE} (slug, state, geojson_name) VALUES {rows}',
+    ]
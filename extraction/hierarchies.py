@@ -0,0 +1,75 @@
+from extraction.rollups import ROLLUP_MEASURES
+
+# Hierarchy node tables for the treemap and sunburst charts. Plotly Express
+# builds a chart's hierarchy from the fact rows on every render; the ingest
+# builds it once per standard path instead, with the rollups:
+#   hierarchy_<table>_<path>(id, parent, label, depth, the path columns,
+#   SUM of every measure)
+# One row per node at every depth of the path. A node's id is its path values
+# joined with '/', as Plotly Express writes them, its parent the id one level
+# up ('' at the top), and the path columns below its depth are NULL.
+
+# Path name -> path columns, outermost first. A table gets every path whose
+# columns it has.
+HIERARCHY_PATHS = {
+    'state_year': ['state', 'year'],
+    'state_year_quarter': ['state', 'year', 'quarter'],
+    'state_year_type': ['state', 'year', 'type_of_transaction'],
+    'state_year_quarter_type': ['state', 'year', 'quarter', 'type_of_transaction'],
+    'year_quarter': ['year', 'quarter'],
+}
+
+
+def hierarchy_table_name(table_name, path_name):
+    return f'hierarchy_{table_name}_{path_name}'
+
+
+def hierarchy_path_name(path):
+    # Name of the standard path with these columns, None if there is none
+    for path_name, path_columns in HIERARCHY_PATHS.items():
+        if path_columns == list(path):
+            return path_name
+    return None
+
+
+def table_hierarchy_paths(table_name, table_columns):
+    # The paths a fact table gets node tables for, in HIERARCHY_PATHS order
+    if table_name not in ROLLUP_MEASURES:
+        return []
+    return [path_name for path_name, path_columns in HIERARCHY_PATHS.items()
+            if all(column in table_columns for column in path_columns)]
+
+
+def node_id_sql(columns):
+    if not columns:
+        return "''"
+    return " || '/' || ".join(f'CAST("{column}" AS TEXT)' for column in columns)
+
+
+def hierarchy_select_sql(table_name, path_name):
+    # The SELECT computing one node table from its fact table. The leaves
+    # come first, so the path columns take their types from the fact table.
+    path = HIERARCHY_PATHS[path_name]
+    measure_list = ', '.join(f'SUM("{measure}") AS "{measure}"' for measure in ROLLUP_MEASURES[table_name])
+    levels = []
+    for depth in range(len(path), 0, -1):
+        level_columns = path[:depth]
+        column_list = ', '.join(f'"{column}"' if column in level_columns else f'NULL AS "{column}"'
+                                for column in path)
+        group_list = ', '.join(f'"{column}"' for column in level_columns)
+        levels.append(f'SELECT {node_id_sql(level_columns)} AS id, {node_id_sql(level_columns[:-1])} AS parent, '
+                      f'CAST("{level_columns[-1]}" AS TEXT) AS label, {depth} AS depth, {column_list}, '
+                      f'{measure_list} FROM {table_name} GROUP BY {group_list}')
+    return ' UNION ALL '.join(levels) + ' ORDER BY depth, id'
+
+
+def hierarchy_statements(table_name, table_columns):
+    # SQL rebuilding every node table of a fact table
+    statements = []
+
+    for path_name in table_hierarchy_paths(table_name, table_columns):
+        hierarchy_table = hierarchy_table_name(table_name, path_name)
+        statements.append(f'DROP TABLE IF EXISTS {hierarchy_table}')
+        statements.append(f'CREATE TABLE {hierarchy_table} AS {hierarchy_select_sql(table_name, path_name)}')
+
+    return statements
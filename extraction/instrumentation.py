@@ -0,0 +1,149 @@
+import json
+import time
+import heapq
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Counters and timers of one ingest run. The extraction shards fill their own
+# stats dict in the worker processes, and the shards are merged into the run's
+# stats as they come back, so the counters are the same with or without a pool.
+#
+# Stages:
+#   scan     walking the data directory
+#   read     reading the JSON files            (summed over the worker processes)
+#   parse    json.loads                        (summed over the worker processes)
+#   extract  the extract_* functions           (summed over the worker processes)
+#   frame    building DataFrames from the column batches
+#   write    to_sql                            (summed over the writer threads)
+#   index    creating the indexes
+#   rollup   rebuilding the rollup, hierarchy and dimension tables
+STAGES = ('scan', 'read', 'parse', 'extract', 'frame', 'write', 'index', 'rollup')
+
+# How many of the slowest files and of the errors are kept for the report
+SLOWEST_FILES = 10
+MAX_ERRORS = 100
+
+
+def new_ingest_stats():
+    return {
+        'stages': dict.fromkeys(STAGES, 0.0),
+        'datasets': {},
+        'slowest_files': [],
+        'errors': [],
+        'error_count': 0,
+    }
+
+
+def add_stage_time(stats, stage, seconds):
+    stats['stages'][stage] += seconds
+
+
+@contextmanager
+def stage_timer(stats, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(stats, stage, time.perf_counter() - start)
+
+
+def dataset_counters(stats, dataset):
+    counters = stats['datasets'].get(dataset)
+    if counters is None:
+        counters = stats['datasets'][dataset] = {'files': 0, 'bytes': 0, 'rows': 0, 'errors': 0}
+    return counters
+
+
+def record_file(stats, data_file, file_bytes, rows, seconds, error=None):
+    # Count one extracted file; seconds is its read + parse + extract time
+    counters = dataset_counters(stats, data_file.dataset)
+    counters['files'] += 1
+    counters['bytes'] += file_bytes
+    counters['rows'] += rows
+
+    if error is not None:
+        counters['errors'] += 1
+        stats['error_count'] += 1
+        if len(stats['errors']) < MAX_ERRORS:
+            stats['errors'].append({'path': data_file.path, 'dataset': data_file.dataset, 'error': error})
+
+    entry = (seconds, data_file.path, data_file.dataset, file_bytes, rows)
+    if len(stats['slowest_files']) < SLOWEST_FILES:
+        heapq.heappush(stats['slowest_files'], entry)
+    else:
+        heapq.heappushpop(stats['slowest_files'], entry)
+
+
+def merge_ingest_stats(target, source):
+    for stage, seconds in source['stages'].items():
+        target['stages'][stage] += seconds
+
+    for dataset, source_counters in source['datasets'].items():
+        counters = dataset_counters(target, dataset)
+        for counter, value in source_counters.items():
+            counters[counter] += value
+
+    # Keep the slowest files as a min-heap so record_file can keep pushing to it
+    target['slowest_files'] = heapq.nlargest(SLOWEST_FILES, target['slowest_files'] + source['slowest_files'])
+    heapq.heapify(target['slowest_files'])
+    target['errors'].extend(source['errors'][:MAX_ERRORS - len(target['errors'])])
+    target['error_count'] += source['error_count']
+
+
+def ingest_totals(stats):
+    totals = {'files': 0, 'bytes': 0, 'rows': 0, 'errors': 0}
+    for counters in stats['datasets'].values():
+        for counter in totals:
+            totals[counter] += counters[counter]
+    return totals
+
+
+def start_progress(stats, total_files, interval):
+    # Print a progress line at most every interval seconds while shards come back
+    stats['progress'] = {'total_files': total_files, 'interval': interval,
+                         'started': time.perf_counter(), 'last_printed': time.perf_counter()}
+
+
+def report_progress(stats):
+    progress = stats.get('progress')
+    if progress is None or progress['interval'] is None:
+        return
+
+    now = time.perf_counter()
+    if now - progress['last_printed'] < progress['interval']:
+        return
+    progress['last_printed'] = now
+
+    totals = ingest_totals(stats)
+    elapsed = now - progress['started']
+    print(f"Ingest progress: {totals['files']}/{progress['total_files']} files, {totals['rows']} rows, "
+          f"{totals['errors']} errors, {totals['files'] / elapsed:.0f} files/s after {elapsed:.1f}s")
+
+
+def build_run_report(stats, data_directory, workers, batch_size, wall_seconds, tables):
+    # The JSON-serialisable summary of a run
+    return {
+        'finished': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'data_directory': data_directory,
+        'workers': workers,
+        'batch_size': batch_size,
+        'wall_seconds': round(wall_seconds, 4),
+        'stages': {stage: round(seconds, 4) for stage, seconds in stats['stages'].items()},
+        'totals': ingest_totals(stats),
+        'datasets': stats['datasets'],
+        'tables': tables,
+        'slowest_files': [
+            {'path': path, 'dataset': dataset, 'bytes': file_bytes, 'rows': rows, 'seconds': round(seconds, 6)}
+            for seconds, path, dataset, file_bytes, rows in sorted(stats['slowest_files'], reverse=True)
+        ],
+        'error_count': stats['error_count'],
+        'errors': stats['errors'],
+    }
+
+
+def write_run_report(report, report_path):
+    try:
+        with open(report_path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    except OSError as e:
+        print(f"Failed to write the ingest report to {report_path}: {e}")
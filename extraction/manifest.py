@@ -0,0 +1,107 @@
+import os
+import time
+import hashlib
+from sqlalchemy import inspect, text
+
+# Table that remembers which source files have already been ingested. The
+# statements are plain SQLite, shared by the SQLAlchemy ingests and the
+# raw-connection bulk load.
+MANIFEST_TABLE = 'ingest_manifest'
+CREATE_MANIFEST_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime REAL NOT NULL,
+        content_hash TEXT NOT NULL,
+        dataset TEXT NOT NULL,
+        state TEXT,
+        year INTEGER NOT NULL,
+        quarter INTEGER NOT NULL,
+        row_count INTEGER NOT NULL
+    )
+"""
+UPSERT_MANIFEST_SQL = f"""
+    INSERT OR REPLACE INTO {MANIFEST_TABLE}
+        (path, size, mtime, content_hash, dataset, state, year, quarter, row_count)
+    VALUES
+        (:path, :size, :mtime, :content_hash, :dataset, :state, :year, :quarter, :row_count)
+"""
+
+# Single-row table whose version every ingest increments, so readers can
+# tell that their cached query results are stale. The statements are plain
+# SQLite, shared by the SQLAlchemy ingests and the raw-connection bulk load.
+DATA_VERSION_TABLE = 'data_version'
+CREATE_DATA_VERSION_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {DATA_VERSION_TABLE} (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL,
+        updated REAL NOT NULL
+    )
+"""
+BUMP_DATA_VERSION_SQL = f"""
+    INSERT INTO {DATA_VERSION_TABLE} (id, version, updated) VALUES (1, 1, :updated)
+    ON CONFLICT (id) DO UPDATE SET version = version + 1, updated = excluded.updated
+"""
+
+
+def create_manifest_table(connection):
+    connection.execute(text(CREATE_MANIFEST_SQL))
+
+
+def read_manifest(engine):
+    # Load the manifest as {path: entry}; an empty dict means nothing was ingested yet
+    if not inspect(engine).has_table(MANIFEST_TABLE):
+        return {}
+
+    with engine.connect() as connection:
+        result = connection.execute(text(f'SELECT * FROM {MANIFEST_TABLE}'))
+        return {row['path']: dict(row) for row in result.mappings()}
+
+
+def file_fingerprint(file_path):
+    # Cheap change check: size and modification time from a single stat call
+    file_stat = os.stat(file_path)
+    return file_stat.st_size, file_stat.st_mtime
+
+
+def file_content_hash(file_path):
+    with open(file_path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def upsert_manifest_entries(connection, entries):
+    if entries:
+        connection.execute(text(UPSERT_MANIFEST_SQL), entries)
+
+
+def delete_manifest_entries(connection, paths):
+    if paths:
+        connection.execute(text(f'DELETE FROM {MANIFEST_TABLE} WHERE path = :path'),
+                           [{'path': path} for path in paths])
+
+
+def clear_manifest(connection):
+    # Full rebuilds rewrite every table, so the entries of an earlier ingest
+    # no longer describe them
+    connection.execute(text(f'DROP TABLE IF EXISTS {MANIFEST_TABLE}'))
+
+
+def replace_manifest(connection, entries):
+    # The manifest of a full rebuild: exactly the files it ingested, so the
+    # next refresh only parses what changed after it
+    clear_manifest(connection)
+    create_manifest_table(connection)
+    upsert_manifest_entries(connection, entries)
+
+
+def bump_data_version(connection):
+    connection.execute(text(CREATE_DATA_VERSION_SQL))
+    connection.execute(text(BUMP_DATA_VERSION_SQL), {'updated': time.time()})
+
+
+def read_data_version(connection):
+    # 0 for a database no ingest has stamped yet
+    try:
+        return connection.execute(text(f'SELECT version FROM {DATA_VERSION_TABLE}')).scalar() or 0
+    except Exception:
+        return 0
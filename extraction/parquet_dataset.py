@@ -0,0 +1,182 @@
+import os
+import time
+import shutil
+from itertools import chain
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import fs
+from extraction.extraction import EXTRACTION_REGISTRY, scan_ingested_files, iter_column_batches
+from extraction.schema import TABLE_SCHEMAS, table_column_names
+from extraction.manifest import read_data_version
+
+# The tables are partitioned by year and quarter, the columns every page filters on:
+#   <parquet_directory>/dataset=<table>/year=<year>/quarter=<quarter>/part-0.parquet
+PARTITIONING = ds.partitioning(pa.schema([('year', pa.int64()), ('quarter', pa.int64())]), flavor='hive')
+
+# Rewritten after every export so readers can tell their cached results are
+# stale: '<database data version> <export time>'. The database version is the
+# one of the SQLite database the export was taken alongside, and the SQLite
+# backend only reads the export while the database is still at it.
+DATA_VERSION_FILE = '_data_version'
+
+
+def dataset_path(parquet_directory, table_name):
+    return os.path.join(parquet_directory, f'dataset={table_name}')
+
+
+# Arrow type of the columns of each SQLite type of the declared schemas
+SQL_TYPE_ARROW_TYPES = {'INTEGER': pa.int64(), 'REAL': pa.float64(), 'TEXT': pa.string()}
+
+
+def arrow_schema(table_name):
+    return pa.schema([pa.field(column, SQL_TYPE_ARROW_TYPES[sql_type], nullable=nullable)
+                      for column, sql_type, nullable in TABLE_SCHEMAS[table_name]['columns']])
+
+
+def iter_record_batches(column_batches):
+    # Turn (table_name, columns) batches of one table into Arrow record
+    # batches of the table's declared schema
+    schema = None
+    for table_name, columns in column_batches:
+        if schema is None:
+            schema = arrow_schema(table_name)
+        yield pa.RecordBatch.from_pydict(columns, schema=schema)
+
+
+def clear_parquet_directory(parquet_directory):
+    # Remove the stamp first, so readers stop trusting the export, then every
+    # dataset, so no partition of an earlier export survives a full one
+    try:
+        os.remove(os.path.join(parquet_directory, DATA_VERSION_FILE))
+    except FileNotFoundError:
+        pass
+    if not os.path.isdir(parquet_directory):
+        return
+    for entry in os.scandir(parquet_directory):
+        if entry.is_dir() and entry.name.startswith('dataset='):
+            shutil.rmtree(entry.path)
+
+
+def write_parquet_dataset(data_directory, parquet_directory, workers=1, batch_size=50000, compression='zstd',
+                          engine=None):
+    # Extract the JSON tree into one Hive-partitioned, compressed Parquet
+    # dataset per table. Each file is parsed once, and batches are streamed
+    # into the partition files, so memory stays bounded like stream_data.
+    # engine: the database ingested from the same tree; the export is stamped
+    # with its data version. Without it the SQLite backend never reads the
+    # export (the DuckDB backend still does).
+    database_version = None
+    if engine is not None:
+        with engine.connect() as connection:
+            database_version = read_data_version(connection)
+
+    clear_parquet_directory(parquet_directory)
+    files_by_table = {}
+    for data_file in scan_ingested_files(data_directory):
+        table_name = EXTRACTION_REGISTRY[(data_file.dataset, data_file.scope)][0]
+        files_by_table.setdefault(table_name, []).append(data_file)
+
+    file_options = ds.ParquetFileFormat().make_write_options(compression=compression)
+    rows_written = {}
+
+    for table_name, data_files in files_by_table.items():
+        record_batches = iter_record_batches(iter_column_batches(data_files, batch_size, workers))
+        first_batch = next(record_batches, None)
+        if first_batch is None:
+            continue
+
+        written_files = []
+        try:
+            ds.write_dataset(
+                chain([first_batch], record_batches),
+                dataset_path(parquet_directory, table_name),
+                schema=first_batch.schema,
+                format='parquet',
+                partitioning=PARTITIONING,
+                file_options=file_options,
+                existing_data_behavior='error',
+                file_visitor=written_files.append,
+            )
+        except Exception as e:
+            print(f"Failed to write {table_name} to parquet: {e}")
+            continue
+        rows_written[table_name] = sum(written_file.metadata.num_rows for written_file in written_files)
+
+    if rows_written:
+        with open(os.path.join(parquet_directory, DATA_VERSION_FILE), 'w') as version_file:
+            version_file.write(f'{database_version} {time.time_ns()}')
+
+    print(f"Wrote {sum(rows_written.values())} rows into {len(rows_written)} parquet datasets")
+    return rows_written
+
+
+def parquet_dataset_exists(parquet_directory, table_name):
+    return os.path.isdir(dataset_path(parquet_directory, table_name))
+
+
+def open_parquet_dataset(parquet_directory, table_name):
+    # Memory-mapped reads: the column chunks are paged in instead of copied
+    return ds.dataset(dataset_path(parquet_directory, table_name), format='parquet',
+                      partitioning=PARTITIONING, filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def read_parquet_dataset(parquet_directory, table_name, columns=None, years=None, quarters=None, filters=None):
+    # Load a table as a DataFrame, reading only the requested columns and
+    # only the year=/quarter= partitions that match the selection.
+    # filters: {column: values} for the other columns. A None selection
+    # matches everything, an empty one matches nothing. The columns come in
+    # schema order, like SQLite's, not with the partition columns last.
+    dataset = open_parquet_dataset(parquet_directory, table_name)
+
+    selections = dict(filters or {})
+    selections['year'] = years
+    selections['quarter'] = quarters
+
+    dataset_filter = None
+    for column, values in selections.items():
+        if values is None:
+            continue
+        if column in ('year', 'quarter'):
+            values = [int(value) for value in values]
+        column_filter = ds.field(column).isin(list(values))
+        dataset_filter = column_filter if dataset_filter is None else dataset_filter & column_filter
+
+    columns = columns or table_column_names(table_name)
+    return dataset.to_table(columns=columns, filter=dataset_filter).to_pandas()
+
+
+def parquet_column_names(parquet_directory, table_name):
+    # Column names in schema order
+    names = set(open_parquet_dataset(parquet_directory, table_name).schema.names)
+    return [column for column in table_column_names(table_name) if column in names]
+
+
+def parquet_partition_values(parquet_directory, table_name):
+    # (years, quarters) available for a table, read from the partition
+    # directory names without opening any file
+    years, quarters = set(), set()
+
+    for year_entry in os.scandir(dataset_path(parquet_directory, table_name)):
+        if year_entry.is_dir() and year_entry.name.startswith('year='):
+            years.add(int(year_entry.name[len('year='):]))
+            for quarter_entry in os.scandir(year_entry.path):
+                if quarter_entry.is_dir() and quarter_entry.name.startswith('quarter='):
+                    quarters.add(int(quarter_entry.name[len('quarter='):]))
+
+    return sorted(years), sorted(quarters)
+
+
+def parquet_data_version(parquet_directory):
+    # Stamp of the last export, None when there is none
+    try:
+        with open(os.path.join(parquet_directory, DATA_VERSION_FILE)) as version_file:
+            return version_file.read().strip()
+    except OSError:
+        return None
+
+
+def stamp_database_version(stamp):
+    # Database data version an export stamp was written for, None for an
+    # export without one
+    database_version = (stamp or '').split(' ')[0]
+    return int(database_version) if database_version.isdigit() else None
@@ -0,0 +1,86 @@
+# Pre-aggregated copies of the fact tables at the grains the pages chart.
+# They are rebuilt from the fact tables at the end of every ingest, inside
+# the ingest's last transaction, so they never disagree with the facts.
+#   rollup_<table>_<grain>: the grain columns, SUM of every measure and the
+#   number of fact rows summed (row_count)
+# Every rollup is listed in the rollup_catalog table with its grain, its
+# measures and its size, so readers can pick the smallest one that answers
+# a query.
+
+# Grain name -> GROUP BY columns. A table gets every grain whose columns it has.
+ROLLUP_GRAINS = {
+    'state_year': ['state', 'year'],
+    'state': ['state'],
+    'year': ['year'],
+    'year_quarter': ['year', 'quarter'],
+}
+
+# Additive measures of each fact table. The top tables rank overlapping
+# entities (states, districts and pincodes) and are not rolled up. The user
+# tables are not either: registered users, phone counts and their shares are
+# running totals as of each quarter, which do not add up over quarters
+# (semantic_layer's latest() measure reads them).
+ROLLUP_MEASURES = {
+    'aggregated_insurence_country': ['count', 'amount'],
+    'aggregated_insurence_state': ['number_of_transactions', 'total_amount'],
+    'agregated_transaction_country': ['count', 'amount'],
+    'aggregated_transaction_state': ['number_of_transactions', 'total_amount'],
+    'map_insurence_hover_counry': ['total_transactions_count', 'total_transactions_amount'],
+    'map_insurence_hover_state': ['total_transactions_count', 'total_transactions_amount'],
+    'map_transaction_hover_counry': ['total_transactions_count', 'total_transactions_amount'],
+    'map_transaction_hover_state': ['total_transactions_count', 'total_transactions_amount'],
+}
+
+
+ROLLUP_CATALOG_TABLE = 'rollup_catalog'
+CREATE_ROLLUP_CATALOG_SQL = f"""
+    CREATE TABLE IF NOT EXISTS {ROLLUP_CATALOG_TABLE} (
+        rollup_table TEXT PRIMARY KEY,
+        source_table TEXT NOT NULL,
+        grain TEXT NOT NULL,
+        group_columns TEXT NOT NULL,
+        measures TEXT NOT NULL,
+        row_count INTEGER NOT NULL
+    )
+"""
+
+
+def rollup_table_name(table_name, grain):
+    return f'rollup_{table_name}_{grain}'
+
+
+def table_rollup_grains(table_name, table_columns):
+    # The grains a fact table is rolled up to, in ROLLUP_GRAINS order
+    if table_name not in ROLLUP_MEASURES:
+        return []
+    return [grain for grain, group_columns in ROLLUP_GRAINS.items()
+            if all(column in table_columns for column in group_columns)]
+
+
+def rollup_select_sql(table_name, grain):
+    # The SELECT computing one rollup from its fact table
+    group_list = ', '.join(f'"{column}"' for column in ROLLUP_GRAINS[grain])
+    measure_list = ', '.join(f'SUM("{measure}") AS "{measure}"' for measure in ROLLUP_MEASURES[table_name])
+    return (f'SELECT {group_list}, {measure_list}, COUNT(*) AS row_count '
+            f'FROM {table_name} GROUP BY {group_list} ORDER BY {group_list}')
+
+
+def rollup_statements(table_name, table_columns):
+    # SQL rebuilding every rollup of a fact table and its catalog entries.
+    # Plain SQLite, so the same statements run on SQLAlchemy connections and
+    # on the bulk load's raw one, as do the hierarchy, dimension and
+    # geography statements. The catalog entries of rollups a table no
+    # longer gets are dropped, so no query is routed to them.
+    statements = [CREATE_ROLLUP_CATALOG_SQL,
+                  f"DELETE FROM {ROLLUP_CATALOG_TABLE} WHERE source_table = '{table_name}'"]
+
+    for grain in table_rollup_grains(table_name, table_columns):
+        rollup_table = rollup_table_name(table_name, grain)
+        statements.append(f'DROP TABLE IF EXISTS {rollup_table}')
+        statements.append(f'CREATE TABLE {rollup_table} AS {rollup_select_sql(table_name, grain)}')
+        statements.append(f"INSERT OR REPLACE INTO {ROLLUP_CATALOG_TABLE} "
+                          f"SELECT '{rollup_table}', '{table_name}', '{grain}', "
+                          f"'{','.join(ROLLUP_GRAINS[grain])}', '{','.join(ROLLUP_MEASURES[table_name])}', "
+                          f"COUNT(*) FROM {rollup_table}")
+
+    return statements
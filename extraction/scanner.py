@@ -0,0 +1,81 @@
+import os
+from collections import namedtuple
+
+# One JSON file of the PhonePe pulse tree.
+#   dataset: '<data_type>_<subfolder>', e.g. 'aggregated_transaction' or 'map_user'
+#   scope:   'country' for the India-level files, 'state' for the per-state files
+#   state:   the state slug for state files (e.g. 'andhra-pradesh'), None otherwise
+DataFile = namedtuple('DataFile', ['dataset', 'scope', 'state', 'year', 'quarter', 'path'])
+
+DATA_TYPES = ('aggregated', 'map', 'top')
+
+
+def sorted_subdirectories(directory):
+    # (name, path) of the subdirectories of directory, sorted by name; a missing directory has none
+    try:
+        with os.scandir(directory) as entries:
+            return sorted((entry.name, entry.path) for entry in entries if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def scan_year_directories(directory, dataset, scope, state):
+    # directory holds one <year> folder per year with one <quarter>.json file per quarter
+    for year_name, year_path in sorted_subdirectories(directory):
+        if not year_name.isdigit():
+            continue
+        year = int(year_name)
+
+        with os.scandir(year_path) as entries:
+            file_entries = sorted((entry.name, entry.path) for entry in entries
+                                  if entry.name.endswith('.json') and entry.is_file())
+        for file_name, file_path in file_entries:
+            yield DataFile(dataset, scope, state, year, int(file_name[:-len('.json')]), file_path)
+
+
+def scan_data_directory(data_directory, datasets=None):
+    # Walk the tree once and yield a DataFile for every quarter file, in a
+    # stable order: dataset by dataset, the country files before the state files.
+    # Layout: <data_type>/<subfolder>[/hover]/country/india[/state/<state>]/<year>/<quarter>.json
+    # Pass a set of dataset names to skip the other subtrees without visiting them.
+    for data_type, data_type_path in sorted_subdirectories(data_directory):
+        if data_type not in DATA_TYPES:
+            continue
+
+        for subfolder_name, subfolder_path in sorted_subdirectories(data_type_path):
+            dataset = f'{data_type}_{subfolder_name}'
+            if datasets is not None and dataset not in datasets:
+                continue
+
+            # The map data is only published per region under hover/, the
+            # other map files are lat/lng grids
+            if data_type == 'map':
+                subfolder_path = os.path.join(subfolder_path, 'hover')
+
+            india_path = os.path.join(subfolder_path, 'country', 'india')
+            yield from scan_year_directories(india_path, dataset, 'country', None)
+
+            for state, state_path in sorted_subdirectories(os.path.join(india_path, 'state')):
+                yield from scan_year_directories(state_path, dataset, 'state', state)
+
+
+def data_inventory(data_directory, datasets=None):
+    # Cheap summary of what exists on disk, without opening any file:
+    # {(dataset, scope): {'files': n, 'states': n, 'years': [...], 'latest': (year, quarter)}}
+    inventory = {}
+
+    for data_file in scan_data_directory(data_directory, datasets):
+        key = (data_file.dataset, data_file.scope)
+        summary = inventory.setdefault(key, {'files': 0, 'states': set(), 'years': set(), 'latest': None})
+        summary['files'] += 1
+        summary['years'].add(data_file.year)
+        if data_file.state is not None:
+            summary['states'].add(data_file.state)
+        if summary['latest'] is None or (data_file.year, data_file.quarter) > summary['latest']:
+            summary['latest'] = (data_file.year, data_file.quarter)
+
+    for summary in inventory.values():
+        summary['states'] = len(summary['states'])
+        summary['years'] = sorted(summary['years'])
+
+    return inventory
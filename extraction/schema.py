@@ -0,0 +1,147 @@
+# Declared schema of every fact table: its columns in order with their
+# SQLite type and whether they may be NULL, and the columns that identify a
+# row. The tables are created from it as STRICT tables, so SQLite rejects a
+# value of the wrong type instead of storing it as text, and the loader
+# types the frames from it instead of inferring dtypes from the values.
+# Only the entity names of the top tables may be NULL: the pincode entities
+# of the top files sometimes have none.
+TABLE_SCHEMAS = {
+    'aggregated_insurence_country': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('name', 'TEXT', False),
+                    ('count', 'INTEGER', False), ('amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'name'],
+    },
+    'aggregated_insurence_state': {
+        'columns': [('state', 'TEXT', False), ('year', 'INTEGER', False), ('quarter', 'INTEGER', False),
+                    ('from_timestamp', 'INTEGER', False), ('to_timestamp', 'INTEGER', False),
+                    ('type_of_transaction', 'TEXT', False), ('number_of_transactions', 'INTEGER', False),
+                    ('total_amount', 'REAL', False)],
+        'key': ['state', 'year', 'quarter', 'type_of_transaction'],
+    },
+    'agregated_transaction_country': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('name', 'TEXT', False),
+                    ('count', 'INTEGER', False), ('amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'name'],
+    },
+    'aggregated_transaction_state': {
+        'columns': [('state', 'TEXT', False), ('year', 'INTEGER', False), ('quarter', 'INTEGER', False),
+                    ('type_of_transaction', 'TEXT', False), ('number_of_transactions', 'INTEGER', False),
+                    ('total_amount', 'REAL', False)],
+        'key': ['state', 'year', 'quarter', 'type_of_transaction'],
+    },
+    'aggregated_user_counry': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False),
+                    ('registered_users', 'INTEGER', False), ('total_open_apps', 'INTEGER', False),
+                    ('phone_brand', 'TEXT', False), ('phone_count', 'INTEGER', False),
+                    ('Percentage', 'REAL', False)],
+        'key': ['year', 'quarter', 'phone_brand'],
+    },
+    'agregated_user_state': {
+        'columns': [('state', 'TEXT', False), ('year', 'INTEGER', False), ('quarter', 'INTEGER', False),
+                    ('registered_users', 'INTEGER', False), ('total_open_apps', 'INTEGER', False),
+                    ('phone_brand', 'TEXT', False), ('phone_count', 'INTEGER', False),
+                    ('Percentage', 'REAL', False)],
+        'key': ['state', 'year', 'quarter', 'phone_brand'],
+    },
+    'map_insurence_hover_counry': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('total_transactions_count', 'INTEGER', False), ('total_transactions_amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'state'],
+    },
+    'map_insurence_hover_state': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('districts_name', 'TEXT', False), ('total_transactions_count', 'INTEGER', False),
+                    ('total_transactions_amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'state', 'districts_name'],
+    },
+    'map_transaction_hover_counry': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('total_transactions_count', 'INTEGER', False), ('total_transactions_amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'state'],
+    },
+    'map_transaction_hover_state': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('districts_name', 'TEXT', False), ('total_transactions_count', 'INTEGER', False),
+                    ('total_transactions_amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'state', 'districts_name'],
+    },
+    'map_user_hover_contry': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('registered_users', 'INTEGER', False)],
+        'key': ['year', 'quarter', 'state'],
+    },
+    'map_user_hover_state': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('districts_name', 'TEXT', False), ('registered_users', 'INTEGER', False)],
+        'key': ['year', 'quarter', 'state', 'districts_name'],
+    },
+    'top_insurence_country': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('entity_type', 'TEXT', False),
+                    ('entity_name', 'TEXT', True), ('transaction_type', 'TEXT', False),
+                    ('count', 'INTEGER', False), ('amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'entity_type', 'entity_name'],
+    },
+    'top_insurance_state': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('entity_type', 'TEXT', False), ('entity_name', 'TEXT', True),
+                    ('transaction_type', 'TEXT', False), ('count', 'INTEGER', False), ('amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'state', 'entity_type', 'entity_name'],
+    },
+    'top_transaction_country': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('entity_type', 'TEXT', False),
+                    ('entity_name', 'TEXT', True), ('transaction_type', 'TEXT', False),
+                    ('count', 'INTEGER', False), ('amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'entity_type', 'entity_name'],
+    },
+    'top_transaction_state': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('entity_type', 'TEXT', False), ('entity_name', 'TEXT', True),
+                    ('transaction_type', 'TEXT', False), ('count', 'INTEGER', False), ('amount', 'REAL', False)],
+        'key': ['year', 'quarter', 'state', 'entity_type', 'entity_name'],
+    },
+    'top_user_country': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('entity_type', 'TEXT', False),
+                    ('entity_name', 'TEXT', True), ('registeredUsers', 'INTEGER', False)],
+        'key': ['year', 'quarter', 'entity_type', 'entity_name'],
+    },
+    'top_user_state': {
+        'columns': [('year', 'INTEGER', False), ('quarter', 'INTEGER', False), ('state', 'TEXT', False),
+                    ('entity_type', 'TEXT', False), ('entity_name', 'TEXT', True),
+                    ('registeredUsers', 'INTEGER', False)],
+        'key': ['year', 'quarter', 'state', 'entity_type', 'entity_name'],
+    },
+}
+
+# dtype the loader gives a column of each SQLite type. The text columns are
+# the dimensions, loaded as pd.Categorical over their dimension table.
+SQL_TYPE_DTYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'TEXT': 'category'}
+
+# Columns whose values fit a smaller dtype than their SQLite type suggests
+COLUMN_DTYPES = {'year': 'int16', 'quarter': 'int8'}
+
+
+def table_column_names(table_name):
+    return [column for column, sql_type, nullable in TABLE_SCHEMAS[table_name]['columns']]
+
+
+def create_table_sql(table_name, created_name=None):
+    # CREATE TABLE IF NOT EXISTS of a table's declared schema, optionally
+    # under another name (the bulk load's staging tables)
+    schema = TABLE_SCHEMAS[table_name]
+    definitions = [f'"{column}" {sql_type}' + ('' if nullable else ' NOT NULL')
+                   for column, sql_type, nullable in schema['columns']]
+    definitions.append(f'UNIQUE ({", ".join(schema["key"])})')
+    return f'CREATE TABLE IF NOT EXISTS {created_name or table_name} ({", ".join(definitions)}) STRICT'
+
+
+def table_dtypes(table_name):
+    # {column: loaded dtype} of a table, empty for a table without a declared schema
+    schema = TABLE_SCHEMAS.get(table_name)
+    if schema is None:
+        return {}
+    dtypes = {}
+    for column, sql_type, nullable in schema['columns']:
+        dtype = COLUMN_DTYPES.get(column, SQL_TYPE_DTYPES[sql_type])
+        # NULLs need pandas' nullable integers
+        dtypes[column] = 'Int64' if nullable and dtype.startswith('int') else dtype
+    return dtypes
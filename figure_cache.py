@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+import plotly.io as pio
+from data_access import current_data_version, freeze_filters
+
+# Figure cache for the pages. Building a Plotly Express figure (grouping the
+# frame, splitting it into traces, validating every property) costs far more
+# than the query behind it, and every rerun of a page rebuilt all of its
+# charts. The serialized figure JSON is kept per (data version, chart, table,
+# filters), shared by every session of the server process, so a repeated view
+# only parses the JSON back. Entries are evicted in least recently used order
+# past FIGURE_CACHE_BYTES, and dropped when an ingest changes the data version.
+
+FIGURE_CACHE_BYTES = 64 * 1024 * 1024
+
+_figure_cache = OrderedDict()  # key -> figure JSON
+_figure_cache_lock = threading.Lock()
+_figure_cache_state = {'bytes': 0, 'max_bytes': FIGURE_CACHE_BYTES, 'version': None,
+                       'hits': 0, 'misses': 0, 'evictions': 0, 'payload_bytes': {}}
+
+
+def figure_cache_get(key):
+    with _figure_cache_lock:
+        if key[0] != _figure_cache_state['version']:
+            _figure_cache.clear()
+            _figure_cache_state['bytes'] = 0
+            _figure_cache_state['version'] = key[0]
+        spec = _figure_cache.get(key)
+        if spec is None:
+            _figure_cache_state['misses'] += 1
+            return None
+        _figure_cache.move_to_end(key)
+        _figure_cache_state['hits'] += 1
+        return spec
+
+
+def figure_cache_put(key, spec):
+    size = len(spec)
+    with _figure_cache_lock:
+        # The size of the JSON each chart sends the browser, as last built
+        _figure_cache_state['payload_bytes'][f'{key[2]}/{key[1]}'] = size
+        if size > _figure_cache_state['max_bytes'] or key[0] != _figure_cache_state['version']:
+            return
+        previous = _figure_cache.pop(key, None)
+        if previous is not None:
+            _figure_cache_state['bytes'] -= len(previous)
+        _figure_cache[key] = spec
+        _figure_cache_state['bytes'] += size
+        while _figure_cache_state['bytes'] > _figure_cache_state['max_bytes']:
+            evicted_key, evicted_spec = _figure_cache.popitem(last=False)
+            _figure_cache_state['bytes'] -= len(evicted_spec)
+            _figure_cache_state['evictions'] += 1
+
+
+def cached_figure(chart_id, table_name, filters, build):
+    # The figure chart_id draws from table_name under filters (None for the
+    # whole table), built by build() only on a miss
+    key = (current_data_version(), chart_id, table_name, freeze_filters(filters))
+    spec = figure_cache_get(key)
+    if spec is None:
+        spec = pio.to_json(build(), validate=False)
+        figure_cache_put(key, spec)
+    return pio.from_json(spec)
+
+
+def set_figure_cache_size(max_bytes):
+    with _figure_cache_lock:
+        _figure_cache_state['max_bytes'] = max_bytes
+        while _figure_cache and _figure_cache_state['bytes'] > max_bytes:
+            evicted_key, evicted_spec = _figure_cache.popitem(last=False)
+            _figure_cache_state['bytes'] -= len(evicted_spec)
+            _figure_cache_state['evictions'] += 1
+
+
+def clear_figure_cache():
+    with _figure_cache_lock:
+        _figure_cache.clear()
+        _figure_cache_state['bytes'] = 0
+
+
+def figure_cache_stats():
+    with _figure_cache_lock:
+        lookups = _figure_cache_state['hits'] + _figure_cache_state['misses']
+        return {
+            'entries': len(_figure_cache),
+            'bytes': _figure_cache_state['bytes'],
+            'max_bytes': _figure_cache_state['max_bytes'],
+            'hits': _figure_cache_state['hits'],
+            'misses': _figure_cache_state['misses'],
+            'hit_rate': _figure_cache_state['hits'] / lookups if lookups else None,
+            'evictions': _figure_cache_state['evictions'],
+            'payload_bytes': dict(_figure_cache_state['payload_bytes']),
+        }
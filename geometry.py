@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import threading
+import urllib.request
+import streamlit as st
+from extraction.geography import STATE_GEOGRAPHY
+
+# Local geometry store for the choropleths. The India states geojson the maps
+# were drawn with used to be passed to plotly as a remote URL, so every
+# render depended on outbound network. It is now built once into STATIC_DIRECTORY
+# from the source geojson kept in the repository (SOURCE_GEOJSON):
+#   python -m geometry [path or URL of another source geojson]
+# which writes the states at every level of GEOMETRY_LEVELS, simplified
+# without opening gaps between neighbouring states, with each feature's id
+# set to its ST_NM name. Streamlit serves the directory as static files
+# (.streamlit/config.toml), so a map sends the browser only the URL of its
+# geometry and the z-values; the browser fetches the polygons once. A
+# server without a built store builds it before its first map, from the
+# source in the repository or, failing that, from GEOJSON_URL; the maps
+# themselves are never drawn from the network.
+
+# States of India with their names in ST_NM, as published at GEOJSON_URL
+SOURCE_GEOJSON = os.path.join('maps', 'india_states.geojson')
+GEOJSON_URL = ("https://gist.githubusercontent.com/jbrobst/56c13bbbf9d97d187fea01ca62ea5112/raw/"
+               "e388c4cae20aa53cb5090210a42ebb9b765c0a36/india_states.geojson")
+
+# Served by Streamlit at app/static/ when enableStaticServing is on
+STATIC_DIRECTORY = 'static'
+STATIC_URL = 'app/static'
+
+# Property holding a state's name, matched by data_access.with_geojson_names
+FEATURE_NAME_PROPERTY = 'ST_NM'
+
+# Level -> simplification tolerance in degrees. 'country' is what the pages
+# draw (all of India in a few hundred pixels), 'state' is for zooming into a
+# state, and 'detail' keeps every vertex.
+GEOMETRY_LEVELS = {'detail': 0.0, 'state': 0.005, 'country': 0.02}
+MAP_LEVEL = 'country'
+
+# Coordinates are rounded to about a metre, so the vertices neighbouring
+# states share compare equal
+COORDINATE_DIGITS = 5
+
+# A failed build is retried after this many seconds, not on every render
+GEOMETRY_RETRY_SECONDS = 300
+
+# level -> (file modification time, geojson)
+_geometry_cache = {}
+_geometry_lock = threading.Lock()
+_build_lock = threading.Lock()
+_build_state = {'error': None, 'failed_at': None}
+
+
+def geometry_file_name(level):
+    return f'india_states_{level}.geojson'
+
+
+def geometry_path(level, directory=STATIC_DIRECTORY):
+    return os.path.join(directory, geometry_file_name(level))
+
+
+# ***************************************Simplification*******************************
+
+def polygon_list(geometry):
+    # The polygons of a Polygon or MultiPolygon, each a list of rings
+    if geometry['type'] == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry['type'] == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+
+def rounded_ring(ring):
+    # Ring as rounded (lon, lat) tuples, without its closing point
+    points = [(round(point[0], COORDINATE_DIGITS), round(point[1], COORDINATE_DIGITS)) for point in ring]
+    deduplicated = [point for index, point in enumerate(points) if index == 0 or point != points[index - 1]]
+    if len(deduplicated) > 1 and deduplicated[0] == deduplicated[-1]:
+        deduplicated.pop()
+    return deduplicated
+
+
+def segment_distance(point, start, end):
+    # Distance from point to the segment start-end, in degrees
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    if dx == 0 and dy == 0:
+        return ((point[0] - start[0]) ** 2 + (point[1] - start[1]) ** 2) ** 0.5
+    t = ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / (dx * dx + dy * dy)
+    t = max(0.0, min(1.0, t))
+    return ((point[0] - start[0] - t * dx) ** 2 + (point[1] - start[1] - t * dy) ** 2) ** 0.5
+
+
+def simplify_line(points, tolerance):
+    # Douglas-Peucker simplification of a line, keeping its end points
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, farthest_distance = None, tolerance
+        for index in range(first + 1, last):
+            distance = segment_distance(points[index], points[first], points[last])
+            if distance > farthest_distance:
+                farthest, farthest_distance = index, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def ring_junctions(ring, owners):
+    # Positions where the set of rings sharing a vertex changes: the ends of
+    # the borders between states, which must stay where they are. A ring
+    # without any (an island) is pinned at its smallest vertex and the vertex
+    # halfway round, so a ring shared in full is split the same way twice.
+    count = len(ring)
+    junctions = [index for index in range(count)
+                 if owners[ring[index]] != owners[ring[index - 1]]
+                 or owners[ring[index]] != owners[ring[(index + 1) % count]]]
+    if len(junctions) < 2:
+        start = junctions[0] if junctions else ring.index(min(ring))
+        junctions = sorted({start, (start + count // 2) % count})
+    return junctions
+
+
+def simplify_ring(ring, owners, tolerance, arc_cache):
+    # Simplify a ring arc by arc, between its junctions. Each arc is
+    # simplified in one canonical direction and cached, so the border of two
+    # states comes out the same in both and no gaps or overlaps open up.
+    junctions = ring_junctions(ring, owners)
+    simplified = []
+    for position, start in enumerate(junctions):
+        end = junctions[(position + 1) % len(junctions)]
+        arc = ring[start:end + 1] if end > start else ring[start:] + ring[:end + 1]
+        key = tuple(arc)
+        reversed_key = key[::-1]
+        if reversed_key < key:
+            if reversed_key not in arc_cache:
+                arc_cache[reversed_key] = simplify_line(reversed_key, tolerance)
+            arc_points = arc_cache[reversed_key][::-1]
+        else:
+            if key not in arc_cache:
+                arc_cache[key] = simplify_line(key, tolerance)
+            arc_points = arc_cache[key]
+        simplified.extend(arc_points[:-1])
+    return simplified
+
+
+def simplify_geojson(geojson, tolerance):
+    # Topology-preserving simplification of a polygon FeatureCollection.
+    # Rings that collapse are dropped; a feature that would lose every
+    # polygon keeps its rounded, unsimplified geometry.
+    features = geojson['features']
+    feature_polygons = [[[rounded_ring(ring) for ring in polygon] for polygon in polygon_list(feature['geometry'])]
+                        for feature in features]
+
+    owners = {}
+    ring_id = 0
+    for polygons in feature_polygons:
+        for polygon in polygons:
+            for ring in polygon:
+                for point in ring:
+                    owners.setdefault(point, set()).add(ring_id)
+                ring_id += 1
+    owners = {point: frozenset(ring_ids) for point, ring_ids in owners.items()}
+
+    arc_cache = {}
+    simplified_features = []
+    for feature, polygons in zip(features, feature_polygons):
+        simplified_polygons = []
+        for polygon in polygons:
+            rings = [simplify_ring(ring, owners, tolerance, arc_cache) if len(ring) >= 3 else ring
+                     for ring in polygon]
+            if len(rings[0]) < 3:
+                continue
+            simplified_polygons.append([rings[0]] + [ring for ring in rings[1:] if len(ring) >= 3])
+        if not simplified_polygons:
+            simplified_polygons = [polygon for polygon in polygons if len(polygon[0]) >= 3]
+
+        coordinates = [[[list(point) for point in ring + ring[:1]] for ring in polygon]
+                       for polygon in simplified_polygons]
+        geometry = ({'type': 'Polygon', 'coordinates': coordinates[0]} if len(coordinates) == 1
+                    else {'type': 'MultiPolygon', 'coordinates': coordinates})
+        simplified_features.append({'type': 'Feature', 'id': feature.get('id'),
+                                    'properties': feature.get('properties', {}), 'geometry': geometry})
+
+    return {'type': 'FeatureCollection', 'features': simplified_features}
+
+
+# ***************************************Build*******************************
+
+def read_source_geojson(source):
+    # The source geojson, from a file or a URL
+    if os.path.exists(source):
+        with open(source, encoding='utf-8') as source_file:
+            return json.load(source_file)
+    with urllib.request.urlopen(source, timeout=60) as response:
+        return json.load(response)
+
+
+def build_geometry(source=SOURCE_GEOJSON, directory=STATIC_DIRECTORY):
+    # Write every level of the geometry store. Returns {level: path}.
+    geojson = read_source_geojson(source)
+    for feature in geojson['features']:
+        # plotly matches locations against the feature id by default
+        feature['id'] = feature['properties'][FEATURE_NAME_PROPERTY]
+
+    feature_names = {feature['id'] for feature in geojson['features']}
+    missing = sorted(geojson_name for display_name, geojson_name in STATE_GEOGRAPHY.values()
+                     if geojson_name not in feature_names)
+    if missing:
+        print(f"States without a feature in {source}: {', '.join(missing)}")
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for level, tolerance in GEOMETRY_LEVELS.items():
+        paths[level] = geometry_path(level, directory)
+        # Written aside and renamed, so a server reading the store never
+        # sees a partial file
+        with open(paths[level] + '.tmp', 'w', encoding='utf-8') as geometry_file:
+            json.dump(simplify_geojson(geojson, tolerance), geometry_file, separators=(',', ':'))
+        os.replace(paths[level] + '.tmp', paths[level])
+        print(f"Wrote {paths[level]} ({os.path.getsize(paths[level]) / 1024:.0f} KiB)")
+    return paths
+
+
+# ***************************************Loading*******************************
+
+def ensure_geometry(level=MAP_LEVEL):
+    # Build the store if the level is missing, once per server process: from
+    # SOURCE_GEOJSON when it is checked out, else from GEOJSON_URL. Returns
+    # whether the level is built.
+    if os.path.exists(geometry_path(level)):
+        return True
+    with _build_lock:
+        if os.path.exists(geometry_path(level)):
+            return True
+        failed_at = _build_state['failed_at']
+        if failed_at is not None and time.time() - failed_at < GEOMETRY_RETRY_SECONDS:
+            return False
+        source = SOURCE_GEOJSON if os.path.exists(SOURCE_GEOJSON) else GEOJSON_URL
+        try:
+            build_geometry(source)
+        except Exception as e:
+            print(f"Failed to build the map geometry from {source}: {e}")
+            _build_state['error'], _build_state['failed_at'] = f"{source}: {e}", time.time()
+            return False
+        _build_state['error'], _build_state['failed_at'] = None, None
+    return True
+
+
+def load_geometry(level=MAP_LEVEL):
+    # geojson of a level, read once per server process and again only when
+    # the file is rebuilt; None if it is not built and cannot be
+    path = geometry_path(level)
+    if not ensure_geometry(level):
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _geometry_lock:
+        cached = _geometry_cache.get(level)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    try:
+        with open(path, encoding='utf-8') as geometry_file:
+            geojson = json.load(geometry_file)
+    except (OSError, ValueError) as e:
+        print(f"Failed to read the map geometry {path}: {e}")
+        return None
+
+    with _geometry_lock:
+        _geometry_cache[level] = (mtime, geojson)
+    return geojson
+
+
+def choropleth_geometry(level=MAP_LEVEL):
+    # (geojson, featureidkey) for px.choropleth: the URL of the served file
+    # when Streamlit serves the store, else the cached geojson
+    geojson = load_geometry(level)
+    if geojson is None:
+        reason = _build_state['error'] or 'the built file is unreadable'
+        raise FileNotFoundError(f"The map geometry {geometry_path(level)} is not available ({reason}): "
+                                f"run `python -m geometry` from the repository root with the source "
+                                f"geojson's path or URL")
+    if st.get_option('server.enableStaticServing'):
+        return f'{STATIC_URL}/{geometry_file_name(level)}', 'id'
+    return geojson, 'id'
+
+
+if __name__ == '__main__':
+    # Run from the repository root, optionally with another source geojson's
+    # path or URL
+    source = sys.argv[1] if len(sys.argv) > 1 else SOURCE_GEOJSON
+    if not os.path.exists(source) and '://' not in source:
+        print(f"No source geojson at {source}: save {GEOJSON_URL} there, or pass its path or URL")
+        sys.exit(1)
+    build_geometry(source)
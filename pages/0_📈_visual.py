@@ -1,7 +1,8 @@
 import plotly.express as px
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
+from data_access import load_data_from_db, load_rollup, with_geojson_names
+from geometry import choropleth_geometry
+from plotting import plot_at_grain, scatter_chart, hierarchy_chart
 import streamlit_shadcn_ui as ui
 
 # Set Streamlit page configuration
@@ -13,17 +14,6 @@ st.set_page_config(
 )
 
 
-# Create a function to load data from the SQLite database
-def load_data_from_db(query):
-    sqlite_file = 'test.sqlite'
-    engine = create_engine(f'sqlite:///{sqlite_file}')
-    df = pd.read_sql(query, engine)
-    return df
-
-
-
-
-
 # # Fetch data from SQLite based on user selection from dropdown
 # dropdown_options = {
 #     '---': None,
@@ -53,16 +43,11 @@ def load_data_from_db(query):
 
 
 query = 'SELECT * FROM aggregated_insurence_state;'
-df = load_data_from_db(query)
-
-# Replace hyphens with spaces and title-case the elements in the 'state' column
-df['state'] = df['state'].apply(lambda x: x.replace('-', ' ').title().replace(' And ', '& '))
+# The states come from the ingest with their display names; the map joins on the geojson's
+df = with_geojson_names(load_data_from_db(query))
 
-# Aggregate data by summing quarter amounts and transactions per year
-agg_df = df.groupby(["state", "year"]).agg({
-    "number_of_transactions": "sum",
-    "total_amount": "sum"
-}).reset_index()
+# Quarter amounts and transactions summed per state and year by the ingest
+agg_df = load_rollup('aggregated_insurence_state', 'state_year')
 
 
 # Display metrics in two columns
@@ -73,11 +58,8 @@ with cols[1]:
     ui.metric_card(title="Total Number of Transactions", content=f"{df.number_of_transactions.sum()}", description="Total Number of Transactions from state insurence", key="card2")
 # st.markdown('---')
 
-# Aggregate data by summing quarter amounts and transactions per year
-agg_df2 = df.groupby(["state"]).agg({
-    "number_of_transactions": "sum",
-    "total_amount": "sum"
-}).reset_index()
+# Totals per state over all quarters, also computed by the ingest
+agg_df2 = load_rollup('aggregated_insurence_state', 'state')
 
 # Sort the aggregated DataFrame by 'total_amount' in descending order
 agg_df_sorted = agg_df2.sort_values(by="total_amount", ascending=False)
@@ -92,7 +74,7 @@ with first_box:
     
 
 # Create a scatter plot using Plotly Express
-fig1 = px.scatter(
+fig1 = scatter_chart(
     agg_df2,
     x="number_of_transactions",
     y="total_amount",
@@ -119,9 +101,9 @@ st.plotly_chart(fig1, theme="streamlit", use_container_width=True)
 
 
 
-# Create pie charts
-fig2 = px.pie(df, values='total_amount', names='year',title='Insurence Amount by year')
-fig3 = px.pie(df, values='total_amount', names='state', hole=.6, hover_data=['number_of_transactions'], title='Total Insurence Amount by State')
+# Create pie charts from the per year and per state totals
+fig2 = px.pie(load_rollup('aggregated_insurence_state', 'year'), values='total_amount', names='year',title='Insurence Amount by year')
+fig3 = px.pie(agg_df2, values='total_amount', names='state', hole=.6, hover_data=['number_of_transactions'], title='Total Insurence Amount by State')
 
 # Display the pie charts in columns
 col1, col2 = st.columns([1, 3])
@@ -132,15 +114,17 @@ with col1:
 with col2:
     st.plotly_chart(fig3, theme="streamlit", use_container_width=True)
 
-fig4 = px.bar(df, x="state", y="number_of_transactions", color="state", title="Total Transactions by State",labels = None)
+# One bar per state: the frame is aggregated to the chart's grain first
+fig4 = plot_at_grain(px.bar, agg_df2, x="state", y="number_of_transactions", color="state", title="Total Transactions by State",labels = None)
 
 
 st.plotly_chart(fig4, theme="streamlit", use_container_width=True)
 
 
-fig5 = px.pie(df, values='total_amount', names='state', hole=.6, hover_data=['number_of_transactions'],title='Total Number of Insurence counts')
-fig12 = px.sunburst(
-    df,
+fig5 = px.pie(agg_df2, values='total_amount', names='state', hole=.6, hover_data=['number_of_transactions'],title='Total Number of Insurence counts')
+# Treemap and sunburst nodes precomputed by the ingest
+fig12 = hierarchy_chart(
+    'sunburst', 'aggregated_insurence_state', None, agg_df,
     path=["state", "year"],
     values="number_of_transactions",
     title="Hierarchical Transactions by State and Year"
@@ -164,8 +148,8 @@ with col5:
 
 
 
-fig13 = px.treemap(
-    df,
+fig13 = hierarchy_chart(
+    'treemap', 'aggregated_insurence_state', None, df,
     path=["state", "year","quarter"],
     values="number_of_transactions",
     # color= "total_amount",
@@ -174,17 +158,24 @@ fig13 = px.treemap(
 st.plotly_chart(fig13, theme="streamlit", use_container_width=True)
 
 
-fig9 = px.choropleth(
-    df,
-    geojson="https://gist.githubusercontent.com/jbrobst/56c13bbbf9d97d187fea01ca62ea5112/raw/e388c4cae20aa53cb5090210a42ebb9b765c0a36/india_states.geojson",
-    featureidkey='properties.ST_NM',
-    locations='state',
-    color='total_amount',
-    hover_data=['total_amount','number_of_transactions'],
-    title="Insurance Amount by State",
-    color_continuous_scale='Viridis_r'
-)
-fig9.update_geos(fitbounds='locations', visible=False)
-st.plotly_chart(fig9, theme="streamlit", use_container_width=True)
+try:
+    geojson, featureidkey = choropleth_geometry()
+except FileNotFoundError as e:
+    st.error(e)
+else:
+    # One row per state instead of one per state, quarter and transaction type
+    fig9 = plot_at_grain(
+        px.choropleth, df,
+        geojson=geojson,
+        featureidkey=featureidkey,
+        locations='geojson_name',
+        hover_name='state',
+        color='total_amount',
+        hover_data=['total_amount','number_of_transactions'],
+        title="Insurance Amount by State",
+        color_continuous_scale='Viridis_r'
+    )
+    fig9.update_geos(fitbounds='locations', visible=False)
+    st.plotly_chart(fig9, theme="streamlit", use_container_width=True)
 
     
@@ -1,7 +1,10 @@
 import streamlit as st
 import streamlit_shadcn_ui as ui
-from sqlalchemy import create_engine
-import pandas as pd
+from data_access import (load_table, load_filtered, load_table_columns, load_distinct_values,
+                         load_year_quarter_options)
+from semantic_layer import load_request
+from figure_cache import cached_figure
+from plotting import plot_at_grain, scatter_chart, hierarchy_chart
 import plotly.express as px
 
 st.set_page_config(
@@ -15,25 +18,96 @@ st.title("📈 Tables")
 
 # ***************************************Data Access*******************************
 
-# Create a function to load data from the SQLite database
-def load_data_from_db(query):
-    sqlite_file = 'test.sqlite'
-    # Use a context manager to ensure proper resource management
-    with create_engine(f'sqlite:///{sqlite_file}').connect() as engine:
-        df = pd.read_sql(query, engine)
-    return df
+# What each tab shows: the fact table behind it, and for the tabs with a
+# summary table the measures and dimensions it asks for. load_request
+# answers a summary from the smallest rollup that can, so the tabs never
+# name a rollup table themselves.
+TAB_REQUESTS = {
+    'Transaction Data': {'table': 'agregated_transaction_country'},
+    'Transaction State Data': {'table': 'aggregated_transaction_state'},
+    'Insurance Data': {'table': 'aggregated_insurence_country'},
+    'Insurance State Data': {'table': 'aggregated_insurence_state'},
+    'User Country Data': {'table': 'aggregated_user_counry',
+                          'measures': ['latest(phone_count)', 'latest(Percentage)'], 'dimensions': ['year', 'phone_brand']},
+    'User State Data': {'table': 'agregated_user_state'},
+}
 
 def select_the_table(selected_tab):
-    # Execute different queries based on the chosen tab
-    tables = {
-        'Transaction Data': 'agregated_transaction_country',
-        'Transaction State Data': 'aggregated_transaction_state',
-        'Insurance Data': 'aggregated_insurence_country',
-        'Insurance State Data': 'aggregated_insurence_state',
-        'User Country Data': 'aggregated_user_counry',
-        'User State Data': 'agregated_user_state'
-    }
-    return tables.get(selected_tab, None)
+    # Fact table of the chosen tab
+    request = TAB_REQUESTS.get(selected_tab)
+    return None if request is None else request['table']
+
+# ***************************************Sections*******************************
+# The page is split into fragments: the filter panel, the table preview and
+# one section per chart. An interaction inside a fragment reruns only that
+# fragment, and the full data and each chart are only computed while their
+# section is open.
+
+def applied_filters_key(table_name):
+    return f'plotting_filters_{table_name}'
+
+
+@st.fragment
+def filter_panel(table_name):
+    # The filter widgets. Changing them reruns only this panel; Apply hands
+    # the selection to the rest of the page.
+    col3, col4, col5, col6 = st.columns(4)
+
+    year_options, quarter_options = load_year_quarter_options(table_name)
+    selected_years = col3.multiselect('Select Year:', year_options, default=[2022],
+                                      help='Select the Year', key=f'{table_name}_years')
+    selected_quarters = col4.multiselect('Select Quarter:', quarter_options, default=[1, 2, 3, 4],
+                                         key=f'{table_name}_quarters')
+
+    table_columns = load_table_columns(table_name)
+    filters = {'year': selected_years, 'quarter': selected_quarters}
+    type_column = col5
+
+    # Check if 'state' is a column in the table
+    if 'state' in table_columns:
+        filters['state'] = col5.multiselect('Select State/UT:', load_distinct_values(table_name, 'state'),
+                                            default=['Karnataka'], key=f'{table_name}_states')
+        type_column = col6
+
+    if 'type_of_transaction' in table_columns:
+        filters['type_of_transaction'] = type_column.multiselect(
+            'Select Transaction Type:', load_distinct_values(table_name, 'type_of_transaction'),
+            key=f'{table_name}_transaction_types')
+    else:
+        filters['phone_brand'] = type_column.multiselect(
+            'Select Phone Brand:', load_distinct_values(table_name, 'phone_brand'), key=f'{table_name}_phone_brands')
+
+    # The first selection of a table applies at once
+    applied_key = applied_filters_key(table_name)
+    if applied_key not in st.session_state:
+        st.session_state[applied_key] = filters
+    pending = filters != st.session_state[applied_key]
+    if st.button('Apply filters', type='primary' if pending else 'secondary', disabled=not pending,
+                 key=f'{table_name}_apply_filters'):
+        st.session_state[applied_key] = filters
+        st.rerun()
+
+
+@st.fragment
+def table_preview(table_name, full_df, preview_df, label):
+    # The rows behind the charts, sent to the browser only while the
+    # expander is open, and the summary table
+    data_section = st.expander(label, key=f'{table_name}_data', on_change='rerun')
+    with data_section:
+        if data_section.open:
+            st.dataframe(full_df, width='stretch')
+
+    ui.table(data=preview_df, maxHeight=500, key="filtered_data_table")
+
+
+@st.fragment
+def chart_section(title, chart_id, table_name, filters, build, expanded=False):
+    # One chart, built or read from the figure cache only while its section
+    # is open, so the charts further down cost nothing until they are opened
+    section = st.expander(title, expanded=expanded, key=f'{table_name}_{chart_id}', on_change='rerun')
+    with section:
+        if section.open:
+            st.plotly_chart(cached_figure(chart_id, table_name, filters, build), width='stretch')
 
 # ***************************************Data Exploration*******************************
 
@@ -51,99 +125,70 @@ with col2:
 chosen_table = select_the_table(selected_tab)
 if chosen_table is None:
     st.warning("Please select a valid table.")
-else:
-    df = load_data_from_db(f'SELECT * FROM {chosen_table}')
-    
-    filtered_df = None
+    st.stop()
 
-    filter_box = st.container()
+filter_box = st.container()
 
 if filter_data:
-    # Create columns
-    col3, col4, col5, col6 = filter_box.columns(4)
-
-    # Sidebar input widgets
-    selected_years = col3.multiselect('Select Year:', sorted(df['year'].unique()), default=[2022],
-                                      help='Select the Year')
-    selected_quarters = col4.multiselect('Select Quarter:', sorted(df['quarter'].unique()), default=[1, 2, 3, 4])
-
-    # Check if 'state' is a column in the DataFrame
-    if 'state' in df.columns:
-        selected_state = col5.multiselect('Select State/UT:', sorted(df['state'].unique()), default=['karnataka'])
-        
-        if 'type_of_transaction' in df.columns:
-            entity_type = col6.multiselect('Select Transaction Type:', sorted(df['type_of_transaction'].unique()))
-            # Filter the DataFrame based on user inputs
-            filtered_df = df[(df['state'].isin(selected_state)) & (df['year'].isin(selected_years)) & (
-                        df['quarter'].isin(selected_quarters)) & (df['type_of_transaction'].isin(entity_type))]
-        else:
-            entity_type = col6.multiselect('Select Phone Brand:', sorted(df['phone_brand'].unique()))
-            # Filter the DataFrame based on user inputs
-            filtered_df = df[(df['state'].isin(selected_state)) & (df['year'].isin(selected_years)) & (
-                        df['quarter'].isin(selected_quarters)) & (df['phone_brand'].isin(entity_type))]
-    else:
-        if 'type_of_transaction' in df.columns:
-            entity_type = col5.multiselect('Select Transaction Type:', sorted(df['type_of_transaction'].unique()))
-            # Filter the DataFrame based on user inputs
-            filtered_df = df[(df['year'].isin(selected_years)) & (df['quarter'].isin(selected_quarters)) & (
-                        df['type_of_transaction'].isin(entity_type))]
-        else:
-            entity_type = col5.multiselect('Select Phone Brand:', sorted(df['phone_brand'].unique()))
-            # Filter the DataFrame based on user inputs
-            filtered_df = df[(df['year'].isin(selected_years)) & (df['quarter'].isin(selected_quarters)) & (
-                        df['phone_brand'].isin(entity_type))]
-   
-    # Show filtered data using an expander
-    with st.expander('Show Filtered Full Data'):
-        st.dataframe(filtered_df, use_container_width=True)
-
+    with filter_box:
+        filter_panel(chosen_table)
+
+    # The applied selections are sent to the database as one parameterized
+    # query, only the matching rows are loaded
+    filters = st.session_state[applied_filters_key(chosen_table)]
+    filtered_df = load_filtered(chosen_table, filters)
+    data_label = 'Show Filtered Full Data'
 else:
-    filtered_df = df
-    with st.expander('Show Full Data'):
-        st.dataframe(df, use_container_width=True)
-        
+    filters = None
+    filtered_df = load_table(chosen_table)
+    data_label = 'Show Full Data'
+
 if selected_tab == 'User Country Data':
-    # Aggregate data by year and phone brand 
-    agg_df = df.groupby(["year",'phone_brand']).agg({
-        "phone_count": "sum",
-        "Percentage": "sum"
-    }).reset_index()
-    data = agg_df
+    # Phone counts and shares per year and brand. They are running totals,
+    # so each year shows them as of its latest selected quarter, for the
+    # selected brands.
+    summary_filters = None
+    if filter_data:
+        summary_filters = {'year': filters['year'], 'quarter': filters['quarter'],
+                           'phone_brand': filters['phone_brand']}
+    data = load_request(TAB_REQUESTS[selected_tab], filters=summary_filters)
 else:
-    data = filtered_df.head()    
+    data = filtered_df.head()
 
-ui.table(data=data, maxHeight=500, key="filtered_data_table")
+table_preview(chosen_table, filtered_df, data, data_label)
 
 # ***************************************Charts*******************************
 
+# Figures are cached per table and filter selection, so a rerun that leaves
+# both alone does not rebuild them
+chart_filters = filters
+
 if selected_tab == 'Transaction State Data':
     # Bar chart for total transaction count by state and type of transaction
-    fig1 = px.bar(
-        filtered_df,
+    chart_section("Total Transaction Count by State and Type of Transaction", 'count_by_state', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.bar, filtered_df,
         x="state",
         y="number_of_transactions",
         color="type_of_transaction",
         barmode="group",
         title="Total Transaction Count by State and Type of Transaction",
         labels={"number_of_transactions": "Total Transaction Count", "state": "State", "type_of_transaction": "Type of Transaction"}
-    )
-    st.plotly_chart(fig1, use_container_width=True)
+    ), expanded=True)
 
     # Bar chart for total transaction amount by state and type of transaction
-    fig2 = px.bar(
-        filtered_df,
+    chart_section("Total Transaction Amount by State and Type of Transaction", 'amount_by_state', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.bar, filtered_df,
         x="state",
         y="total_amount",
         color="type_of_transaction",
         barmode="group",
         title="Total Transaction Amount by State and Type of Transaction",
         labels={"total_amount": "Total Transaction Amount", "state": "State", "type_of_transaction": "Type of Transaction"}
-    )
-    st.plotly_chart(fig2, use_container_width=True)
+    ), expanded=True)
 
     # Line chart for transaction count over time by state and type of transaction
-    fig3 = px.line(
-        filtered_df,
+    chart_section("Transaction Count Over Time by State and Type of Transaction", 'count_over_time', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.line, filtered_df,
         x="quarter",
         y="number_of_transactions",
         color="state",
@@ -152,12 +197,11 @@ if selected_tab == 'Transaction State Data':
         labels={"number_of_transactions": "Transaction Count", "quarter": "Quarter", "state": "State", "type_of_transaction": "Type of Transaction"},
         facet_col="year",
         facet_col_wrap=2
-    )
-    st.plotly_chart(fig3, use_container_width=True)
+    ))
 
     # Line chart for transaction amount over time by state and type of transaction
-    fig4 = px.line(
-        filtered_df,
+    chart_section("Transaction Amount Over Time by State and Type of Transaction", 'amount_over_time', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.line, filtered_df,
         x="quarter",
         y="total_amount",
         color="state",
@@ -166,31 +210,28 @@ if selected_tab == 'Transaction State Data':
         labels={"total_amount": "Transaction Amount", "quarter": "Quarter", "state": "State", "type_of_transaction": "Type of Transaction"},
         facet_col="year",
         facet_col_wrap=2
-    )
-    st.plotly_chart(fig4, use_container_width=True)
+    ))
 
     # Treemap for transaction distribution by state, year, and type of transaction
-    fig5 = px.treemap(
-        filtered_df,
+    chart_section("Transaction Distribution by State, Year, and Type of Transaction", 'count_treemap', chosen_table, chart_filters, lambda: hierarchy_chart(
+        'treemap', chosen_table, chart_filters, filtered_df,
         path=["state", "year", "type_of_transaction"],
         values="number_of_transactions",
         title="Transaction Distribution by State, Year, and Type of Transaction",
         labels={"number_of_transactions": "Transaction Count", "state": "State", "type_of_transaction": "Type of Transaction"}
-    )
-    st.plotly_chart(fig5, use_container_width=True)
+    ))
 
     # Treemap for transaction amount distribution by state, year, and type of transaction
-    fig6 = px.treemap(
-        filtered_df,
+    chart_section("Transaction Amount Distribution by State, Year, and Type of Transaction", 'amount_treemap', chosen_table, chart_filters, lambda: hierarchy_chart(
+        'treemap', chosen_table, chart_filters, filtered_df,
         path=["state", "year", "type_of_transaction"],
         values="total_amount",
         title="Transaction Amount Distribution by State, Year, and Type of Transaction",
         labels={"total_amount": "Transaction Amount", "state": "State", "type_of_transaction": "Type of Transaction"}
-    )
-    st.plotly_chart(fig6, use_container_width=True)
+    ))
 
     # Scatter plot for transaction count vs. amount by state and type of transaction
-    fig7 = px.scatter(
+    chart_section("Transaction Count vs. Amount by State and Type of Transaction", 'count_vs_amount', chosen_table, chart_filters, lambda: scatter_chart(
         filtered_df,
         x="number_of_transactions",
         y="total_amount",
@@ -198,88 +239,80 @@ if selected_tab == 'Transaction State Data':
         symbol="type_of_transaction",
         title="Transaction Count vs. Amount by State and Type of Transaction",
         labels={"number_of_transactions": "Transaction Count", "total_amount": "Transaction Amount", "state": "State", "type_of_transaction": "Type of Transaction"}
-    )
-    st.plotly_chart(fig7, use_container_width=True)
+    ))
 
     # Sunburst chart for transaction distribution by state, year, quarter, and type of transaction
-    fig8 = px.sunburst(
-        filtered_df,
+    chart_section("Transaction Distribution by State, Year, Quarter, and Type of Transaction", 'count_sunburst', chosen_table, chart_filters, lambda: hierarchy_chart(
+        'sunburst', chosen_table, chart_filters, filtered_df,
         path=["state", "year", "quarter", "type_of_transaction"],
         values="number_of_transactions",
         title="Transaction Distribution by State, Year, Quarter, and Type of Transaction",
         labels={"number_of_transactions": "Transaction Count", "state": "State", "type_of_transaction": "Type of Transaction"}
-    )
-    st.plotly_chart(fig8, use_container_width=True)
+    ))
 
 elif selected_tab == 'Insurance Data':
     # Bar chart for total insurance transaction count by year and quarter
-    fig1 = px.bar(
-        filtered_df,
+    chart_section("Total Insurance Transaction Count by Year and Quarter", 'count_by_year', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.bar, filtered_df,
         x="year",
         y="count",
         color="quarter",
         barmode="group",
         title="Total Insurance Transaction Count by Year and Quarter",
         labels={"count": "Total Transaction Count", "year": "Year", "quarter": "Quarter"}
-    )
-    st.plotly_chart(fig1, use_container_width=True)
+    ), expanded=True)
 
     # Bar chart for total insurance transaction amount by year and quarter
-    fig2 = px.bar(
-        filtered_df,
+    chart_section("Total Insurance Transaction Amount by Year and Quarter", 'amount_by_year', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.bar, filtered_df,
         x="year",
         y="amount",
         color="quarter",
         barmode="group",
         title="Total Insurance Transaction Amount by Year and Quarter",
         labels={"amount": "Total Transaction Amount", "year": "Year", "quarter": "Quarter"}
-    )
-    st.plotly_chart(fig2, use_container_width=True)
+    ), expanded=True)
 
     # Line chart for insurance transaction count over time
-    fig3 = px.line(
-        filtered_df,
+    chart_section("Insurance Transaction Count Over Time", 'count_over_time', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.line, filtered_df,
         x="quarter",
         y="count",
         color="year",
         title="Insurance Transaction Count Over Time",
         labels={"count": "Transaction Count", "quarter": "Quarter", "year": "Year"}
-    )
-    st.plotly_chart(fig3, use_container_width=True)
+    ))
 
     # Line chart for insurance transaction amount over time
-    fig4 = px.line(
-        filtered_df,
+    chart_section("Insurance Transaction Amount Over Time", 'amount_over_time', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.line, filtered_df,
         x="quarter",
         y="amount",
         color="year",
         title="Insurance Transaction Amount Over Time",
         labels={"amount": "Transaction Amount", "quarter": "Quarter", "year": "Year"}
-    )
-    st.plotly_chart(fig4, use_container_width=True)
+    ))
 
     # Treemap for insurance transaction distribution by year and quarter
-    fig5 = px.treemap(
-        filtered_df,
+    chart_section("Insurance Transaction Distribution by Year and Quarter", 'count_treemap', chosen_table, chart_filters, lambda: hierarchy_chart(
+        'treemap', chosen_table, chart_filters, filtered_df,
         path=["year", "quarter"],
         values="count",
         title="Insurance Transaction Distribution by Year and Quarter",
         labels={"count": "Transaction Count", "year": "Year", "quarter": "Quarter"}
-    )
-    st.plotly_chart(fig5, use_container_width=True)
+    ))
 
     # Treemap for insurance transaction amount distribution by year and quarter
-    fig6 = px.treemap(
-        filtered_df,
+    chart_section("Insurance Transaction Amount Distribution by Year and Quarter", 'amount_treemap', chosen_table, chart_filters, lambda: hierarchy_chart(
+        'treemap', chosen_table, chart_filters, filtered_df,
         path=["year", "quarter"],
         values="amount",
         title="Insurance Transaction Amount Distribution by Year and Quarter",
         labels={"amount": "Transaction Amount", "year": "Year", "quarter": "Quarter"}
-    )
-    st.plotly_chart(fig6, use_container_width=True)
+    ))
 
     # Scatter plot for insurance transaction count vs. amount
-    fig7 = px.scatter(
+    chart_section("Insurance Transaction Count vs. Amount", 'count_vs_amount', chosen_table, chart_filters, lambda: scatter_chart(
         filtered_df,
         x="count",
         y="amount",
@@ -287,43 +320,38 @@ elif selected_tab == 'Insurance Data':
         symbol="quarter",
         title="Insurance Transaction Count vs. Amount",
         labels={"count": "Transaction Count", "amount": "Transaction Amount", "year": "Year", "quarter": "Quarter"}
-    )
-    st.plotly_chart(fig7, use_container_width=True)
+    ))
 
     # Sunburst chart for insurance transaction distribution by year, quarter, and type of transaction
-    fig8 = px.sunburst(
-        filtered_df,
+    chart_section("Insurance Transaction Distribution by Year, Quarter, and Type of Transaction", 'count_sunburst', chosen_table, chart_filters, lambda: hierarchy_chart(
+        'sunburst', chosen_table, chart_filters, filtered_df,
         path=["year", "quarter", "type_of_transaction"],
         values="count",
         title="Insurance Transaction Distribution by Year, Quarter, and Type of Transaction",
         labels={"count": "Transaction Count", "year": "Year", "quarter": "Quarter", "type_of_transaction": "Type of Transaction"}
-    )
-    st.plotly_chart(fig8, use_container_width=True)
+    ))
 
 
 if selected_tab == "Insurance State Data":
     st.subheader("Insurance Transactions Overview")
     
     # Plot 1: Number of Transactions by Quarter
-    st.write("### Number of Transactions by Quarter")
-    fig1 = px.bar(filtered_df, x='quarter', y='number_of_transactions', 
-                  labels={'quarter': 'Quarter', 'number_of_transactions': 'Number of Transactions'},
-                  title=f"Number of Insurance Transactions")
-    st.plotly_chart(fig1)
+    chart_section("Number of Transactions by Quarter", 'count_by_quarter', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.bar, filtered_df, x='quarter', y='number_of_transactions',
+        labels={'quarter': 'Quarter', 'number_of_transactions': 'Number of Transactions'},
+        title=f"Number of Insurance Transactions"), expanded=True)
     
     # Plot 2: Total Amount by Quarter
-    st.write("### Total Amount by Quarter")
-    fig2 = px.line(filtered_df, x='quarter', y='total_amount', 
-                   labels={'quarter': 'Quarter', 'total_amount': 'Total Amount'},
-                   title=f"Total Amount of Insurance Transactions")
-    st.plotly_chart(fig2)
+    chart_section("Total Amount by Quarter", 'amount_by_quarter', chosen_table, chart_filters, lambda: plot_at_grain(
+        px.line, filtered_df, x='quarter', y='total_amount',
+        labels={'quarter': 'Quarter', 'total_amount': 'Total Amount'},
+        title=f"Total Amount of Insurance Transactions"), expanded=True)
     
     # Plot 3: Combined View (Number of Transactions and Total Amount)
-    st.write("### Combined View: Number of Transactions and Total Amount")
-    fig3 = px.scatter(filtered_df, x='number_of_transactions', y='total_amount', color='quarter',
-                      labels={'number_of_transactions': 'Number of Transactions', 'total_amount': 'Total Amount'},
-                      title=f"Combined View of Insurance Transactions")
-    st.plotly_chart(fig3)
+    chart_section("Combined View: Number of Transactions and Total Amount", 'count_vs_amount', chosen_table, chart_filters, lambda: scatter_chart(
+        filtered_df, x='number_of_transactions', y='total_amount', color='quarter',
+        labels={'number_of_transactions': 'Number of Transactions', 'total_amount': 'Total Amount'},
+        title=f"Combined View of Insurance Transactions"))
 # else:
 #     # Bar chart for total transaction count by category
 #     fig1 = px.bar(
@@ -1,10 +1,11 @@
-import pandas as pd
 import streamlit as st
 import plotly.express as px
-from sqlalchemy import create_engine
+from data_access import (load_table, load_filtered, load_distinct_values, load_year_quarter_options,
+                         with_geojson_names)
+from semantic_layer import load_request
+from geometry import choropleth_geometry
 import streamlit_shadcn_ui as ui
 # import geopandas as gpd
-import re
 
 # Set Streamlit page configuration
 st.set_page_config(
@@ -15,31 +16,40 @@ st.set_page_config(
 
 # ***************************************Data Access*******************************
 
-# Create a function to load data from the SQLite database
-def load_data_from_db(query):
-    sqlite_file = 'test.sqlite'
-    # Use a context manager to ensure proper resource management
-    with create_engine(f'sqlite:///{sqlite_file}').connect() as engine:
-        df = pd.read_sql(query, engine)
-    return df
+# What each tab shows: the fact table behind it, and the per-state measures
+# its map is coloured by. load_request answers them from the smallest
+# rollup that can, or from the fact table when the filters need it.
+# Registered users are a running total, so the user maps show them as of
+# the latest quarter selected.
+TAB_REQUESTS = {
+    'Transaction Data': {'table': 'map_transaction_hover_counry', 'dimensions': ['state'],
+                         'measures': ['sum(total_transactions_amount)', 'sum(total_transactions_count)']},
+    'Transaction State Data': {'table': 'map_transaction_hover_state', 'dimensions': ['state'],
+                               'measures': ['sum(total_transactions_amount)', 'sum(total_transactions_count)']},
+    'Insurance Data': {'table': 'map_insurence_hover_counry', 'dimensions': ['state'],
+                       'measures': ['sum(total_transactions_amount)', 'sum(total_transactions_count)']},
+    'Insurance State Data': {'table': 'map_insurence_hover_state', 'dimensions': ['state'],
+                             'measures': ['sum(total_transactions_amount)', 'sum(total_transactions_count)']},
+    'User Country Data': {'table': 'map_user_hover_contry', 'dimensions': ['state'],
+                          'measures': ['latest(registered_users)']},
+    'User State Data': {'table': 'map_user_hover_state', 'dimensions': ['state'],
+                        'measures': ['latest(registered_users)']},
+}
 
 def select_the_table(selected_tab):
-    # Execute different queries based on the chosen tab
-    tables = {
-        'Transaction Data': 'map_transaction_hover_counry',
-        'Transaction State Data': 'map_transaction_hover_state',
-        'Insurance Data': 'map_insurence_hover_counry',
-        'Insurance State Data': 'map_insurence_hover_state',
-        'User Country Data': 'map_user_hover_contry',
-        'User State Data': 'map_user_hover_state'
-    }
-    return tables.get(selected_tab, None)
+    # Fact table of the chosen tab
+    request = TAB_REQUESTS.get(selected_tab)
+    return None if request is None else request['table']
 
 
 def plot_map_chart(data, selected_tab):
-    geojson_url = "https://gist.githubusercontent.com/jbrobst/56c13bbbf9d97d187fea01ca62ea5112/raw/e388c4cae20aa53cb5090210a42ebb9b765c0a36/india_states.geojson"
-    featureidkey = 'properties.ST_NM'
-    locations_column = 'state'
+    # State polygons from the local geometry store, served once to the browser
+    try:
+        geojson, featureidkey = choropleth_geometry()
+    except FileNotFoundError as e:
+        st.error(e)
+        return
+    locations_column = 'geojson_name'
     
     if 'User' in selected_tab:
         color_column = 'registered_users'
@@ -52,7 +62,7 @@ def plot_map_chart(data, selected_tab):
 
     fig = px.choropleth(
         data,
-        geojson=geojson_url,
+        geojson=geojson,
         featureidkey=featureidkey,
         locations=locations_column,
         color=color_column,
@@ -93,13 +103,6 @@ chosen_table = select_the_table(selected_tab)
 if chosen_table is None:
     st.warning("Please select a valid table.")
 else:
-    df = load_data_from_db(f'SELECT * FROM {chosen_table}')
-    
-
-    # Replace hyphens with spaces and title-case the elements in the 'state' column
-    df['state'] = df['state'].apply(lambda x: x.replace('-', ' ').title())
-
-
     filtered_df = None
 
     container = st.container(border=True)
@@ -109,17 +112,29 @@ else:
         col3, col4, col5, col6 = container.columns(4)
 
         # Sidebar input widgets
-        selected_years = col3.multiselect('Select Year:', sorted(df['year'].unique()), default=2022,
+        year_options, quarter_options = load_year_quarter_options(chosen_table)
+        selected_years = col3.multiselect('Select Year:', year_options, default=2022,
                                           help='Select the Year')
-        selected_quarters = col4.multiselect('Select Quarter:', sorted(df['quarter'].unique()), default=[1, 2])
-        selected_state = col5.multiselect('Select State/UT:', sorted(df['state'].unique()), default=['Karnataka'])
-
-        # Filter the DataFrame based on user inputs
-        filtered_df = df[(df['state'].isin(selected_state)) & (df['year'].isin(selected_years)) & (
-                df['quarter'].isin(selected_quarters))]
+        selected_quarters = col4.multiselect('Select Quarter:', quarter_options, default=[1, 2])
+
+        selected_state = col5.multiselect('Select State/UT:', load_distinct_values(chosen_table, 'state'),
+                                          default=['Karnataka'])
+
+        # Only the rows of the selected states, years and quarters are loaded
+        map_filters = {'year': selected_years, 'quarter': selected_quarters, 'state': selected_state}
+        filtered_df = load_filtered(chosen_table, map_filters)
+        # A quarter selection covering every quarter does not filter, so the
+        # per-state totals can come from a rollup
+        if sorted(selected_quarters) == sorted(quarter_options):
+            map_filters['quarter'] = None
     else:
         # If 'filter data' is not selected
-        filtered_df = df
+        filtered_df = load_table(chosen_table)
+        map_filters = None
+
+    # One row per state, summed over the selected years and quarters (users
+    # as of the latest one), keyed by the geojson's state names
+    map_df = with_geojson_names(load_request(TAB_REQUESTS[selected_tab], filters=map_filters))
     
     ui.table(data=filtered_df.head(), maxHeight=500, key="filtered_data_table")
     # # Create main container
@@ -127,7 +142,7 @@ else:
     # with main_box:
     # Display the filtered DataFrame
     # st.write(f"Displaying Chart for {selected_tab} table:")
-    plot_map_chart(filtered_df,selected_tab)
+    plot_map_chart(map_df,selected_tab)
 
     # with col3:
     #     st.write(f"Displaying data from {selected_tab} table:")
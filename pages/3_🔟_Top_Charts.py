@@ -1,7 +1,9 @@
 import plotly.express as px
 import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
+from data_access import (load_table, load_filtered, load_table_columns, load_distinct_values,
+                         load_year_quarter_options, table_exists)
+from semantic_layer import load_request
+from top_requests import TOP_REQUESTS
 import streamlit_shadcn_ui as ui
 
 # Set Streamlit page configuration
@@ -15,25 +17,15 @@ st.set_page_config(
 st.markdown('**Top charts**')
 
 # ***************************************Data Access*******************************
-# Create a function to load data from the SQLite database
-def load_data_from_db(query):
-    sqlite_file = 'test.sqlite'
-    engine = create_engine(f'sqlite:///{sqlite_file}')
-    df = pd.read_sql(query, engine)
-    return df
+
+# One tab per top table, shared with the Dash Board
+TAB_REQUESTS = TOP_REQUESTS
 
 
 def select_the_table(selected_tab):
-    # Execute different queries based on the chosen tab
-    table_queries = {
-        'Transaction Data': 'SELECT * FROM top_transaction_country;',
-        'Insurance Data': 'SELECT * FROM top_insurence_country;',
-        'User Data': 'SELECT * FROM top_user_country;',
-        'Statewise Transaction Data': 'SELECT * FROM top_transaction_state;',
-        'Statewise Insurance Data': 'SELECT * FROM top_insurance_state;',
-        'Statewise User Data': 'SELECT * FROM top_user_state;'
-    }
-    return table_queries.get(selected_tab, None)
+    # Fact table of the chosen tab
+    request = TAB_REQUESTS.get(selected_tab)
+    return None if request is None else request['table']
 
 
 def plot_barchart_top(df, x, y, title):
@@ -45,8 +37,12 @@ def plot_barchart_top(df, x, y, title):
         orientation='h',
         color="entity_name",
         labels={'amount': 'Amount', 'count': 'Transactions'},
+        facet_col='entity_type',
         title=title,
     )
+    # One panel per entity type, each ranking only its own entities
+    fig.update_yaxes(matches=None, showticklabels=True)
+    fig.update_xaxes(matches=None)
     # Show the plot using Plotly chart in Streamlit
     st.plotly_chart(fig, theme="streamlit", use_container_width=True)
 
@@ -57,10 +53,10 @@ col1, col2 = first_box.columns([6, 1])
 
 with col1:
     # Create tabs
+    # Only the tabs whose table the database has
     selected_tab = ui.tabs(
-        options=['Transaction Data', 'Insurance Data', 'User Data', 'Statewise Transaction Data',
-                 'Statewise Insurance Data', 'Statewise User Data'], default_value= 'Transaction Data',
-        key="kanaries")
+        options=[tab for tab, request in TAB_REQUESTS.items() if table_exists(request['table'])],
+        default_value= 'Transaction Data', key="kanaries")
 with col2:
     filter_data = st.toggle('Filter Data')
 
@@ -68,7 +64,6 @@ chosen_table = select_the_table(selected_tab)
 if chosen_table is None:
     st.warning("Please select a valid table.")
 else:
-    df = load_data_from_db(chosen_table)
     filtered_df = None
 
     filter_box = st.container(border=True)
@@ -77,30 +72,32 @@ else:
         col3, col4, col5, col6 = filter_box.columns(4)
 
         # Sidebar input widgets
-        selected_years = col3.multiselect('Select Year:', sorted(df['year'].unique()), default=2022,
+        year_options, quarter_options = load_year_quarter_options(chosen_table)
+        selected_years = col3.multiselect('Select Year:', year_options, default=2022,
                                           help='Select the Year')
-        selected_quarters = col4.multiselect('Select Quarter:', sorted(df['quarter'].unique()), default=[1, 2, 3, 4])
-
-        # Check if 'state' is a column in the DataFrame
-        if 'state' in df.columns:
-            selected_state = col5.multiselect('Select State/UT:', sorted(df['state'].unique()), default=['karnataka'])
-            entity_type = col6.selectbox('Select Entity Type:', sorted(df['entity_type'].unique()))
-
-            # Filter the DataFrame based on user inputs
-            filtered_df = df[(df['state'].isin(selected_state)) & (df['year'].isin(selected_years)) & (
-                        df['quarter'].isin(selected_quarters)) & (df['entity_type'] == entity_type)]
+        selected_quarters = col4.multiselect('Select Quarter:', quarter_options, default=[1, 2, 3, 4])
+        filters = {'year': selected_years, 'quarter': selected_quarters}
+
+        # Check if 'state' is a column in the table
+        if 'state' in load_table_columns(chosen_table):
+            filters['state'] = col5.multiselect('Select State/UT:', load_distinct_values(chosen_table, 'state'),
+                                                default=['Karnataka'])
+            entity_type = col6.selectbox('Select Entity Type:', load_distinct_values(chosen_table, 'entity_type'))
         else:
-            entity_type = col5.selectbox('Select Entity Type:', sorted(df['entity_type'].unique()))
+            entity_type = col5.selectbox('Select Entity Type:', load_distinct_values(chosen_table, 'entity_type'))
+        filters['entity_type'] = [entity_type]
 
-            # Filter the DataFrame based on user inputs
-            filtered_df = df[(df['year'].isin(selected_years)) & (df['quarter'].isin(selected_quarters)) & (
-                        df['entity_type'] == entity_type)]
+        # Only the rows matching the selections are loaded
+        filtered_df = load_filtered(chosen_table, filters)
+        chart_df = load_request(TAB_REQUESTS[selected_tab], filters=filters)
 
         # Show filtered data using an expander
         with st.expander('Show Filtered Full Data'):
             st.dataframe(filtered_df, use_container_width=True)
 
     else:
+        df = load_table(chosen_table)
+        chart_df = load_request(TAB_REQUESTS[selected_tab])
         with st.expander('Show Full Data'):
             st.dataframe(df, use_container_width=True)
 
@@ -120,7 +117,7 @@ else:
     with charts_col:
         # Plotly bar chart
         # Check if 'registeredUsers' column exists in the DataFrame
-        y_column = 'registeredUsers' if 'registeredUsers' in data.columns else 'amount'
-        plot_barchart_top(data, 'entity_name', y_column, f'Top {selected_tab} Graph')
+        y_column = 'registeredUsers' if 'registeredUsers' in chart_df.columns else 'amount'
+        plot_barchart_top(chart_df, 'entity_name', y_column, f'Top {selected_tab} Graph')
 
 # ****************************************Data Visualisation****************************
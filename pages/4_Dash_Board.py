@@ -1,10 +1,8 @@
 import streamlit as st
 import plotly.express as px
-import streamlit as st
-import pandas as pd
-from sqlalchemy import create_engine
-import streamlit_shadcn_ui as ui
-import extra_streamlit_components as stx
+from data_access import load_table, table_exists
+from semantic_layer import load_request
+from top_requests import TOP_REQUESTS, TOP_ENTITY_TYPES
 
 # Set Streamlit page configuration
 st.set_page_config(
@@ -14,29 +12,15 @@ st.set_page_config(
     page_icon=":graph:",
 )
 #***************************************Data Access*******************************
-# Create a function to load data from the SQLite database
-def load_data_from_db(query):
-    sqlite_file = 'test.sqlite'
-    engine = create_engine(f'sqlite:///{sqlite_file}')
-    df = pd.read_sql(query, engine)
-    return df
+
+
+# One tab per top table, shared with the Top Charts page
+TAB_REQUESTS = TOP_REQUESTS
 
 
 def select_the_table(selected_tab):
-    # Execute different queries based on the chosen tab
-    if selected_tab == 'Transaction Data':
-        query = 'SELECT * FROM top_transaction_country;'
-    elif selected_tab == 'Insurance Data':
-        query = 'SELECT * FROM top_insurence_country;'
-    elif selected_tab == 'User Data':
-        query = 'SELECT * FROM top_user_country;'
-    elif selected_tab == 'Statewise Transaction Data':
-        query = 'SELECT * FROM top_transaction_state;'
-    elif selected_tab == 'Statewise Insurance Data':
-        query = 'SELECT * FROM top_insurance_state;'
-    elif selected_tab == 'Statewise User Data':
-        query = 'SELECT * FROM top_user_state;'
-    return query
+    # Request of the chosen chart
+    return TAB_REQUESTS[selected_tab]
 
 
 #***********************************plots*********************************************
@@ -50,8 +34,12 @@ def plot_barchart_top(df, x, y, title):
         orientation='h',
         color="entity_name",
         labels={'amount': 'Amount', 'count': 'Transactions', 'quarter': 'Quar'},
+        facet_col='entity_type',
         title=title,
     )
+    # One panel per entity type, each ranking only its own entities
+    fig.update_yaxes(matches=None, showticklabels=True)
+    fig.update_xaxes(matches=None)
     # Show the plot using Plotly chart in Streamlit
     st.plotly_chart(fig, theme="streamlit", use_container_width=True)
 
@@ -68,12 +56,18 @@ def main():
     # Create container for choices
     choice_box = st.container(border=True)
     with choice_box:
+        # Only the charts whose table the database has
         selected_tab = st.selectbox(label='Choice of chart',
-                                    options=['Transaction Data', 'Insurance Data', 'User Data',
-                                                'Statewise Transaction Data', 'Statewise Insurance Data',
-                                                'Statewise User Data'])
-    choosen_table = select_the_table(selected_tab)
-    df = load_data_from_db(choosen_table)
+                                    options=[tab for tab, request in TAB_REQUESTS.items()
+                                             if table_exists(request['table'])])
+    request = select_the_table(selected_tab)
+    df = load_table(request['table'])
+    chart_df = load_request(request)
+    # Totals of the broadest entity type the table ranks: adding up every
+    # type would count the same transactions once per type
+    type_totals = load_request(request, dimensions=['entity_type']).set_index('entity_type')
+    entity_type = next(entity_type for entity_type in TOP_ENTITY_TYPES if entity_type in type_totals.index)
+    totals = type_totals.loc[entity_type]
 
     # Create container for info box
     info_box = st.container()
@@ -100,10 +94,10 @@ def main():
         with container3:
             # Plotly bar chart
             # Check if 'registeredUsers' column exists in the DataFrame
-            if 'registeredUsers' in df.columns:
-                plot_barchart_top(df, 'entity_name', 'registeredUsers', f'Top {selected_tab} Chart')
+            if 'registeredUsers' in chart_df.columns:
+                plot_barchart_top(chart_df, 'entity_name', 'registeredUsers', f'Top {selected_tab} Chart')
             else:
-                plot_barchart_top(df, 'entity_name', 'amount', f'Top {selected_tab} Chart')
+                plot_barchart_top(chart_df, 'entity_name', 'amount', f'Top {selected_tab} Chart')
 
     # info_box = st.container(border=True)
     col5, col6 = info_box.columns([1, 1])
@@ -112,15 +106,17 @@ def main():
         container1 = st.container(border=True)
         with container1:
             if 'User' in selected_tab:
-                total_users = df.registeredUsers.sum()
-                st.metric(f"Total Users", f"{total_users}", "Year on year")
+                total_users = int(totals['registeredUsers'])
+                st.metric(f"Total Users, top {entity_type}", f"{total_users:,}", "Year on year")
             else:
-                st.metric(f"{selected_tab} Amount", f"₹{df.amount.sum()}", "Year on year")
+                st.metric(f"{selected_tab} Amount, top {entity_type}", f"₹{totals['amount']:,.2f}", "Year on year")
                 
     with col6:
         container3 = st.container(border=True)
         with container3:
-            st.metric(f"{selected_tab} Counts", f"{df['count'].sum()}", "Year on year")    
+            # The user tables have no transaction count
+            if 'count' in totals:
+                st.metric(f"{selected_tab} Counts, top {entity_type}", f"{int(totals['count']):,}", "Year on year")
 
 
 # Run the main script
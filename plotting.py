@@ -0,0 +1,113 @@
+import threading
+import plotly.express as px
+import plotly.io as pio
+import plotly.graph_objects as go
+from pandas.api.types import is_numeric_dtype
+from data_access import load_hierarchy
+
+# Plotting helpers for the pages. Plotly draws one mark per row it is given
+# and ships every row to the browser, so a bar chart of the fact table by
+# state sent thousands of stacked segments where 36 bars were meant.
+# plot_at_grain aggregates a frame to the exact grain a chart draws before
+# Plotly Express sees it, and scatter_chart switches to WebGL when a scatter
+# has too many points for SVG. hierarchy_chart draws treemaps and sunbursts
+# from the node tables the ingest precomputes. Every figure they return has
+# the size of the JSON the browser is sent for it recorded, by title, for
+# figure_payload_stats.
+
+# Numeric columns that are dimensions, not measures
+TIME_COLUMNS = ('year', 'quarter')
+
+# Arguments of the px functions that name columns of the frame
+COLUMN_ARGUMENTS = ('x', 'y', 'color', 'symbol', 'line_dash', 'line_group', 'facet_col', 'facet_row', 'names',
+                    'values', 'size', 'text', 'locations', 'hover_name', 'animation_frame')
+COLUMN_LIST_ARGUMENTS = ('path', 'hover_data')
+
+# Scatter plots with more points than this are drawn with WebGL (scattergl)
+WEBGL_POINTS = 1000
+
+# Hierarchy chart kind -> (Plotly Express function, graph object trace)
+HIERARCHY_CHARTS = {'treemap': (px.treemap, go.Treemap), 'sunburst': (px.sunburst, go.Sunburst)}
+
+# figure title -> (bytes of its JSON, marks drawn), as last built
+_payload_state = {}
+_payload_lock = threading.Lock()
+
+
+def is_dimension(df, column):
+    return column in TIME_COLUMNS or not is_numeric_dtype(df[column])
+
+
+def chart_columns(kwargs):
+    # The frame's columns a px call names, in argument order
+    columns = [kwargs[argument] for argument in COLUMN_ARGUMENTS if isinstance(kwargs.get(argument), str)]
+    for argument in COLUMN_LIST_ARGUMENTS:
+        columns += [column for column in kwargs.get(argument) or [] if isinstance(column, str)]
+    return list(dict.fromkeys(columns))
+
+
+def aggregate_to_grain(df, grain, values, how='sum'):
+    # One row per combination of the grain columns that occurs, in the order
+    # the rows first appear, with the value columns aggregated
+    if not grain:
+        return df[values].agg(how).to_frame().T
+    return df.groupby(grain, observed=True, sort=False, as_index=False)[values].agg(how)
+
+
+def trace_marks(trace):
+    # Bars, points, sectors or regions a trace draws
+    for attribute in ('ids', 'locations', 'x', 'y', 'labels'):
+        values = getattr(trace, attribute, None)
+        if values is not None:
+            return len(values)
+    return 0
+
+
+def recorded_figure(fig):
+    # fig, once the size of its JSON and the number of marks it draws are
+    # recorded under its title
+    name = fig.layout.title.text or (fig.data[0].type if fig.data else 'figure')
+    size = len(pio.to_json(fig, validate=False))
+    marks = sum(trace_marks(trace) for trace in fig.data)
+    with _payload_lock:
+        _payload_state[name] = (size, marks)
+    return fig
+
+
+def figure_payload_stats():
+    # {figure title: {'bytes': ..., 'marks': ...}} of every figure built
+    with _payload_lock:
+        return {name: {'bytes': size, 'marks': marks} for name, (size, marks) in _payload_state.items()}
+
+
+def plot_at_grain(chart, df, how='sum', **kwargs):
+    # chart (a px function) drawn from df aggregated to the dimensions its
+    # arguments name, with the measures it names summed
+    columns = [column for column in chart_columns(kwargs) if column in df.columns]
+    grain = [column for column in columns if is_dimension(df, column)]
+    values = [column for column in columns if column not in grain]
+    return recorded_figure(chart(aggregate_to_grain(df, grain, values, how), **kwargs))
+
+
+def scatter_chart(df, **kwargs):
+    # px.scatter, in WebGL past WEBGL_POINTS points over all of its traces
+    render_mode = 'webgl' if len(df) > WEBGL_POINTS else 'svg'
+    return recorded_figure(px.scatter(df, render_mode=render_mode, **kwargs))
+
+
+def hierarchy_chart(kind, table_name, filters, df, path, values, title=None, labels=None):
+    # A 'treemap' or 'sunburst' of values along path, built as a graph object
+    # straight from the table's node table. Falls back to Plotly Express over
+    # df (the table's rows under filters) when the node table cannot answer.
+    labels = labels or {}
+    px_chart, trace = HIERARCHY_CHARTS[kind]
+    hierarchy = load_hierarchy(table_name, path, filters)
+    if hierarchy is None:
+        return plot_at_grain(px_chart, df, path=path, values=values, title=title, labels=labels)
+
+    nodes, branchvalues = hierarchy
+    fig = go.Figure(trace(ids=nodes['id'], parents=nodes['parent'], labels=nodes['label'], values=nodes[values],
+                          branchvalues=branchvalues,
+                          hovertemplate=f'%{{label}}<br>{labels.get(values, values)}=%{{value}}<extra></extra>'))
+    fig.update_layout(title=title)
+    return recorded_figure(fig)
@@ -0,0 +1,133 @@
+import re
+from data_access import load_data_from_db, compile_filter_conditions
+from extraction.rollups import ROLLUP_CATALOG_TABLE
+
+# Aggregate queries for the pages: a page asks for measures of a fact table
+# by some dimensions under a filter spec, e.g.
+#   load_measures('aggregated_insurence_state', ['sum(total_amount)'], ['state', 'year'],
+#                 {'year': [2022]})
+# and gets one row per dimension value. The query runs on the smallest
+# rollup in the rollup catalog that answers it exactly, or on the fact table
+# when none does.
+#
+# Measures: 'sum(<column>)' (a bare column name means the same) and
+# 'count(*)', the number of fact rows, returned as row_count. Rollups only
+# hold sums, so 'min', 'max' and 'avg' always read the fact table.
+# 'latest(<column>)' is for point-in-time counts such as registered users,
+# which must not be summed over quarters: the column summed over the rows of
+# the latest quarter in the selection (per year or quarter when those are
+# dimensions). It also reads the fact table.
+
+MEASURE_PATTERN = re.compile(r'^\s*(sum|count|min|max|avg|latest)\s*\(\s*(\*|\w+)\s*\)\s*$', re.IGNORECASE)
+
+# Orders the quarters of the selection, for the latest() measures
+TIME_COLUMNS = ('year', 'quarter')
+PERIOD_SQL = 'year * 10 + quarter'
+
+
+def parse_measure(measure):
+    # (function, column) of a measure, e.g. ('sum', 'total_amount') or ('count', '*')
+    match = MEASURE_PATTERN.match(measure)
+    if match is None:
+        return 'sum', measure.strip()
+    return match.group(1).lower(), match.group(2)
+
+
+def measure_column(function, column):
+    # Output column of a measure: the measured column, or row_count for count(*)
+    return 'row_count' if function == 'count' else column
+
+
+def load_rollup_catalog():
+    # [{'rollup_table', 'source_table', 'grain', 'group_columns', 'measures', 'row_count'}],
+    # empty for a database built before the rollups existed
+    try:
+        catalog = load_data_from_db(f'SELECT * FROM {ROLLUP_CATALOG_TABLE}')
+    except Exception:
+        return []
+
+    entries = catalog.to_dict('records')
+    for entry in entries:
+        entry['group_columns'] = entry['group_columns'].split(',')
+        entry['measures'] = entry['measures'].split(',')
+    return entries
+
+
+def choose_source(table_name, measures, dimensions, filters=None):
+    # The smallest rollup of table_name holding every dimension, every filtered
+    # column and every measure, or None when only the fact table can answer
+    parsed_measures = [parse_measure(measure) for measure in measures]
+    if any(function not in ('sum', 'count') for function, column in parsed_measures):
+        return None
+
+    needed_columns = set(dimensions) | {column for column, values in (filters or {}).items() if values is not None}
+    summed_columns = {column for function, column in parsed_measures if function == 'sum'}
+
+    candidates = [entry for entry in load_rollup_catalog()
+                  if entry['source_table'] == table_name
+                  and needed_columns <= set(entry['group_columns'])
+                  and summed_columns <= set(entry['measures'])]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda entry: entry['row_count'])
+
+
+def latest_selection_sql(table_name, where_clause, dimensions, only_latest):
+    # The selected rows with their quarter (_period) and the latest quarter
+    # of the selection (_latest_period), per year or quarter when those are
+    # dimensions. only_latest keeps just the rows of the latest quarter.
+    partition_list = ', '.join(f'"{dimension}"' for dimension in dimensions if dimension in TIME_COLUMNS)
+    window = f'PARTITION BY {partition_list}' if partition_list else ''
+    sql = (f'(SELECT *, {PERIOD_SQL} AS _period, MAX({PERIOD_SQL}) OVER ({window}) AS _latest_period '
+           f'FROM {table_name}{where_clause}) AS selection')
+    if only_latest:
+        sql += ' WHERE _period = _latest_period'
+    return sql
+
+
+def plan_measures(table_name, measures, dimensions=(), filters=None):
+    # (source table, query, params) answering the request. On a rollup the
+    # sums are summed again, which is exact because sums add up.
+    dimensions = list(dimensions)
+    parsed_measures = [parse_measure(measure) for measure in measures]
+    rollup = choose_source(table_name, measures, dimensions, filters)
+    source_table = table_name if rollup is None else rollup['rollup_table']
+
+    select_list = [f'"{dimension}"' for dimension in dimensions]
+    for function, column in parsed_measures:
+        output_column = measure_column(function, column)
+        if rollup is not None:
+            select_list.append(f'SUM("{output_column}") AS "{output_column}"')
+        elif function == 'count':
+            select_list.append('COUNT(*) AS row_count')
+        elif function == 'latest':
+            select_list.append(f'SUM(CASE WHEN _period = _latest_period THEN "{column}" END) AS "{column}"')
+        else:
+            select_list.append(f'{function.upper()}("{column}") AS "{column}"')
+
+    where_clause, params = compile_filter_conditions(filters)
+    latest_functions = [function == 'latest' for function, column in parsed_measures]
+    if any(latest_functions):
+        # Only the groups with rows in the latest quarter, unless other measures need every row
+        source_sql = latest_selection_sql(source_table, where_clause, dimensions, all(latest_functions))
+    else:
+        source_sql = f'{source_table}{where_clause}'
+    query = f'SELECT {", ".join(select_list)} FROM {source_sql}'
+    if dimensions:
+        dimension_list = ', '.join(f'"{dimension}"' for dimension in dimensions)
+        query += f' GROUP BY {dimension_list} ORDER BY {dimension_list}'
+    return source_table, query, params
+
+
+def load_measures(table_name, measures, dimensions=(), filters=None):
+    # Measures of a fact table by dimensions, from the cheapest source that answers exactly
+    source_table, query, params = plan_measures(table_name, measures, dimensions, filters)
+    return load_data_from_db(query, params)
+
+
+def load_request(request, dimensions=None, filters=None):
+    # Measures of a declarative page request {'table': ..., 'measures': [...], 'dimensions': [...]};
+    # the page can override the request's dimensions
+    if dimensions is None:
+        dimensions = request.get('dimensions', ())
+    return load_measures(request['table'], request['measures'], dimensions, filters)
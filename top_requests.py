@@ -0,0 +1,23 @@
+# Requests of the Top Charts and Dash Board pages: per chart, the top table
+# behind it and the per-entity totals its bar chart and metrics are computed
+# from. The top tables are not rolled up, so load_request sums them on the
+# fact table. They rank states, districts and pincodes side by side, so the
+# totals are kept apart per entity type, and registered users, a running
+# total, are taken as of the latest quarter.
+TOP_REQUESTS = {
+    'Transaction Data': {'table': 'top_transaction_country', 'dimensions': ['entity_type', 'entity_name'],
+                         'measures': ['sum(amount)', 'sum(count)']},
+    'Insurance Data': {'table': 'top_insurence_country', 'dimensions': ['entity_type', 'entity_name'],
+                       'measures': ['sum(amount)', 'sum(count)']},
+    'User Data': {'table': 'top_user_country', 'dimensions': ['entity_type', 'entity_name'],
+                  'measures': ['latest(registeredUsers)']},
+    'Statewise Transaction Data': {'table': 'top_transaction_state', 'dimensions': ['entity_type', 'entity_name'],
+                                   'measures': ['sum(amount)', 'sum(count)']},
+    'Statewise Insurance Data': {'table': 'top_insurance_state', 'dimensions': ['entity_type', 'entity_name'],
+                                 'measures': ['sum(amount)', 'sum(count)']},
+    'Statewise User Data': {'table': 'top_user_state', 'dimensions': ['entity_type', 'entity_name'],
+                            'measures': ['latest(registeredUsers)']},
+}
+
+# Entity types of the top tables, broadest first
+TOP_ENTITY_TYPES = ['states', 'districts', 'pincodes']